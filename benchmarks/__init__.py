@@ -0,0 +1,16 @@
+"""Micro-benchmarks for the protocol hot paths
+
+Run the suite with
+
+    python -m benchmarks
+
+which times each case, prints a table and compares it with the tracked
+baseline in benchmarks/baseline.json, exiting with status 1 if any case is
+slower than the baseline by more than the tolerance. Times are compared
+relative to a pure Python calibration loop timed in the same run, so a
+baseline saved on one machine is a usable guide on another. Use --json for
+comparable results and --save-baseline after an intended change.
+
+The soak module runs a whole network against an emulated bus for fleet level
+throughput, staleness and write latency, see python -m benchmarks.soak --help.
+"""
@@ -0,0 +1,60 @@
+"""Runs the benchmark suite, prints results and compares them with the baseline"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import logging
+import argparse
+
+from .cases import CASES
+from .runner import run_cases, compare, load_results, save_results
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def main(argv=None):
+    """Run benchmarks, returns exit status 1 if any case regressed"""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('names', nargs='*', help='only run cases containing any of these names')
+    parser.add_argument('--repeat', type=int, default=5, help='repeats of each case, the best is used')
+    parser.add_argument('--min-time', type=float, default=0.1, help='minimum seconds for each repeat')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='fraction slower than the baseline counted as a regression')
+    parser.add_argument('--output', help='write results as JSON to file')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--save-baseline', action='store_true', help='write results as the new baseline')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('heatmisercontroller').setLevel(logging.WARNING)
+    cases = [(name, setup) for name, setup in CASES if not args.names or any(part in name for part in args.names)]
+    results = run_cases(cases, args.repeat, args.min_time)
+    if args.output:
+        save_results(results, args.output)
+    if args.save_baseline:
+        save_results(results, args.baseline)
+
+    comparison = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        comparison = compare(results, load_results(args.baseline), args.tolerance)
+    regressed = [name for name, _, _, _, isregressed in comparison if isregressed]
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print("")
+    else:
+        ratios = {name: ratio for name, _, _, ratio, _ in comparison}
+        print("Python %s %s, calibration %.2f us" %(results['implementation'], results['python'],
+                                                    results['calibration'] * 1e6))
+        print("%-38s %12s %10s %10s" %('Case', 'us/call', 'relative', 'baseline'))
+        for name, result in results['benchmarks'].items():
+            ratiotext = "%9.2fx" % ratios[name] if name in ratios else "%10s" % '-'
+            print("%-38s %12.3f %10.3f %s%s" %(name, result['seconds'] * 1e6, result['relative'], ratiotext,
+                                                ' REGRESSED' if name in regressed else ''))
+    if regressed:
+        sys.stderr.write("%i cases slower than baseline by more than %i%%: %s\n" %(
+                            len(regressed), args.tolerance * 100, ', '.join(regressed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
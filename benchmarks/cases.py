@@ -0,0 +1,146 @@
+"""Benchmark cases for framing, payload processing, read and write planning,
+observer dispatch and schedules
+
+Each case is a setup function returning the function to time, registered in
+CASES in the order they are reported.
+"""
+from __future__ import absolute_import
+
+from heatmisercontroller import framing
+from heatmisercontroller.emulator import VirtualStat
+from heatmisercontroller.genericdevice import DEVICETYPES
+from heatmisercontroller.hm_constants import HMV3_ID, FUNC_READ, FUNC_WRITE, RW_LENGTH_ALL, DCB_START
+from heatmisercontroller.hm_constants import MIN_FRAME_READ_RESP_LENGTH
+
+CASES = []
+
+MASTER_ADDR = 129
+STAT_ADDR = 1
+STARTTIME = 1600000000.0
+#fields read on a typical poll, all heating schedules and the values written when changing mode
+POLL_FIELDS = ['airtemp', 'heatingdemand', 'setroomtemp', 'runmode', 'tempholdmins', 'currenttime']
+SCHEDULE_FIELDS = ['wday_heat', 'wend_heat', 'mon_heat', 'tues_heat', 'wed_heat', 'thurs_heat',
+                    'fri_heat', 'sat_heat', 'sun_heat']
+WRITE_FIELDS = ['setroomtemp', 'frosttemp', 'holidayhours', 'tempholdmins', 'wday_heat']
+WRITE_VALUES = [21, 12, 0, 30, [7, 0, 21, 9, 0, 16, 17, 0, 21, 22, 0, 16]]
+#mid morning, so the schedule has a current item today, and before the first item of the day
+MID_MORNING = [3, 10, 30, 0]
+EARLY_MORNING = [3, 5, 0, 0]
+
+def case(name):
+    """Decorator registering setup function as a case"""
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+def _device(prog_mode='day'):
+    """Returns prt_e device, with no adaptor, holding a full DCB from an emulated stat"""
+    device = DEVICETYPES['prt_e_model'][prog_mode](None, {'address': STAT_ADDR, 'expected_model': 'prt_e_model',
+                                                            'expected_prog_mode': prog_mode})
+    device.lastreadtime = STARTTIME
+    device._procpayload(_dcb(prog_mode)) #pylint: disable=protected-access
+    return device
+
+def _dcb(prog_mode='day'):
+    """Returns full DCB payload of an emulated stat as a list"""
+    return list(bytearray(VirtualStat(STAT_ADDR, prog_mode=prog_mode, starttime=STARTTIME)
+                            .read(DCB_START, RW_LENGTH_ALL, STARTTIME)))
+
+def _read_response(payload):
+    """Returns read response frame from the stat for payload"""
+    length = MIN_FRAME_READ_RESP_LENGTH + len(payload)
+    frame = [MASTER_ADDR, length & 0xff, length >> 8, STAT_ADDR, FUNC_READ,
+                DCB_START & 0xff, DCB_START >> 8, len(payload) & 0xff, len(payload) >> 8] + payload
+    return frame + framing.Crc16().run(frame)
+
+@case('crc16.run_request')
+def _crc_request():
+    message = [STAT_ADDR, 10, MASTER_ADDR, FUNC_READ, 0, 0, 0xff, 0xff]
+    return lambda: framing.Crc16().run(message)
+
+@case('crc16.run_full_response')
+def _crc_full_response():
+    message = _read_response(_dcb())[:-2]
+    return lambda: framing.Crc16().run(message)
+
+@case('framing.form_frame_read')
+def _form_frame_read():
+    return lambda: framing.form_frame(STAT_ADDR, HMV3_ID, MASTER_ADDR, FUNC_READ, DCB_START, RW_LENGTH_ALL, [])
+
+@case('framing.form_frame_write')
+def _form_frame_write():
+    payload = [7, 0, 21, 9, 0, 16, 17, 0, 21, 22, 0, 16]
+    return lambda: framing.form_frame(STAT_ADDR, HMV3_ID, MASTER_ADDR, FUNC_WRITE, 47, len(payload), payload)
+
+@case('framing.verify_response_full_dcb')
+def _verify_response():
+    frame = _read_response(_dcb())
+    return lambda: framing.verify_response(HMV3_ID, STAT_ADDR, MASTER_ADDR, FUNC_READ, RW_LENGTH_ALL, frame)
+
+@case('device.procpayload_full_dcb')
+def _procpayload():
+    device = _device()
+    payload = _dcb()
+    return lambda: device._procpayload(payload) #pylint: disable=protected-access
+
+def _field_blocks(fieldnames):
+    """Returns function planning the blocks to read fieldnames"""
+    device = _device()
+    fieldids = [device._fieldnametonum[name] for name in fieldnames] #pylint: disable=protected-access
+    return lambda: device._get_field_blocks_from_id_list(fieldids) #pylint: disable=protected-access
+
+@case('device.field_blocks_poll')
+def _field_blocks_poll():
+    return _field_blocks(POLL_FIELDS)
+
+@case('device.field_blocks_schedules')
+def _field_blocks_schedules():
+    return _field_blocks(SCHEDULE_FIELDS)
+
+@case('device.field_blocks_all')
+def _field_blocks_all():
+    return _field_blocks([field.name for field in _device().fields])
+
+@case('device.payload_blocks_set_fields')
+def _payload_blocks():
+    device = _device()
+    fields = [getattr(device, name) for name in WRITE_FIELDS]
+    return lambda: device._get_payload_blocks_from_list(fields, WRITE_VALUES) #pylint: disable=protected-access
+
+@case('observer.dispatch_changed')
+def _dispatch_changed():
+    device = _device()
+    field = device.setroomtemp
+    values = [20, 21]
+    def dispatch():
+        """Update value twice, so each update notifies the observers"""
+        for value in values:
+            field.update_value(value, STARTTIME)
+    return dispatch
+
+@case('observer.dispatch_is')
+def _dispatch_is():
+    device = _device()
+    field = device.tempholdmins
+    values = [0, 30]
+    def dispatch():
+        """Update value twice, so each update notifies the observers"""
+        for value in values:
+            field.update_value(value, STARTTIME)
+    return dispatch
+
+@case('schedule.current_item_day')
+def _schedule_day():
+    schedule = _device('day').heat_schedule
+    return lambda: schedule.get_current_schedule_item(MID_MORNING)
+
+@case('schedule.current_item_week')
+def _schedule_week():
+    schedule = _device('week').heat_schedule
+    return lambda: schedule.get_current_schedule_item(MID_MORNING)
+
+@case('schedule.current_item_previous_day')
+def _schedule_previous_day():
+    schedule = _device('week').heat_schedule
+    return lambda: schedule.get_current_schedule_item(EARLY_MORNING)
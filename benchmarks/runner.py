@@ -0,0 +1,82 @@
+"""Timing, results and baseline comparison for the benchmark suite"""
+from __future__ import absolute_import
+import os
+import json
+import platform
+import timeit
+from contextlib import redirect_stdout
+
+CALIBRATION_LOOPS = 1000
+
+def _calibration():
+    """Pure Python reference work that the case times are divided by"""
+    total = 0
+    for value in range(CALIBRATION_LOOPS):
+        total += value
+    return total
+
+def time_function(function, repeat=5, min_time=0.1):
+    """Returns best seconds per call of function and the calls per repeat
+
+    The calls per repeat are increased until a repeat takes at least min_time."""
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        for multiple in (1, 2, 5):
+            calls = number * multiple
+            if timer.timeit(calls) >= min_time:
+                return min(timer.repeat(repeat, calls)) / calls, calls
+        number *= 10
+
+def run_cases(cases, repeat=5, min_time=0.1):
+    """Returns results dictionary for list of (name, setup function) cases
+
+    Each setup function is called once and returns the function to time. The thermostat
+    state machine prints its changes, these are discarded so they do not mix with results."""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return _run_cases(cases, repeat, min_time)
+
+def _run_cases(cases, repeat, min_time):
+    """Time cases, each relative to the calibration timed just before it
+
+    Timing the calibration next to each case means a machine that speeds up or slows down
+    during the run affects both alike."""
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'benchmarks': {}
+    }
+    calibrations = []
+    for name, setup in cases:
+        function = setup()
+        calibration, _ = time_function(_calibration, repeat, min_time)
+        seconds, calls = time_function(function, repeat, min_time)
+        calibrations.append(calibration)
+        results['benchmarks'][name] = {'seconds': seconds, 'calls': calls, 'relative': seconds / calibration}
+    results['calibration'] = min(calibrations) if calibrations else None
+    return results
+
+def compare(results, baseline, tolerance=0.5):
+    """Returns list of (name, baseline relative, relative, ratio, regressed) for cases in both
+
+    A case is regressed if its relative time is more than tolerance above the baseline."""
+    comparison = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        expected = baseline['benchmarks'][name]['relative']
+        ratio = result['relative'] / expected
+        comparison.append((name, expected, result['relative'], ratio, ratio > 1 + tolerance))
+    return comparison
+
+def load_results(filename):
+    """Returns results dictionary from JSON file"""
+    with open(filename) as fhandle:
+        return json.load(fhandle)
+
+def save_results(results, filename):
+    """Writes results dictionary to JSON file"""
+    with open(filename, 'w') as fhandle:
+        json.dump(results, fhandle, indent=2, sort_keys=True)
+        fhandle.write('\n')
@@ -0,0 +1,216 @@
+"""Fleet soak and throughput harness
+
+Runs a HeatmiserNetwork against an emulated bus of stats, polling with the
+default poll groups and writing set points at a fixed rate, on a simulated
+clock so hours of bus time take seconds. Reports fields read per second, the
+age of polled fields sampled through the run, write latency under the polling
+load, retries, timeouts and CRC failures, and CPU time per poll. The CPU time
+includes the emulator, so compare it between runs rather than with a real bus.
+For example
+
+    python -m benchmarks.soak --stats 32 --duration 14400 --noise 0.01 --dropout 0.01
+"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from contextlib import redirect_stdout
+import serial
+
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
+from heatmisercontroller.network import HeatmiserNetwork
+from heatmisercontroller.emulator import HeatmiserEmulator, EmulatorAdaptor
+from heatmisercontroller.polling import HeatmiserPoller, DEFAULT_POLL_GROUPS
+from heatmisercontroller.capacity import admit_groups
+from heatmisercontroller.analysis import latency_summary
+from heatmisercontroller.exceptions import HeatmiserError
+from heatmisercontroller.hm_constants import SLAVE_ADDR_MAX
+
+CONFIGFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'soak.conf')
+STARTTIME = 1600000000.0
+WRITE_FIELD = 'setroomtemp'
+WRITE_RANGE = (16, 24)
+
+def _metric_total(snapshot, name):
+    """Sum of a counter over all labels"""
+    return sum(snapshot.get(name, {}).values())
+
+def _polls(snapshot, result):
+    """Number of polls with result, ok or failed"""
+    return sum(value for labels, value in snapshot.get('heatmiser_polls_total', {}).items()
+                if 'result="%s"' % result in labels)
+
+def create_fleet(stats, emulator, prog_mode='day'):
+    """Returns network with prt_e devices at addresses 1 to stats, connected to emulator"""
+    if not 1 <= stats <= SLAVE_ADDR_MAX:
+        raise ValueError("Number of stats must be 1 to %i" % SLAVE_ADDR_MAX)
+    network = HeatmiserNetwork(CONFIGFILE, adaptor_factory=lambda setup: EmulatorAdaptor(setup, emulator))
+    for address in range(1, stats + 1):
+        emulator.add_stat(address, prog_mode=prog_mode)
+        settings = {'address': address, 'expected_model': 'prt_e_model', 'expected_prog_mode': prog_mode}
+        network.controllers.append(network.add_device("C%i" % address, settings,
+                                                        network._setup.settings['devicesgeneral'])) #pylint: disable=protected-access
+    return network
+
+class SoakRun():
+    """Polling and write workload on a network, sampling field ages as it runs"""
+    def __init__(self, network, groups=None, write_interval=60.0, sample_interval=10.0, seed=None):
+        self.network = network
+        self.write_interval = write_interval
+        self.sample_interval = sample_interval
+        self.random = random.Random(seed)
+        self.capacity_plan = admit_groups(network, DEFAULT_POLL_GROUPS if groups is None else groups)
+        self.poller = HeatmiserPoller(network, self.capacity_plan.groups)
+        for device in network.controllers:
+            device.refresh_queue = self.poller
+        self.ages = {group.name: [] for group in self.poller.groups}
+        self.write_latencies = []
+        self.write_failures = 0
+
+    def run(self, duration):
+        """Run workload for duration seconds of clock time"""
+        starttime = clock.now()
+        endtime = starttime + duration
+        nextwrite = starttime + self.write_interval if self.write_interval else None
+        nextsample = starttime + self.sample_interval
+        while clock.now() < endtime:
+            waittime = self.poller.run_once()
+            if nextwrite is not None and nextwrite <= clock.now():
+                self._write(nextwrite)
+                nextwrite += self.write_interval
+            if nextsample <= clock.now():
+                self._sample()
+                while nextsample <= clock.now():
+                    nextsample += self.sample_interval
+            nextevent = min(clock.now() + waittime, nextsample, endtime)
+            if nextwrite is not None:
+                nextevent = min(nextevent, nextwrite)
+            clock.get_clock().set_time(nextevent)
+
+    def _write(self, duetime):
+        """Write a set point to a random device, latency is from when the write was due"""
+        device = self.random.choice(self.network.controllers)
+        try:
+            device.set_field(WRITE_FIELD, self.random.randint(*WRITE_RANGE))
+        except (HeatmiserError, serial.SerialException):
+            self.write_failures += 1
+            return
+        self.write_latencies.append(clock.now() - duetime)
+
+    def _sample(self):
+        """Record age of each polled field that has been read"""
+        timenow = clock.now()
+        for group in self.poller.groups:
+            for device in self.network.controllers:
+                for fieldname in group.fieldnames:
+                    field = getattr(device, fieldname, None)
+                    if field is not None and field.lastreadtime is not None:
+                        self.ages[group.name].append(timenow - field.lastreadtime)
+
+    def fields_read(self):
+        """Number of field reads from the bus"""
+        return sum(field.freshness.reads for device in self.network.controllers for field in device.fields)
+
+def run_soak(stats=8, duration=3600.0, latency=0.04, latency_jitter=0.02, noise=0.0, dropout=0.0,
+                write_interval=60.0, sample_interval=10.0, seed=1):
+    """Returns report of a soak run of duration simulated seconds against an emulated bus"""
+    previousclock = clock.get_clock()
+    clock.set_clock(SimulatedClock(STARTTIME))
+    try:
+        emulator = HeatmiserEmulator(latency=latency, latency_jitter=latency_jitter, noise=noise,
+                                        dropout=dropout, seed=seed)
+        network = create_fleet(stats, emulator)
+        soak = SoakRun(network, write_interval=write_interval, sample_interval=sample_interval, seed=seed)
+        walltime = time.time()
+        cputime = time.process_time()
+        soak.run(duration)
+        cputime = time.process_time() - cputime
+        walltime = time.time() - walltime
+        snapshot = network.metrics_snapshot()
+    finally:
+        clock.set_clock(previousclock)
+
+    polls = _polls(snapshot, 'ok') + _polls(snapshot, 'failed')
+    return {
+        'stats': stats,
+        'duration': duration,
+        'wall_time': walltime,
+        'speedup': duration / walltime if walltime else None,
+        'cpu_time': cputime,
+        'cpu_per_poll': cputime / polls if polls else None,
+        'polls': polls,
+        'poll_failures': _polls(snapshot, 'failed'),
+        'fields_read': soak.fields_read(),
+        'fields_per_second': soak.fields_read() / duration,
+        'planned_utilisation': soak.capacity_plan.utilisation,
+        'degraded': soak.capacity_plan.degraded,
+        'intervals': {group.name: group.interval for group in soak.poller.groups},
+        'staleness': {name: latency_summary(ages) for name, ages in soak.ages.items()},
+        'writes': {'count': len(soak.write_latencies) + soak.write_failures,
+                    'failed': soak.write_failures,
+                    'latency': latency_summary(soak.write_latencies)},
+        'retries': _metric_total(snapshot, 'heatmiser_retries_total'),
+        'timeouts': _metric_total(snapshot, 'heatmiser_timeouts_total'),
+        'crc_failures': _metric_total(snapshot, 'heatmiser_crc_failures_total'),
+        'emulator': dict(emulator.counts)
+    }
+
+def _format_summary(summary, scale=1.0):
+    """Returns p50, p99 and max text for a summary"""
+    if not summary['count']:
+        return "%8s %8s %8s" % ('-', '-', '-')
+    return "%8.2f %8.2f %8.2f" % (summary['p50'] * scale, summary['p99'] * scale, summary['max'] * scale)
+
+def main(argv=None):
+    """Run soak from the command line"""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.soak', description=__doc__.splitlines()[0])
+    parser.add_argument('--stats', type=int, default=8, help='number of emulated stats, 1 to 32')
+    parser.add_argument('--duration', type=float, default=3600.0, help='simulated seconds to run')
+    parser.add_argument('--latency', type=float, default=0.04, help='stat response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='random extra latency in seconds')
+    parser.add_argument('--noise', type=float, default=0.0, help='probability of a corrupted response')
+    parser.add_argument('--dropout', type=float, default=0.0, help='probability of no response')
+    parser.add_argument('--write-interval', type=float, default=60.0,
+                        help='seconds between set point writes, 0 for none')
+    parser.add_argument('--sample-interval', type=float, default=10.0, help='seconds between field age samples')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for faults and writes')
+    parser.add_argument('--json', action='store_true', help='print report as JSON')
+    parser.add_argument('--output', help='write report as JSON to file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull): #thermostat state changes are printed
+        report = run_soak(args.stats, args.duration, args.latency, args.jitter, args.noise, args.dropout,
+                            args.write_interval, args.sample_interval, args.seed)
+    if args.output:
+        with open(args.output, 'w') as fhandle:
+            json.dump(report, fhandle, indent=2, sort_keys=True)
+            fhandle.write('\n')
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print("")
+        return 0
+
+    print("%i stats for %.0f s simulated in %.1f s, planned bus use %.0f%%%s" %(
+            report['stats'], report['duration'], report['wall_time'], report['planned_utilisation'] * 100,
+            ', intervals stretched' if report['degraded'] else ''))
+    print("%i polls, %i failed, %.2f fields/s, %.2f ms CPU per poll" %(
+            report['polls'], report['poll_failures'], report['fields_per_second'],
+            (report['cpu_per_poll'] or 0) * 1000))
+    print("retries %i, timeouts %i, CRC failures %i" %(
+            report['retries'], report['timeouts'], report['crc_failures']))
+    print("\r\n%-14s %8s %8s %8s %8s" % ('Field age s', 'interval', 'p50', 'p99', 'max'))
+    for name, summary in report['staleness'].items():
+        print("%-14s %8.0f %s" % (name, report['intervals'][name], _format_summary(summary)))
+    writes = report['writes']
+    print("\r\nWrites %i, failed %i, latency ms p50 p99 max %s" %(
+            writes['count'], writes['failed'], _format_summary(writes['latency'], 1000)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
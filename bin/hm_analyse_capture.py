@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Analyses a bus capture file and prints CRC, latency, retry, frame length
+and utilisation statistics
+
+Captures are written when capture_file is set in the controller settings.
+"""
+from __future__ import absolute_import
+import sys
+import json
+import argparse
+
+from heatmisercontroller.capture import read_capture
+from heatmisercontroller.analysis import analyse_capture
+
+PARSER = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+PARSER.add_argument('capture', help='capture file')
+PARSER.add_argument('--interval', type=float, default=60.0, help='seconds per utilisation interval')
+PARSER.add_argument('--baudrate', type=int, default=4800, help='bus baud rate')
+PARSER.add_argument('--json', action='store_true', help='print statistics as JSON')
+ARGS = PARSER.parse_args()
+
+STATS = analyse_capture(read_capture(ARGS.capture), ARGS.interval, ARGS.baudrate)
+
+if ARGS.json:
+    json.dump(STATS, sys.stdout, indent=2, sort_keys=True)
+    print("")
+    sys.exit()
+
+print("%i frames, %i sent, %i received over %.1f s" %(
+        STATS['frames'], STATS['sent'], STATS['received'], STATS['duration']))
+print("CRC valid %i, invalid %i, unsolicited responses %i" %(
+        STATS['crc_valid'], STATS['crc_invalid'], STATS['unsolicited']))
+
+print("\r\nAddress  Trans  Timeouts  CRC fail  Retries   p50 ms   p90 ms   p99 ms   max ms")
+for address, stats in STATS['addresses'].items():
+    latency = stats['latency']
+    if latency['count']:
+        latencytext = "%8.1f %8.1f %8.1f %8.1f" %(latency['p50'] * 1000, latency['p90'] * 1000,
+                                                    latency['p99'] * 1000, latency['max'] * 1000)
+    else:
+        latencytext = "%8s %8s %8s %8s" % ('-', '-', '-', '-')
+    print("%7i %6i %9i %9i %8i %s" %(address, stats['transactions'], stats['timeouts'],
+                                    stats['crc_failures'], stats['retries'], latencytext))
+
+print("\r\nSends per request: %s" % ', '.join("%i x%i" %(sends, count)
+                                    for sends, count in sorted(STATS['retry_chains'].items())))
+for direction in ('sent', 'received'):
+    print("Frame lengths %s: %s" %(direction, ', '.join("%i x%i" %(length, count)
+                                    for length, count in sorted(STATS['frame_lengths'][direction].items()))))
+
+print("\r\nInterval start s  Utilisation")
+for starttime, utilisation in STATS['utilisation']:
+    print("%16.0f  %10.1f%%" %(starttime, utilisation * 100))
@@ -2,37 +2,86 @@
 from __future__ import absolute_import
 import time
 import logging
+import threading
 import serial
 
+from . import clock
 from .hm_constants import MAX_FRAME_RESP_LENGTH, MIN_FRAME_READ_RESP_LENGTH, DCB_START, FUNC_WRITE
 from .hm_constants import FUNC_READ, BROADCAST_ADDR, FRAME_WRITE_RESP_LENGTH, FR_CONTENTS
 from .hm_constants import RW_LENGTH_ALL, CRC_LENGTH
 from . import framing
-from .exceptions import HeatmiserResponseError, HeatmiserResponseErrorCRC
-
-def retryer(max_retries=3):
-    """Decorates reading from and writing to devices, rerunning the methods on failure"""
+from .exceptions import HeatmiserResponseError, HeatmiserResponseErrorCRC, HeatmiserDeadlineError
+from .exceptions import HeatmiserCircuitOpenError
+from .resilience import RetryPolicy, CircuitBreaker
+from .metrics import MetricsRegistry, NULL_METRICS
+from .tracing import start_span
+from .logsupport import FrameRing, FRAME_SENT, FRAME_RECEIVED, LazyCall
+from .capture import CaptureWriter
+from .deadline import time_left
+
+def retryer(policyname):
+    """Decorates reading from and writing to devices, rerunning the methods on failure
+
+    The retry policy is the named attribute of the adaptor. Calls to an address with an open
+    circuit breaker fail without using the bus.
+    Takes an optional deadline keyword argument, no attempt is started after the deadline."""
     def wraps(func):
         """Part of decorator"""
-        def inner(*args, **kwargs):
+        def inner(self, network_address, *args, **kwargs):
             """Part of decorator"""
+            deadline = kwargs.pop('deadline', None)
+            policy = getattr(self, policyname)
+            breaker = self.circuit_breaker(network_address)
+            if deadline is not None and clock.now() >= deadline:
+                raise HeatmiserDeadlineError("Deadline passed before first attempt")
+            if breaker is not None and not breaker.allow():
+                raise HeatmiserCircuitOpenError("C%i skipped, circuit open after %i failures"%(network_address, breaker.failures))
             lasterror = None
-            for i in range(max_retries):
-                if i != 0:
-                    logging.getLogger(__name__).warning("Gen retrying due to %s",str(lasterror))
-                try:
-                    result = func(*args, **kwargs)
-                except HeatmiserResponseError as err:
-                    lasterror = err
-                    continue
-                else:
-                    return result
-            raise HeatmiserResponseError("Failed after %i retries on %s"%(max_retries, str(lasterror)))
+            succeeded = False
+            try:
+                for i in range(policy.attempts):
+                    if deadline is not None and clock.now() >= deadline:
+                        raise HeatmiserDeadlineError("Deadline passed after %i attempts, last error %s"%(i, str(lasterror)))
+                    if i != 0:
+                        logging.getLogger(__name__).warning("Gen retrying due to %s",str(lasterror))
+                        self.metrics.inc('heatmiser_retries_total', address=network_address, operation=func.__name__)
+                        delay = min(policy.delay(i), time_left(deadline))
+                        if delay > 0:
+                            clock.sleep(delay)
+                    try:
+                        with start_span(func.__name__, address=network_address, attempt=i + 1):
+                            result = func(self, network_address, *args, **kwargs)
+                    except HeatmiserResponseError as err:
+                        lasterror = err
+                        continue
+                    else:
+                        succeeded = True
+                        if breaker is not None:
+                            breaker.record_success()
+                        return result
+                self.dump_frame_trace(network_address)
+                raise HeatmiserResponseError("Failed after %i retries on %s"%(policy.attempts, str(lasterror)))
+            finally:
+                #any other way out, including deadline and serial errors, counts as a failure,
+                #so a half open breaker goes back to open rather than waiting on a probe for ever
+                if breaker is not None and not succeeded:
+                    breaker.record_failure()
         return inner
     return wraps
 
 class HeatmiserAdaptor():
     """Handles configuration serial port and provides low level read and write functions"""
+    #defaults for controller settings that are not in the configuration
+    write_max_retries = 3
+    read_max_retries = 2
+    retry_backoff = 0.0
+    retry_jitter = 0.0
+    breaker_failure_threshold = 5
+    breaker_reset_time = 60.0
+    metrics_enabled = False
+    frame_trace_size = 0
+    capture_file = ''
+
     def __init__(self, setup):
         self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
         self._logger.debug('creating an instance of %s', self.__class__.__name__)
@@ -40,15 +89,28 @@ class HeatmiserAdaptor():
         self._setup = setup
         settings = self._setup.settings
 
-        self.serport = serial.Serial()
+        self.serport = self._create_port()
         self.serport.bytesize = serial.EIGHTBITS #COM_SIZE
         self.serport.parity = serial.PARITY_NONE #COM_PARITY
         self.serport.stopbits = serial.STOPBITS_ONE #COM_STOP
 
-        self.lastsendtime = None
-        self.creationtime = time.time()
+        self._lastsendtimestamp = None
+        self.creationtime = clock.now()
+        self._bus_lock = threading.RLock() #held for each transaction so threads can share the bus
+        self._breakers = {} #circuit breaker for each device address
 
         self._update_settings(settings)
+        self._busbusytime = 0.0 #total time spent in transactions
+        self.metrics = MetricsRegistry() if self.metrics_enabled else NULL_METRICS
+        self._declare_metrics()
+        self.frame_taps = [] #called with direction, data and time for each frame sent or received
+        self.frame_trace = None
+        if self.frame_trace_size > 0:
+            self.frame_trace = FrameRing(self.frame_trace_size)
+            self.add_frame_tap(self.frame_trace)
+        self.capture = None
+        if self.capture_file:
+            self.start_capture(self.capture_file)
 
         # so that system will get on with sending straight away
         self.lastreceivetime = self.creationtime - self.serport.COM_BUS_RESET_TIME
@@ -56,6 +118,70 @@ class HeatmiserAdaptor():
         if self.auto_connect:
             self.connect()
 
+    @staticmethod
+    def _create_port():
+        """Returns serial port, configured from settings later"""
+        return serial.Serial()
+
+    def _declare_metrics(self):
+        """Declare metrics recorded by the adaptor"""
+        self.metrics.histogram('heatmiser_read_latency_seconds', 'Time for successful read transactions')
+        self.metrics.histogram('heatmiser_write_latency_seconds', 'Time for successful write transactions')
+        self.metrics.histogram('heatmiser_first_byte_wait_seconds', 'Time waited for first byte of responses')
+        self.metrics.counter('heatmiser_retries_total', 'Retried transactions')
+        self.metrics.counter('heatmiser_crc_failures_total', 'Responses failing CRC check')
+        self.metrics.counter('heatmiser_timeouts_total', 'Requests with no response')
+        self.metrics.counter('heatmiser_bytes_sent_total', 'Bytes sent on bus')
+        self.metrics.counter('heatmiser_bytes_received_total', 'Bytes received from bus')
+        self.metrics.gauge('heatmiser_bus_busy_ratio', 'Fraction of time bus has been in transactions',
+                            lambda: self._busbusytime / max(clock.now() - self.metrics.starttime, 1e-9))
+
+    def _record_transaction(self, operation, network_address, starttime, succeeded):
+        """Record time on bus for a transaction, and its latency if it succeeded"""
+        duration = clock.now() - starttime
+        self._busbusytime += duration
+        if succeeded:
+            self.metrics.observe(operation, duration, address=network_address)
+
+    @property
+    def lastsendtime(self):
+        """Time of last send as text, None if nothing has been sent"""
+        if self._lastsendtimestamp is None:
+            return None
+        #timezone is wrong
+        return time.strftime("%d %b %Y %H:%M:%S +0000", time.localtime(self._lastsendtimestamp))
+
+    def add_frame_tap(self, tap):
+        """Add function called with direction, data and time for every frame sent or received"""
+        self.frame_taps.append(tap)
+
+    def remove_frame_tap(self, tap):
+        """Remove frame tap"""
+        self.frame_taps.remove(tap)
+
+    def start_capture(self, filename):
+        """Append all frames sent and received to a capture file, see capture module"""
+        self.stop_capture()
+        self.capture = CaptureWriter(filename)
+        self.add_frame_tap(self.capture)
+
+    def stop_capture(self):
+        """Stop and close any capture"""
+        if self.capture is not None:
+            self.remove_frame_tap(self.capture)
+            self.capture.close()
+            self.capture = None
+
+    def _tap_frame(self, direction, data, timestamp):
+        """Pass frame to frame taps"""
+        for tap in self.frame_taps:
+            tap(direction, data, timestamp)
+
+    def dump_frame_trace(self, network_address):
+        """Log recent frames held by the frame trace, if enabled"""
+        if self.frame_trace is not None:
+            self._logger.warning("C%i recent frames:\n%s", network_address, LazyCall(self.frame_trace.dump))
+
     def __del__(self):
         self._disconnect()
 
@@ -63,6 +189,11 @@ class HeatmiserAdaptor():
         """Check settings and update if needed."""
         for name, value in settings['controller'].items():
             setattr(self, name, value)
+        self.write_retry_policy = RetryPolicy(self.write_max_retries, self.retry_backoff, jitter=self.retry_jitter)
+        self.read_retry_policy = RetryPolicy(self.read_max_retries, self.retry_backoff, jitter=self.retry_jitter)
+        for breaker in self._breakers.values():
+            breaker.failure_threshold = self.breaker_failure_threshold
+            breaker.reset_time = self.breaker_reset_time
 
         # Configure serial settings after closing if required
         wasopen = False
@@ -112,36 +243,40 @@ class HeatmiserAdaptor():
 
     def _send_message(self, message):
         """Send message to serial port and log errors"""
-        if not self.serport.isOpen():
-            self.connect()
+        with start_span('send', bytes=len(message)):
+            if not self.serport.isOpen():
+                self.connect()
 
-        #check time since last received to make sure bus has settled.
-        waittime = self.serport.COM_BUS_RESET_TIME - (time.time() - self.lastreceivetime)
-        if waittime > 0:
-            self._logger.debug("Gen waiting before sending %.2f",waittime)
-            time.sleep(waittime)
+            #check time since last received to make sure bus has settled.
+            waittime = self.serport.COM_BUS_RESET_TIME - (clock.now() - self.lastreceivetime)
+            if waittime > 0:
+                self._logger.debug("Gen waiting before sending %.2f",waittime)
+                with start_span('bus_settle', wait=waittime):
+                    clock.sleep(waittime)
 
-        try:
-            self.serport.write(bytes(message))
-        except serial.SerialTimeoutException as err:
-            self.serport.close() #need to close so that isOpen works correctly.
-            self._logger.warning("Write timeout error: %s, sending %s", err, message)
-            raise
-        except serial.SerialException as err:
-            self.serport.close() #need to close so that isOpen works correctly.
-            self._logger.warning("Write error: %s, sending %s", err, message)
-            raise
+            try:
+                self.serport.write(bytes(message))
+            except serial.SerialTimeoutException as err:
+                self.serport.close() #need to close so that isOpen works correctly.
+                self._logger.warning("Write timeout error: %s, sending %s", err, message)
+                raise
+            except serial.SerialException as err:
+                self.serport.close() #need to close so that isOpen works correctly.
+                self._logger.warning("Write error: %s, sending %s", err, message)
+                raise
 
-        #timezone is wrong
-        self.lastsendtime = time.strftime("%d %b %Y %H:%M:%S +0000", time.localtime(time.time()))
-        self._logger.debug("Gen sent %s", message)
+            self.metrics.inc('heatmiser_bytes_sent_total', len(message))
+            self._lastsendtimestamp = clock.now()
+            if self.frame_taps:
+                self._tap_frame(FRAME_SENT, message, self._lastsendtimestamp)
+            self._logger.debug("Gen sent %s", message)
 
     def _clear_input_buffer(self):
         """Clears input buffer
 
         Used after CRC check wrong; in case more data was sent than expected."""
 
-        time.sleep(self.serport.COM_TIMEOUT) #wait for read timeout to ensure slave finished sending
+        clock.sleep(self.serport.COM_TIMEOUT) #wait for read timeout to ensure slave finished sending
         try:
             if self.serport.isOpen():
                 self.serport.reset_input_buffer() #reset input buffer and dump any contents
@@ -163,132 +298,200 @@ class HeatmiserAdaptor():
             raise
         finally:
             self.serport.timeout = self.serport.COM_TIMEOUT #make sure timeout is reverted
-            self.lastreceivetime = time.time() #record last read time. Used to manage bus settling.
+            self.lastreceivetime = clock.now() #record last read time. Used to manage bus settling.
 
-    def _receive_message(self, length=MAX_FRAME_RESP_LENGTH):
+    def _receive_message(self, length=MAX_FRAME_RESP_LENGTH, start_timeout=None):
         """Receive message from serial port and log errors
         
         Uses two time outs, one on the first byte and another for full data"""
-        if not self.serport.isOpen():
-            self.connect()
-        self._logger.debug("Gen listening for %d", length)
-
-        # Listen for the first byte
-        timereadstart = time.time()
-        #set wait for start of response
-        self.serport.timeout = self.serport.COM_START_TIMEOUT
-
-        firstbyteread = self._read_bytes(1)
-
-        timereadfirstbyte = time.time()-timereadstart
-        self._logger.debug("Gen waited %.2fs for first byte", timereadfirstbyte)
-        if len(firstbyteread) == 0:
-            raise HeatmiserResponseError("No Response")
-
-        # Listen for the rest of the response
-        self.serport.timeout = max(self.serport.COM_MIN_TIMEOUT, self.serport.COM_TIMEOUT - timereadfirstbyte) #wait for full time out for rest of response, but not less than COM_MIN_TIMEOUT)
-        byteread = self._read_bytes(length - 1)
-
-        #Convert back to array
-        data = list(bytearray(firstbyteread)) + list(bytearray(byteread))
-
-        return data
+        with start_span('receive', length=length) as span:
+            if not self.serport.isOpen():
+                self.connect()
+            self._logger.debug("Gen listening for %d", length)
+
+            # Listen for the first byte
+            timereadstart = clock.now()
+            #set wait for start of response
+            if start_timeout is None:
+                start_timeout = self.serport.COM_START_TIMEOUT
+            self.serport.timeout = start_timeout
+
+            firstbyteread = self._read_bytes(1)
+
+            timereadfirstbyte = clock.now()-timereadstart
+            span.set_attribute('first_byte_wait', timereadfirstbyte)
+            self._logger.debug("Gen waited %.2fs for first byte", timereadfirstbyte)
+            if len(firstbyteread) == 0:
+                self.metrics.inc('heatmiser_timeouts_total')
+                raise HeatmiserResponseError("No Response")
+            self.metrics.observe('heatmiser_first_byte_wait_seconds', timereadfirstbyte)
+
+            # Listen for the rest of the response
+            self.serport.timeout = max(self.serport.COM_MIN_TIMEOUT, self.serport.COM_TIMEOUT - timereadfirstbyte) #wait for full time out for rest of response, but not less than COM_MIN_TIMEOUT)
+            byteread = self._read_bytes(length - 1)
+
+            #Convert back to array
+            data = list(bytearray(firstbyteread)) + list(bytearray(byteread))
+            self.metrics.inc('heatmiser_bytes_received_total', len(data))
+            if self.frame_taps:
+                self._tap_frame(FRAME_RECEIVED, data, self.lastreceivetime)
+
+            return data
 
 ### protocol functions
 
-    @retryer(max_retries=3)
+    @retryer('write_retry_policy')
     def write_to_device(self, network_address, protocol, unique_address, length, payload):
         """Forms write frame and sends to serial link checking the acknowledgement"""
-        #Payload must be list
-        msg = framing.form_frame(network_address, protocol, self.my_master_addr,
-                                 FUNC_WRITE, unique_address, length, payload)
-        try:
-            self._send_message(msg)
-        except Exception:
-            self._logger.warning("C%i writing to address, no message sent", network_address)
-            raise
-
-        self._logger.debug("C%i written to address %i length %i payload %s",
-                        network_address,
-                        unique_address,
-                        length,
-                        payload)
-        if network_address == BROADCAST_ADDR: # if broadcasting force it to wait longer until next send
-            self.lastreceivetime = (time.time()
-                                    + self.serport.COM_SEND_MIN_TIME
-                                    - self.serport.COM_BUS_RESET_TIME)
-        else: #else listen for acknowledgement
-            response = self._receive_message(FRAME_WRITE_RESP_LENGTH)
+        with self._bus_lock:
+            starttime = clock.now()
+            succeeded = False
             try:
-                framing.verify_write_ack(protocol, network_address, self.my_master_addr, response)
-            except HeatmiserResponseErrorCRC:
-                self._clear_input_buffer()
-                raise
+                #Payload must be list
+                msg = framing.form_frame(network_address, protocol, self.my_master_addr,
+                                         FUNC_WRITE, unique_address, length, payload)
+                try:
+                    self._send_message(msg)
+                except Exception:
+                    self._logger.warning("C%i writing to address, no message sent", network_address)
+                    raise
+
+                self._logger.debug("C%i written to address %i length %i payload %s",
+                                network_address,
+                                unique_address,
+                                length,
+                                payload)
+                if network_address == BROADCAST_ADDR: # if broadcasting force it to wait longer until next send
+                    self.lastreceivetime = (clock.now()
+                                            + self.serport.COM_SEND_MIN_TIME
+                                            - self.serport.COM_BUS_RESET_TIME)
+                else: #else listen for acknowledgement
+                    response = self._receive_message(FRAME_WRITE_RESP_LENGTH)
+                    try:
+                        with start_span('verify', address=network_address):
+                            framing.verify_write_ack(protocol, network_address, self.my_master_addr, response)
+                    except HeatmiserResponseErrorCRC:
+                        self.metrics.inc('heatmiser_crc_failures_total', address=network_address)
+                        self._clear_input_buffer()
+                        raise
+                succeeded = True
+            finally:
+                self._record_transaction('heatmiser_write_latency_seconds', network_address, starttime, succeeded)
+
+    def circuit_breaker(self, network_address):
+        """Returns circuit breaker for a device address, None for broadcasts"""
+        if network_address == BROADCAST_ADDR:
+            return None
+        breaker = self._breakers.get(network_address)
+        if breaker is None:
+            breaker = self._breakers.setdefault(network_address,
+                        CircuitBreaker(self.breaker_failure_threshold, self.breaker_reset_time))
+        return breaker
+
+    def breaker_states(self):
+        """Returns dictionary of circuit breaker state by device address"""
+        return {address: breaker.state for address, breaker in self._breakers.items()}
 
     def min_time_between_reads(self):
         """Computes the minimum time that adaptor leaves between read commands"""
         return self.serport.COM_BUS_RESET_TIME
 
-    @retryer(max_retries=2)
-    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False):
-        """Forms read frame and sends to serial link checking the response"""
-        if readall:
-            msg = framing.form_read_frame(network_address,
-                                            protocol,
-                                            self.my_master_addr,
-                                            DCB_START,
-                                            RW_LENGTH_ALL)
-            self._logger.debug("C %i read request to address %i length %i",
-                            network_address,
-                            DCB_START,
-                            RW_LENGTH_ALL)
-        else:
-            msg = framing.form_read_frame(network_address,
-                                            protocol,
-                                            self.my_master_addr,
-                                            unique_start_address,
-                                            expected_length)
-            self._logger.debug("C %i read request to address %i length %i",
-                            network_address,
-                            unique_start_address,
-                            expected_length)
-        try: #sending request
-            self._send_message(msg)
-        except:
-            self._logger.warning("C%i address, read message not sent", network_address)
-            raise
+    def frame_transmit_time(self, length):
+        """Estimates the time to put a frame of length bytes on the wire"""
+        #start bit, data bits, parity bit and stop bits for each byte
+        parity_bits = 0 if self.serport.parity == serial.PARITY_NONE else 1
+        bits_per_byte = 1 + self.serport.bytesize + parity_bits + self.serport.stopbits
+        return length * bits_per_byte / float(self.serport.baudrate)
 
-        time1 = time.time()
+    def bus_ready_time(self):
+        """Returns the earliest time that the bus will have settled for the next send"""
+        return self.lastreceivetime + self.serport.COM_BUS_RESET_TIME
 
-        try: #listening for response
-            response = self._receive_message(MIN_FRAME_READ_RESP_LENGTH + expected_length)
-        except Exception as err:
-            self._logger.warning("C%i read failed from address %i length %i due to %s",
-                                network_address,
-                                unique_start_address,
-                                expected_length,
-                                str(err))
-            raise
-
-        self._logger.debug("C%i read in %.2f s from address %i length %i response %s",
-                        network_address,
-                        time.time()-time1,
-                        unique_start_address,
-                        expected_length,
-                        response)
-
-        try: #processing response
-            framing.verify_response(protocol,
+    @retryer('read_retry_policy')
+    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False):
+        """Forms read frame and sends to serial link checking the response"""
+        return self._read_from_device(network_address, protocol, unique_start_address,
+                                        expected_length, readall)
+
+    def probe_device(self, network_address, protocol, unique_start_address, expected_length):
+        """Single read attempt with a short wait for the first byte, used to find devices"""
+        return self._read_from_device(network_address, protocol, unique_start_address,
+                                        expected_length,
+                                        start_timeout=self.serport.COM_PROBE_START_TIMEOUT)
+
+    def _read_from_device(self, network_address, protocol, unique_start_address, expected_length,
+                            readall=False, start_timeout=None):
+        """Single read attempt, forms read frame and sends to serial link checking the response"""
+        with self._bus_lock:
+            starttime = clock.now()
+            succeeded = False
+            try:
+                if readall:
+                    msg = framing.form_read_frame(network_address,
+                                                    protocol,
+                                                    self.my_master_addr,
+                                                    DCB_START,
+                                                    RW_LENGTH_ALL)
+                    self._logger.debug("C %i read request to address %i length %i",
+                                    network_address,
+                                    DCB_START,
+                                    RW_LENGTH_ALL)
+                else:
+                    msg = framing.form_read_frame(network_address,
+                                                    protocol,
+                                                    self.my_master_addr,
+                                                    unique_start_address,
+                                                    expected_length)
+                    self._logger.debug("C %i read request to address %i length %i",
                                     network_address,
-                                    self.my_master_addr,
-                                    FUNC_READ,
+                                    unique_start_address,
+                                    expected_length)
+                try: #sending request
+                    self._send_message(msg)
+                except:
+                    self._logger.warning("C%i address, read message not sent", network_address)
+                    raise
+
+                time1 = clock.now()
+
+                try: #listening for response
+                    response = self._receive_message(MIN_FRAME_READ_RESP_LENGTH + expected_length,
+                                                        start_timeout)
+                except Exception as err:
+                    self._logger.warning("C%i read failed from address %i length %i due to %s",
+                                        network_address,
+                                        unique_start_address,
+                                        expected_length,
+                                        str(err))
+                    raise
+
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    self._logger.debug("C%i read in %.2f s from address %i length %i response %s",
+                                    network_address,
+                                    clock.now()-time1,
+                                    unique_start_address,
                                     expected_length,
                                     response)
-        except HeatmiserResponseErrorCRC:
-            self._clear_input_buffer()
-            raise
-        return response[FR_CONTENTS:-CRC_LENGTH]
 
-    def read_all_from_device(self, network_address, protocol, expected_length):
+                try: #processing response
+                    with start_span('verify', address=network_address):
+                        framing.verify_response(protocol,
+                                                network_address,
+                                                self.my_master_addr,
+                                                FUNC_READ,
+                                                expected_length,
+                                                response)
+                except HeatmiserResponseErrorCRC:
+                    self.metrics.inc('heatmiser_crc_failures_total', address=network_address)
+                    self._clear_input_buffer()
+                    raise
+
+                succeeded = True
+                return response[FR_CONTENTS:-CRC_LENGTH]
+            finally:
+                self._record_transaction('heatmiser_read_latency_seconds', network_address, starttime, succeeded)
+
+    def read_all_from_device(self, network_address, protocol, expected_length, deadline=None):
         """Forms read all frame using read_from_device"""
-        return self.read_from_device(network_address, protocol, DCB_START, expected_length, True)
+        return self.read_from_device(network_address, protocol, DCB_START, expected_length, True,
+                                        deadline=deadline)
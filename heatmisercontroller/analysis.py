@@ -0,0 +1,174 @@
+"""Offline analysis of bus captures
+
+Computes CRC validity, per address latency and retry statistics, frame length
+histograms and bus utilisation over time for frames read with
+capture.read_capture. Only the CRC check is vectorised, with NumPy when it is
+installed using the framing CRC tables, and frame by frame with framing.Crc16
+otherwise. The other statistics are gathered frame by frame in Python, and the
+whole capture is held in memory, so very long captures should be split.
+"""
+from __future__ import absolute_import
+import math
+from collections import Counter
+
+from .framing import Crc16
+from .hm_constants import BYTEMASK, BROADCAST_ADDR, FR_DEST_ADDR
+from .logsupport import FRAME_SENT, FRAME_RECEIVED
+
+BATCH_ROWS = 65536 #frames of the same length checked together
+BITS_PER_BYTE = 10 #start bit, 8 data bits and stop bit
+LATENCY_PERCENTILES = (50, 90, 99)
+
+def _import_numpy():
+    """Returns numpy module, None if it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def crc_valid(frames, use_numpy=None):
+    """Returns list of True for each frame, given as bytes, with a valid CRC
+
+    use_numpy None uses the vectorised CRC with NumPy if installed."""
+    numpy = _import_numpy() if use_numpy is not False else None
+    if use_numpy and numpy is None:
+        raise ImportError("NumPy is needed for vectorised CRC checks")
+    if numpy is None:
+        return [_crc_valid_frame(frame) for frame in frames]
+    return _crc_valid_batch(numpy, frames).tolist()
+
+def _crc_valid_frame(frame):
+    """Check CRC of a single frame"""
+    frame = bytearray(frame)
+    return len(frame) >= 2 and Crc16().run(frame[:-2]) == [frame[-2], frame[-1]]
+
+def _crc_valid_batch(numpy, frames):
+    """Check CRCs with frames grouped by length, so each group is a dense array"""
+    lengths = numpy.fromiter((len(frame) for frame in frames), dtype=numpy.int64, count=len(frames))
+    valid = numpy.zeros(len(frames), dtype=bool)
+    tables = (numpy.array(Crc16.LookupHigh, dtype=numpy.uint8),
+                numpy.array(Crc16.LookupLow, dtype=numpy.uint8))
+    for length in numpy.unique(lengths):
+        if length < 2:
+            continue
+        indices = numpy.nonzero(lengths == length)[0]
+        for batchstart in range(0, len(indices), BATCH_ROWS):
+            rows = indices[batchstart:batchstart + BATCH_ROWS]
+            block = numpy.frombuffer(b''.join(bytes(frames[row]) for row in rows),
+                                        dtype=numpy.uint8).reshape(len(rows), int(length))
+            low, high = _crc_batch(numpy, block[:, :-2], tables)
+            valid[rows] = (low == block[:, -2]) & (high == block[:, -1])
+    return valid
+
+def _crc_batch(numpy, messages, tables):
+    """Returns arrays of CRC low and high bytes for rows of messages, as Crc16.run"""
+    lookuphigh, lookuplow = tables
+    high = numpy.full(messages.shape[0], BYTEMASK, dtype=numpy.uint8)
+    low = numpy.full(messages.shape[0], BYTEMASK, dtype=numpy.uint8)
+    for column in range(messages.shape[1]):
+        byte = messages[:, column]
+        for nibble in (byte >> 4, byte & 0x0f): #high nibble first
+            sigbit = (high >> 4) ^ nibble
+            high = ((high << 4) | (low >> 4)) ^ lookuphigh[sigbit]
+            low = (low << 4) ^ lookuplow[sigbit]
+    return low, high
+
+def _percentile(ordered, percent):
+    """Nearest rank percentile of sorted list"""
+    index = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+def latency_summary(latencies):
+    """Returns count, mean, percentiles and max of latencies"""
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    summary = {'count': len(ordered), 'mean': sum(ordered) / len(ordered), 'max': ordered[-1]}
+    for percent in LATENCY_PERCENTILES:
+        summary['p%i' % percent] = _percentile(ordered, percent)
+    return summary
+
+class _AddressStats():
+    """Counts for one device address"""
+    def __init__(self):
+        self.transactions = 0
+        self.timeouts = 0
+        self.crc_failures = 0
+        self.retries = 0
+        self.latencies = []
+
+    def report(self):
+        """Returns dictionary of counts and latency summary"""
+        return {'transactions': self.transactions, 'timeouts': self.timeouts,
+                'crc_failures': self.crc_failures, 'retries': self.retries,
+                'latency': latency_summary(self.latencies)}
+
+def analyse_capture(frames, interval=60.0, baudrate=4800, use_numpy=None):
+    """Returns dictionary of statistics for frames of (time, direction, bytes)
+
+    A sent frame is matched to the next received frame, if any arrives before the next send.
+    A send repeating a failed send is counted as a retry, retry_chains counts the number of
+    sends for each request. Utilisation is the fraction of each interval with bytes on the wire."""
+    valid = crc_valid([frame for _, _, frame in frames], use_numpy)
+    addresses = {}
+    lengths = {FRAME_SENT: Counter(), FRAME_RECEIVED: Counter()}
+    chains = Counter()
+    busytime = Counter()
+    unsolicited = 0
+    pending = None #(time, address) of send waiting for a response
+    chain = None #[frame, sends, failed] for current request
+    starttime = frames[0][0] if frames else 0.0
+
+    def close_pending():
+        """Count send that has no response as a timeout"""
+        if pending is not None and pending[1] != BROADCAST_ADDR:
+            addresses[pending[1]].timeouts += 1
+            chain[2] = True
+
+    for (timestamp, direction, frame), isvalid in zip(frames, valid):
+        lengths[direction][len(frame)] += 1
+        busytime[int((timestamp - starttime) // interval)] += len(frame) * BITS_PER_BYTE / float(baudrate)
+        if direction == FRAME_SENT:
+            close_pending()
+            address = bytearray(frame)[FR_DEST_ADDR] if frame else BROADCAST_ADDR
+            stats = addresses.setdefault(address, _AddressStats())
+            if chain is not None and chain[0] == frame and chain[2]:
+                chain[1] += 1
+                chain[2] = False
+                stats.retries += 1
+            else:
+                if chain is not None:
+                    chains[chain[1]] += 1
+                chain = [frame, 1, False]
+            pending = (timestamp, address)
+        elif pending is None:
+            unsolicited += 1
+        else:
+            stats = addresses[pending[1]]
+            stats.transactions += 1
+            if isvalid:
+                stats.latencies.append(timestamp - pending[0])
+            else:
+                stats.crc_failures += 1
+                chain[2] = True
+            pending = None
+    close_pending()
+    if chain is not None:
+        chains[chain[1]] += 1
+
+    received = [isvalid for (_, direction, _), isvalid in zip(frames, valid) if direction == FRAME_RECEIVED]
+    return {
+        'frames': len(frames),
+        'sent': sum(lengths[FRAME_SENT].values()),
+        'received': len(received),
+        'duration': frames[-1][0] - starttime if frames else 0.0,
+        'crc_valid': sum(received),
+        'crc_invalid': len(received) - sum(received),
+        'unsolicited': unsolicited,
+        'addresses': {address: stats.report() for address, stats in sorted(addresses.items())},
+        'retry_chains': dict(chains),
+        'frame_lengths': {'sent': dict(lengths[FRAME_SENT]), 'received': dict(lengths[FRAME_RECEIVED])},
+        'utilisation': [(index * interval, busytime[index] / interval)
+                        for index in range(max(busytime) + 1 if busytime else 0)]
+    }
@@ -0,0 +1,99 @@
+"""Bus capacity planning for polling Heatmiser devices
+
+Uses the read time model of each device to work out the fraction of bus time
+that a set of poll groups needs, so configurations that cannot meet their
+intervals are found before data goes stale.
+"""
+from __future__ import absolute_import
+import logging
+
+from .polling import PollGroup, PollTask, DEFAULT_POLL_GROUPS
+from .exceptions import HeatmiserCapacityError
+
+MAX_BUS_UTILISATION = 0.8 #fraction of bus time that polling may use, rest is kept for writes
+
+class CapacityPlan():
+    """Bus utilisation needed by a set of poll groups on a network"""
+    def __init__(self, groups, grouputilisation, max_utilisation, write_time):
+        self.groups = groups
+        self.grouputilisation = grouputilisation #dictionary of utilisation by group name
+        self.utilisation = sum(grouputilisation.values())
+        self.max_utilisation = max_utilisation
+        self.degraded = False
+        self._write_time = write_time
+
+    def is_feasible(self):
+        """Returns True if the plan fits in the allowed bus utilisation"""
+        #small tolerance for rounding when intervals are stretched to fit exactly
+        return self.utilisation <= self.max_utilisation * (1 + 1e-9)
+
+    def headroom(self):
+        """Fraction of bus time left after polling"""
+        return max(0.0, 1.0 - self.utilisation)
+
+    def write_rate(self):
+        """Number of single field writes per second that fit in the headroom, 0 if there is nothing to write to"""
+        if not self._write_time:
+            return 0.0
+        return self.headroom() / self._write_time
+
+    def report(self):
+        """Returns dictionary describing the plan"""
+        return {
+            'utilisation': self.utilisation,
+            'max_utilisation': self.max_utilisation,
+            'feasible': self.is_feasible(),
+            'degraded': self.degraded,
+            'headroom': self.headroom(),
+            'write_rate': self.write_rate(),
+            'groups': {group.name: {'interval': group.interval,
+                                    'utilisation': self.grouputilisation[group.name]}
+                        for group in self.groups}
+        }
+
+def plan_capacity(network, groups=None, max_utilisation=MAX_BUS_UTILISATION):
+    """Compute bus utilisation needed to poll groups on all devices of a network
+
+    A group with an interval of 0 is not polled, so adds no load to the bus."""
+    if groups is None:
+        groups = DEFAULT_POLL_GROUPS
+    resettime = network.adaptor.min_time_between_reads()
+    devices = [device for device in network.controllers if hasattr(device, 'read_fields')]
+
+    grouputilisation = {}
+    for group in groups:
+        if not group.interval:
+            grouputilisation[group.name] = 0.0
+            continue
+        tasks = [PollTask(device, group, 0) for device in devices]
+        grouputilisation[group.name] = sum((task.bustime + resettime) / group.interval
+                                            for task in tasks if task.fieldnames)
+
+    write_time = resettime
+    if devices:
+        write_time += devices[0]._estimate_write_time(1)
+    return CapacityPlan(groups, grouputilisation, max_utilisation, write_time)
+
+def admit_groups(network, groups=None, max_utilisation=MAX_BUS_UTILISATION, degrade=True):
+    """Check poll groups fit on the bus, returns a feasible CapacityPlan
+
+    If the groups need more than max_utilisation, either all intervals are stretched by the
+    same factor so that they fit (degrade), or HeatmiserCapacityError is raised."""
+    logger = logging.getLogger(__name__)
+    plan = plan_capacity(network, groups, max_utilisation)
+    if plan.is_feasible():
+        logger.info("Polling uses %.0f%% of bus, %.0f%% headroom",
+                    plan.utilisation * 100, plan.headroom() * 100)
+        return plan
+    if not degrade:
+        raise HeatmiserCapacityError("Polling needs %.0f%% of bus, limit is %.0f%%"%(
+                                        plan.utilisation * 100, max_utilisation * 100))
+
+    factor = plan.utilisation / max_utilisation
+    stretched = [PollGroup(group.name, group.fieldnames, group.interval * factor)
+                    for group in plan.groups]
+    logger.warning("Polling needs %.0f%% of bus, intervals stretched by %.2f",
+                    plan.utilisation * 100, factor)
+    degradedplan = plan_capacity(network, stretched, max_utilisation)
+    degradedplan.degraded = True
+    return degradedplan
@@ -0,0 +1,72 @@
+"""Capture of bus traffic to file
+
+CaptureWriter is an adaptor frame tap that appends every frame sent and
+received, with its time, to a compact binary file. A capture file starts with
+CAPTURE_MAGIC followed by frame records, each a header of time, direction and
+length followed by the frame bytes. Captures can be read with read_capture and
+replayed with the replay module.
+"""
+from __future__ import absolute_import
+import os
+import threading
+
+from .logsupport import FRAME_HEADER, CAPTURE_MAGIC, FRAME_SENT, FRAME_RECEIVED
+from .exceptions import HeatmiserError
+
+class CaptureWriter():
+    """Appends frames to a capture file, use as an adaptor frame tap"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.frames = 0
+        self._lock = threading.Lock()
+        isnew = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self._file = open(filename, 'ab')
+        if isnew:
+            self._file.write(CAPTURE_MAGIC)
+            self._file.flush()
+        else:
+            _check_magic(filename)
+
+    def __call__(self, direction, data, timestamp):
+        """Append frame and flush, so the capture is complete if the process stops"""
+        payload = bytes(bytearray(data))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(FRAME_HEADER.pack(timestamp, direction, len(payload)) + payload)
+            self._file.flush()
+            self.frames += 1
+
+    def close(self):
+        """Close capture file, later frames are ignored"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def _check_magic(filename):
+    """Raises HeatmiserError if file is not a capture"""
+    with open(filename, 'rb') as fhandle:
+        if fhandle.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise HeatmiserError("%s is not a capture file" % filename)
+
+def read_capture(filename):
+    """Returns list of (time, direction, bytes) for frames in a capture file
+
+    A truncated last record, for example from a process stopped while writing, is ignored."""
+    with open(filename, 'rb') as fhandle:
+        content = fhandle.read()
+    if content[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise HeatmiserError("%s is not a capture file" % filename)
+    frames = []
+    offset = len(CAPTURE_MAGIC)
+    while offset + FRAME_HEADER.size <= len(content):
+        timestamp, direction, length = FRAME_HEADER.unpack_from(content, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > len(content):
+            break
+        if direction not in (FRAME_SENT, FRAME_RECEIVED):
+            raise HeatmiserError("%s has unknown frame direction %i" % (filename, direction))
+        frames.append((timestamp, direction, content[offset:offset + length]))
+        offset += length
+    return frames
@@ -0,0 +1,90 @@
+"""Clock used for all timing in the library
+
+The library reads the time and sleeps through this module rather than the time
+module, so that the clock can be replaced. SystemClock uses the real time.
+SimulatedClock starts at a given time and only moves when it is slept on or
+advanced, so sleeps return straight away and hours of polling against an
+emulator or replay run in seconds. Set the clock with set_clock before creating
+networks or adaptors, as some times are recorded when they are created.
+"""
+from __future__ import absolute_import
+import time
+import threading
+
+class SystemClock():
+    """Real time clock"""
+    @staticmethod
+    def now():
+        """Returns seconds since the epoch"""
+        return time.time()
+
+    @staticmethod
+    def sleep(seconds):
+        """Sleep for seconds"""
+        time.sleep(seconds)
+
+    @staticmethod
+    def wait(event, timeout=None):
+        """Wait for event to be set or timeout, returns True if set"""
+        return event.wait(timeout)
+
+class SimulatedClock():
+    """Clock that moves only when slept on or advanced
+
+    Sleeps from any thread move the shared time forward by the time slept."""
+    def __init__(self, start=None):
+        self._now = time.time() if start is None else start
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Returns simulated seconds since the epoch"""
+        return self._now
+
+    def sleep(self, seconds):
+        """Move time forward by seconds, returning straight away"""
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """Move time forward by seconds"""
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+    def set_time(self, timenow):
+        """Move time to timenow, which must not be in the past"""
+        self.advance(timenow - self._now)
+
+    def wait(self, event, timeout=None):
+        """Returns True if event is set, otherwise moves time forward by timeout
+
+        Without a timeout there is nothing to move time to, so waits in real time for the event."""
+        if event.is_set():
+            return True
+        if timeout is None:
+            return event.wait()
+        self.advance(timeout)
+        return event.is_set()
+
+SYSTEM_CLOCK = SystemClock()
+_CLOCK = SYSTEM_CLOCK
+
+def set_clock(clock):
+    """Set clock used by the library, None for the system clock"""
+    global _CLOCK
+    _CLOCK = SYSTEM_CLOCK if clock is None else clock
+
+def get_clock():
+    """Returns clock used by the library"""
+    return _CLOCK
+
+def now():
+    """Returns current time from the library clock, as seconds since the epoch"""
+    return _CLOCK.now()
+
+def sleep(seconds):
+    """Sleep on the library clock"""
+    _CLOCK.sleep(seconds)
+
+def wait(event, timeout=None):
+    """Wait for event on the library clock, returns True if set"""
+    return _CLOCK.wait(event, timeout)
@@ -0,0 +1,32 @@
+"""Time budgets for operations on the bus
+
+A deadline is an absolute time as given by clock.now(), a timeout is a number of
+seconds from now. Operations given either skip work that cannot finish in time
+and report what was left undone.
+"""
+from __future__ import absolute_import
+
+from . import clock
+
+def resolve_deadline(deadline=None, timeout=None):
+    """Returns the earlier of deadline and now plus timeout, None if neither is given"""
+    if timeout is not None:
+        timeoutdeadline = clock.now() + timeout
+        deadline = timeoutdeadline if deadline is None else min(deadline, timeoutdeadline)
+    return deadline
+
+def time_left(deadline):
+    """Returns seconds until deadline, infinite if there is no deadline"""
+    if deadline is None:
+        return float('inf')
+    return deadline - clock.now()
+
+class PartialResults(list):
+    """List of results, with the items that could not be completed in time listed in incomplete"""
+    def __init__(self, results, incomplete=None):
+        list.__init__(self, results)
+        self.incomplete = [] if incomplete is None else incomplete
+
+    def is_complete(self):
+        """Returns True if all items were completed"""
+        return len(self.incomplete) == 0
@@ -3,7 +3,9 @@ from __future__ import absolute_import
 import logging
 import serial
 
-from .exceptions import HeatmiserResponseError, HeatmiserControllerTimeError
+from . import clock
+from .exceptions import HeatmiserError, HeatmiserResponseError, HeatmiserCircuitOpenError
+from .deadline import resolve_deadline
 
 class ListWrapperClass():
     """Class to provide mutable list as decorator argument"""
@@ -23,8 +25,33 @@ class ListWrapperClass():
     def list(self):
         self._storedlist = None
 
+class DeviceResult():
+    """Result of running a method on one device, with the error if it failed"""
+    def __init__(self, device, value=None, error=None, latency=None):
+        self.device = device
+        self.value = value
+        self.error = error
+        self.latency = latency #seconds taken, None if the device was skipped
+
+    def __repr__(self):
+        if self.error is not None:
+            return "DeviceResult(C%s failed %s)" % (self.device.set_address, self.error)
+        return "DeviceResult(C%s %s in %.3fs)" % (self.device.set_address, self.value, self.latency)
+
+    def is_ok(self):
+        """Returns True if the method succeeded"""
+        return self.error is None
+
+    def is_skipped(self):
+        """Returns True if the device was not tried as it is in backoff"""
+        return self.latency is None
+
 def run_function_on_all(liststore):
-    """Decorator to allow a class method to be run on all objects in a list"""
+    """Decorator to allow a class method to be run on all objects in a list
+
+    Devices in backoff after repeated failures are skipped, the rest are tried with the
+    healthiest first. An error on one device is stored in its DeviceResult and the others are
+    still run. Returns a DeviceResult for each object, in list order."""
     def wraps(func):
         """Decorator internal"""
         def inner(self, *args, **kwargs):
@@ -33,20 +60,33 @@ def run_function_on_all(liststore):
                 raise ValueError("liststore contains no list")
             logging.getLogger(__name__).info("All running %s for %i controllers",
                                                 func.__name__, len(liststore.list))
+            if kwargs.get('timeout') is not None:
+                #one deadline shared by all devices rather than a timeout for each
+                kwargs['deadline'] = resolve_deadline(kwargs.get('deadline'), kwargs.pop('timeout'))
             func(self, *args, **kwargs)
             results = [None] * len(liststore.list)
             lasterror = None
-            for index, obj in enumerate(liststore.list):
+            healths = [obj.health() for obj in liststore.list]
+            order = sorted(range(len(liststore.list)), key=lambda index: healths[index].failures)
+            for index in order:
+                obj = liststore.list[index]
+                if not healths[index].is_available():
+                    results[index] = DeviceResult(obj, error=HeatmiserCircuitOpenError(
+                        "C%i unavailable, in backoff after %i failures"%(obj.set_address, healths[index].failures)))
+                    lasterror = results[index].error
+                    continue
+                starttime = clock.now()
                 try:
-                    results[index] = getattr(obj, func.__name__)(*args, **kwargs)
-                except (HeatmiserResponseError, serial.SerialException,
-                            HeatmiserControllerTimeError) as err:
+                    value = getattr(obj, func.__name__)(*args, **kwargs)
+                except (HeatmiserError, serial.SerialException) as err:
                     logging.getLogger(__name__).warning("C%i %s failed due to %s",
-                                                   obj.set_address, func.__name__, lasterror)
+                                                   obj.set_address, func.__name__, err)
                     lasterror = err
+                    results[index] = DeviceResult(obj, error=err, latency=clock.now() - starttime)
                     continue
+                results[index] = DeviceResult(obj, value, latency=clock.now() - starttime)
 
-            if all(result is None for result in results):
+            if all(not result.is_ok() for result in results):
                 raise HeatmiserResponseError("All failed, last error was %s"%lasterror)
 
             return results
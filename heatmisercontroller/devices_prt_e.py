@@ -5,8 +5,8 @@ PRT-E Thermostat classes on the Heatmiser network
 Ian Horsley 2018
 """
 from __future__ import absolute_import
-import time
 
+from . import clock
 from .genericdevice import HeatmiserDevice, DEVICETYPES
 from .fields import HeatmiserFieldSingle, HeatmiserFieldSingleReadOnly
 from .fields import HeatmiserFieldDouble, HeatmiserFieldDoubleReadOnly
@@ -141,7 +141,7 @@ class ThermoStatWeek(HeatmiserDevice):
         """Process data for a single field storing in relevant."""
         super()._procfield(data, fieldinfo)
 
-        if fieldinfo.name == 'currenttime':
+        if fieldinfo.name == 'currenttime' and not self._restoring:
             self._checkcontrollertime()
 
     def _checkcontrollertime(self):
@@ -155,6 +155,19 @@ class ThermoStatWeek(HeatmiserDevice):
             else:
                 raise
 
+    def get_snapshot(self):
+        """Returns dictionary of field data and read times, including time drift history"""
+        snapshot = super().get_snapshot()
+        snapshot['timedrift'] = list(self.currenttime.driftsamples)
+        return snapshot
+
+    def restore_snapshot(self, snapshot):
+        """Restores field data and read times from a snapshot, including time drift history"""
+        restored = super().restore_snapshot(snapshot)
+        if self.currenttime.check_data_valid():
+            self.currenttime.restore_drift(snapshot.get('timedrift'))
+        return restored
+
     def get_variables(self):
         """Gets setroomtemp to hotwaterdemand fields from device"""
         self.get_field_range('setroomtemp', 'hotwaterdemand')
@@ -170,7 +183,7 @@ class ThermoStatWeek(HeatmiserDevice):
 
     def nexttarget(self):
         """get next heat target"""
-        return self.heat_schedule.get_next_schedule_item(self.currenttime.localtimearray())
+        return self.heat_schedule.get_next_schedule_item(self.currenttime.remote_timearray())
 
     def print_target(self):
         """Returns text describing current heating state"""
@@ -216,6 +229,15 @@ class ThermoStatWeek(HeatmiserDevice):
         """Readtime, getting from device if required"""
         return self.read_field('currenttime', maxage)
 
+    def maintain_time(self):
+        """Read or correct device time only when the drift model expects the error to be large"""
+        self.read_field('currenttime')
+        if self.set_autocorrectime is True and self.currenttime.needs_resync():
+            self._logger.info("C%i predicted time error %.1f, resetting time",
+                                self.set_address, self.currenttime.predicted_timeerr())
+            self.set_time()
+        return self.currenttime.get_value()
+
     ## External functions for setting data
 
     def set_heating_schedule(self, day, schedule):
@@ -226,7 +248,7 @@ class ThermoStatWeek(HeatmiserDevice):
 
     def set_time(self):
         """set time on device to match current localtime on server"""
-        timenow = time.time() + 0.5 #allow a little time for any delay in setting
+        timenow = clock.now() + 0.5 #allow a little time for any delay in setting
         return self.set_field('currenttime', self.currenttime.localtimearray(timenow))
 
     #overriding
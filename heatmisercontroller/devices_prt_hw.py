@@ -85,7 +85,7 @@ class ThermoStatHotWaterWeek(ThermoStatWeek):
             return self.thermostat.TEMP_STATE_HOLIDAY
         self.read_field('currenttime', MAX_AGE_MEDIUM)
 
-        locatimenow = self.currenttime.localtimearray()
+        locatimenow = self.currenttime.remote_timearray()
         scheduletarget = self.water_schedule.get_current_schedule_item(locatimenow)
 
         if scheduletarget[SCH_ENT_TEMP] != self.hotwaterdemand:
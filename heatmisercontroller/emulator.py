@@ -0,0 +1,426 @@
+"""Emulation of Heatmiser V3 devices for testing and benchmarking without hardware
+
+HeatmiserEmulator holds up to 32 virtual PRT-E and PRT-HW stats, each with DCB
+memory laid out from the device classes. It answers V3 read and write frames,
+including read all and broadcast writes, with real CRCs. Response latency,
+bus reset timing, noise (corrupted responses) and dropouts (missing responses)
+are configurable, and air temperatures evolve as the stats heat.
+
+The emulator can be reached in process through EmulatorSerial, for example
+
+    emulator = HeatmiserEmulator()
+    emulator.add_stat(1, 'prt_e_model')
+    HeatmiserNetwork(configfile, adaptor_factory=lambda setup: EmulatorAdaptor(setup, emulator))
+
+or through a pseudo terminal with PtyTransport, whose port can be used as the
+serial port of an unmodified HeatmiserAdaptor.
+"""
+from __future__ import absolute_import
+import os
+import time
+import random
+import logging
+import threading
+import serial
+
+from . import clock
+from .adaptor import HeatmiserAdaptor
+from .framing import Crc16
+from .genericdevice import DEVICETYPES
+from . import devices_prt_e, devices_prt_hw #pylint: disable=unused-import
+from .hm_constants import BYTEMASK, SLAVE_ADDR_MIN, SLAVE_ADDR_MAX, BROADCAST_ADDR
+from .hm_constants import FUNC_READ, FUNC_WRITE, RW_LENGTH_ALL, DCB_START, MIN_FRAME_SEND_LENGTH
+from .hm_constants import MIN_FRAME_READ_RESP_LENGTH, FRAME_WRITE_RESP_LENGTH, CRC_LENGTH
+from .hm_constants import FS_DEST_ADDR, FS_LEN, FS_SOURCE_ADDR, FS_FUNC_CODE
+from .hm_constants import MAX_PAYLOAD_SEND_LENGTH
+
+BITS_PER_BYTE = 10 #start bit, 8 data bits and stop bit
+MAX_STEP = 60 #seconds, longest step when evolving temperatures
+
+#values of fields when a stat is created, in field units
+DEFAULT_VALUES = {
+    'vendor': 0, 'version': 2, 'tempformat': 0, 'switchdiff': 1, 'frostprotdisable': 0,
+    'caloffset': 0, 'outputdelay': 0, 'updwnkeylimit': 0, 'sensorsavaliable': 0, 'optimstart': 0,
+    'rateofchange': 20, 'frosttemp': 12, 'setroomtemp': 20, 'floormaxlimit': 28,
+    'floormaxlimitenable': 0, 'onoff': 1, 'keylock': 0, 'runmode': 0, 'holidayhours': 0,
+    'tempholdmins': 0, 'remoteairtemp': 0, 'floortemp': 0, 'airtemp': 18, 'errorcode': 0,
+    'heatingdemand': 0, 'hotwaterdemand': 0
+}
+DEFAULT_HEAT = [7, 0, 21, 9, 0, 16, 17, 0, 21, 22, 0, 16]
+DEFAULT_WATER = [7, 0, 8, 0, 17, 0, 18, 0, 24, 0, 24, 0, 24, 0, 24, 0]
+
+class VirtualStat():
+    """Emulated stat holding DCB memory
+
+    Heating switches on below setroomtemp less switchdiff, or frosttemp when off or in frost
+    mode, and off once the target is reached. The air warms at heat_rate while heating and
+    otherwise cools towards ambient, losing loss_rate of the difference per second."""
+    def __init__(self, address, model='prt_e_model', prog_mode='day', starttime=None,
+                    ambient=12.0, heat_rate=1.0 / 600, loss_rate=1.0 / 7200, sensor_noise=0.0, rand=None):
+        if not SLAVE_ADDR_MIN <= address <= SLAVE_ADDR_MAX:
+            raise ValueError("Stat address %i out of range" % address)
+        self.address = address
+        self.model = model
+        self.prog_mode = prog_mode
+        self.ambient = ambient
+        self.heat_rate = heat_rate
+        self.loss_rate = loss_rate
+        self.sensor_noise = sensor_noise #standard deviation of air temperature readings
+        self._random = rand if rand is not None else random.Random()
+        self.time_offset = 0.0 #seconds stat clock is ahead of local time
+
+        layout = DEVICETYPES[model][prog_mode](None, {'address': address, 'expected_model': model,
+                                                        'expected_prog_mode': prog_mode})
+        self.fields = {field.name: field for field in layout.fields}
+        self.dcb_length = layout.dcb_length
+        self.memory = bytearray(self.dcb_length)
+        self._dcbaddresses = {} #unique address to dcb address
+        for field in layout.fields:
+            for offset in range(field.fieldlength):
+                self._dcbaddresses[field.address + offset] = field.dcbaddress + offset
+
+        for name, value in DEFAULT_VALUES.items():
+            if name in self.fields:
+                self.set_value(name, value)
+        for name in self.fields:
+            if name.endswith('_heat'):
+                self.set_value(name, DEFAULT_HEAT)
+            elif name.endswith('_water'):
+                self.set_value(name, DEFAULT_WATER)
+        self.set_value('DCBlen', self.dcb_length)
+        self.set_value('model', layout.model.readvalues[model])
+        self.set_value('address', address)
+        self.set_value('programmode', layout.programmode.readvalues[prog_mode])
+        self.airtemp = float(DEFAULT_VALUES['airtemp'])
+        self.heating = False
+        self.lastupdate = clock.now() if starttime is None else starttime
+
+    def __repr__(self):
+        return "VirtualStat(%i %s %s)" % (self.address, self.model, self.prog_mode)
+
+    def set_value(self, name, value):
+        """Set field in memory from value in field units, or list of bytes for multi byte fields"""
+        field = self.fields[name]
+        if field.fieldlength > 2:
+            data = list(value)
+        else:
+            raw = int(round(value * field.divisor))
+            data = [raw] if field.fieldlength == 1 else [(raw >> 8) & BYTEMASK, raw & BYTEMASK]
+        self.memory[field.dcbaddress:field.dcbaddress + field.fieldlength] = bytearray(data)
+
+    def get_value(self, name):
+        """Returns field value from memory in field units, or list of bytes for multi byte fields"""
+        field = self.fields[name]
+        data = self.memory[field.dcbaddress:field.dcbaddress + field.fieldlength]
+        if field.fieldlength > 2:
+            return list(data)
+        raw = data[0] if field.fieldlength == 1 else data[0] * 256 + data[1]
+        return raw / field.divisor if field.divisor != 1 else raw
+
+    def advance(self, timenow):
+        """Evolve air temperature and heating demand up to timenow"""
+        while self.lastupdate < timenow:
+            step = min(MAX_STEP, timenow - self.lastupdate)
+            if self.get_value('onoff') == 0 or self.get_value('runmode') == 1:
+                target = self.get_value('frosttemp')
+            else:
+                target = self.get_value('setroomtemp')
+            if self.heating and self.airtemp >= target:
+                self.heating = False
+            elif not self.heating and self.airtemp <= target - self.get_value('switchdiff'):
+                self.heating = True
+            if self.heating:
+                self.airtemp += self.heat_rate * step
+            else:
+                self.airtemp -= (self.airtemp - self.ambient) * self.loss_rate * step
+            self.lastupdate += step
+        self.set_value('heatingdemand', 1 if self.heating else 0)
+        reading = self.airtemp + (self._random.gauss(0, self.sensor_noise) if self.sensor_noise else 0)
+        self.set_value('airtemp', min(max(reading, 0), 99))
+        self._update_time(timenow)
+
+    def _update_time(self, timenow):
+        """Set currenttime from the stat clock"""
+        if 'currenttime' not in self.fields:
+            return
+        localtime = time.localtime(timenow + self.time_offset)
+        self.set_value('currenttime', [localtime.tm_wday + 1, localtime.tm_hour, localtime.tm_min,
+                                        min(localtime.tm_sec, 59)])
+
+    def read(self, start, length, timenow):
+        """Returns bytes for read request, None if the range is not all in the DCB"""
+        self.advance(timenow)
+        if length == RW_LENGTH_ALL and start == DCB_START:
+            return bytes(self.memory)
+        try:
+            return bytes(bytearray(self.memory[self._dcbaddresses[address]]
+                                    for address in range(start, start + length)))
+        except KeyError:
+            return None
+
+    def write(self, start, payload, timenow):
+        """Write payload to writable fields, other bytes are ignored
+
+        Returns False if the range is not all in the DCB."""
+        self.advance(timenow)
+        if any(address not in self._dcbaddresses for address in range(start, start + len(payload))):
+            return False
+        for field in self.fields.values():
+            if not field.writeable or field.address < start or field.address + field.fieldlength > start + len(payload):
+                continue
+            data = list(payload[field.address - start:field.address - start + field.fieldlength])
+            if field.fieldlength == 2:
+                data.reverse() #written low byte first, read high byte first
+            self._write_field(field, data, timenow)
+        return True
+
+    def _write_field(self, field, data, timenow):
+        """Store written field data, applying side effects"""
+        if field.name == 'currenttime':
+            written = ((data[0] - 1) * 86400 + data[1] * 3600 + data[2] * 60 + data[3])
+            localtime = time.localtime(timenow)
+            local = (localtime.tm_wday * 86400 + localtime.tm_hour * 3600
+                        + localtime.tm_min * 60 + localtime.tm_sec)
+            self.time_offset = written - local
+            self._update_time(timenow)
+            return
+        if field.name == 'hotwaterdemand':
+            data = [0 if data[0] == 2 else data[0]] #override off reads as off
+        self.memory[field.dcbaddress:field.dcbaddress + field.fieldlength] = bytearray(data)
+
+class HeatmiserEmulator():
+    """Bus of virtual stats answering V3 frames
+
+    latency is the time from the end of a request to the first byte of the response, with
+    latency_jitter added at random. Requests arriving less than bus_reset_time after the bus
+    was last busy are ignored, as are frames failing CRC checks. noise is the probability of
+    a response having a corrupted byte and dropout the probability of no response."""
+    def __init__(self, latency=0.0, latency_jitter=0.0, bus_reset_time=0.0, noise=0.0, dropout=0.0,
+                    baudrate=4800, seed=None, master_addr_min=0x81):
+        self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.bus_reset_time = bus_reset_time
+        self.noise = noise
+        self.dropout = dropout
+        self.baudrate = baudrate
+        self.master_addr_min = master_addr_min
+        self.random = random.Random(seed)
+        self.stats = {}
+        self.busyuntil = 0.0
+        self.counts = {'frames': 0, 'responses': 0, 'crc_errors': 0, 'too_soon': 0,
+                        'dropouts': 0, 'corrupted': 0, 'ignored': 0, 'broadcasts': 0}
+        self._lock = threading.Lock()
+
+    def add_stat(self, address, model='prt_e_model', prog_mode='day', **kwargs):
+        """Add virtual stat at address, kwargs are passed to VirtualStat"""
+        if address in self.stats:
+            raise ValueError("Stat address %i already in use" % address)
+        stat = VirtualStat(address, model, prog_mode, rand=self.random, **kwargs)
+        self.stats[address] = stat
+        return stat
+
+    def byte_time(self):
+        """Time to transmit a byte on the wire, 0 if baudrate is None"""
+        return BITS_PER_BYTE / float(self.baudrate) if self.baudrate else 0.0
+
+    def handle_frame(self, frame, timenow=None):
+        """Process request frame received at timenow
+
+        Returns response bytes and delay to the first byte, or None and 0 if there is no response."""
+        if timenow is None:
+            timenow = clock.now()
+        frame = bytearray(frame)
+        with self._lock:
+            self.counts['frames'] += 1
+            response = self._respond(frame, timenow)
+            if response is None:
+                return None, 0.0
+            if self.dropout and self.random.random() < self.dropout:
+                self.counts['dropouts'] += 1
+                return None, 0.0
+            if self.noise and self.random.random() < self.noise:
+                self.counts['corrupted'] += 1
+                response[self.random.randrange(len(response))] ^= 1 << self.random.randrange(8)
+            delay = self.latency + (self.random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+            self.busyuntil = timenow + delay + len(response) * self.byte_time()
+            self.counts['responses'] += 1
+            return bytes(response), delay
+
+    def _respond(self, frame, timenow):
+        """Returns response to a frame, None if there should be no response"""
+        if timenow < self.busyuntil + self.bus_reset_time:
+            self.counts['too_soon'] += 1
+            return None
+        if (len(frame) < MIN_FRAME_SEND_LENGTH or frame[FS_LEN] != len(frame)
+                or list(Crc16().run(list(frame[:-CRC_LENGTH]))) != list(frame[-CRC_LENGTH:])):
+            self.counts['crc_errors'] += 1
+            return None
+        destination = frame[FS_DEST_ADDR]
+        source = frame[FS_SOURCE_ADDR]
+        function = frame[FS_FUNC_CODE]
+        start = frame[4] | frame[5] << 8
+        length = frame[6] | frame[7] << 8
+        payload = frame[8:-CRC_LENGTH]
+        if function == FUNC_WRITE and (length != len(payload) or length > MAX_PAYLOAD_SEND_LENGTH):
+            self.counts['ignored'] += 1
+            return None
+        if destination == BROADCAST_ADDR:
+            if function == FUNC_WRITE:
+                self.counts['broadcasts'] += 1
+                for stat in self.stats.values():
+                    stat.write(start, payload, timenow)
+            return None
+        stat = self.stats.get(destination)
+        if stat is None or source < self.master_addr_min or function not in (FUNC_READ, FUNC_WRITE):
+            self.counts['ignored'] += 1
+            return None
+        if function == FUNC_WRITE:
+            if not stat.write(start, payload, timenow):
+                self.counts['ignored'] += 1
+                return None
+            response = [source, FRAME_WRITE_RESP_LENGTH, 0, destination, FUNC_WRITE]
+        else:
+            data = stat.read(start, length, timenow)
+            if data is None:
+                self.counts['ignored'] += 1
+                return None
+            framelength = MIN_FRAME_READ_RESP_LENGTH + len(data)
+            response = [source, framelength & BYTEMASK, framelength >> 8, destination, FUNC_READ,
+                        start & BYTEMASK, start >> 8, len(data) & BYTEMASK, len(data) >> 8] + list(bytearray(data))
+        return bytearray(response + Crc16().run(response))
+
+class EmulatorSerial(serial.SerialBase):
+    """In process serial port connected to an emulator
+
+    Response bytes become available after the emulator latency and their time on the wire,
+    so late responses are left in the input buffer as on a real bus."""
+    #defaults for settings that are not in the configuration
+    COM_TIMEOUT = 1.0
+    COM_START_TIMEOUT = 0.1
+    COM_PROBE_START_TIMEOUT = 0.05
+    COM_MIN_TIMEOUT = 0.1
+    COM_SEND_MIN_TIME = 1.0
+    COM_BUS_RESET_TIME = 0.1
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self._input = [] #(time available, byte)
+        super(EmulatorSerial, self).__init__()
+
+    def open(self):
+        """Open port, the emulator does not need a port name"""
+        self.is_open = True
+
+    def close(self):
+        """Close port"""
+        self.is_open = False
+
+    def _reconfigure_port(self, force_update=False):
+        """Nothing to configure"""
+
+    @property
+    def in_waiting(self):
+        """Number of bytes received"""
+        timenow = clock.now()
+        return sum(1 for available, _ in self._input if available <= timenow)
+
+    def reset_input_buffer(self):
+        """Discard bytes received"""
+        timenow = clock.now()
+        self._input = [(available, byte) for available, byte in self._input if available > timenow]
+
+    def write(self, data):
+        """Send frame to emulator, scheduling any response bytes"""
+        timenow = clock.now()
+        data = bytes(bytearray(data))
+        bytetime = self.emulator.byte_time()
+        response, delay = self.emulator.handle_frame(data, timenow + len(data) * bytetime)
+        if response is not None:
+            start = timenow + len(data) * bytetime + delay
+            self._input.extend((start + (index + 1) * bytetime, byte)
+                                for index, byte in enumerate(bytearray(response)))
+        return len(data)
+
+    def read(self, size=1):
+        """Returns up to size bytes received before the timeout"""
+        timenow = clock.now()
+        deadline = timenow + self.timeout if self.timeout is not None else float('inf')
+        if self._input:
+            wake = min(self._input[min(size, len(self._input)) - 1][0], deadline)
+        else:
+            wake = deadline if self.timeout is not None else timenow
+        if wake > timenow:
+            clock.sleep(wake - timenow)
+        count = 0
+        while count < min(size, len(self._input)) and self._input[count][0] <= wake:
+            count += 1
+        data, self._input = self._input[:count], self._input[count:]
+        return bytes(bytearray(byte for _, byte in data))
+
+class EmulatorAdaptor(HeatmiserAdaptor):
+    """Adaptor connected to an emulator in process instead of a serial port"""
+    def __init__(self, setup, emulator):
+        self.emulator = emulator
+        super(EmulatorAdaptor, self).__init__(setup)
+
+    def _create_port(self):
+        """Returns port connected to the emulator"""
+        return EmulatorSerial(self.emulator)
+
+class PtyTransport():
+    """Serves an emulator on a pseudo terminal, port is the name to open as a serial port"""
+    def __init__(self, emulator):
+        self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self.emulator = emulator
+        self.port = None
+        self._masterfd = None
+        self._slavefd = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Create pseudo terminal and start serving, returns port name"""
+        import tty
+        self._masterfd, self._slavefd = os.openpty()
+        tty.setraw(self._slavefd)
+        self.port = os.ttyname(self._slavefd)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='HeatmiserEmulatorPty')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop serving and close pseudo terminal"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fdesc in (self._masterfd, self._slavefd):
+            if fdesc is not None:
+                os.close(fdesc)
+        self._masterfd = self._slavefd = None
+
+    def _serve(self):
+        """Collect request frames from the master side and write responses"""
+        import select
+        buffer = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._masterfd], [], [], 0.05)
+            if not readable:
+                continue
+            buffer.extend(os.read(self._masterfd, 1024))
+            while len(buffer) > FS_LEN:
+                framelength = buffer[FS_LEN]
+                if not MIN_FRAME_SEND_LENGTH <= framelength <= MIN_FRAME_SEND_LENGTH + MAX_PAYLOAD_SEND_LENGTH:
+                    del buffer[0] #not the start of a frame, resynchronise
+                    continue
+                if len(buffer) < framelength:
+                    break
+                frame, buffer = bytes(buffer[:framelength]), buffer[framelength:]
+                response, delay = self.emulator.handle_frame(frame)
+                if response is not None:
+                    if delay > 0:
+                        clock.sleep(delay)
+                    os.write(self._masterfd, response)
@@ -17,3 +17,12 @@ class HeatmiserControllerTimeError(HeatmiserError):
 
 class HeatmiserControllerSetupInitError(HeatmiserError):
     """Raise this when init fails."""
+
+class HeatmiserCapacityError(HeatmiserError):
+    """Raise this when polling needs more bus time than is available."""
+
+class HeatmiserDeadlineError(HeatmiserError):
+    """Raise this when an operation cannot complete before its deadline."""
+
+class HeatmiserCircuitOpenError(HeatmiserResponseError):
+    """Raise this when a device has failed repeatedly and calls to it are being skipped."""
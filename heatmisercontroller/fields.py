@@ -2,11 +2,12 @@
 from __future__ import absolute_import
 from __future__ import division
 import logging
-import time
 
+from . import clock
 from .hm_constants import BYTEMASK
 from .exceptions import HeatmiserResponseError
 from .observer import Notifier
+from .freshness import FreshnessStats, add_ratios
 
 #assusme that default comes first
 #need to swtich to ordered dictionary to make it possible to get default value
@@ -31,6 +32,7 @@ class HeatmiserFieldUnknown(Notifier):
         self.data = None
         self.value = None
         self.lastreadtime = None #used to record when the field was last read
+        self.freshness = FreshnessStats()
 
     def __int__(self):
         return self.value
@@ -65,6 +67,7 @@ class HeatmiserFieldUnknown(Notifier):
 
     def update_data(self, data, readtime):
         """update stored data and readtime. Don't compute value because don't know how to map"""
+        self.freshness.record_read(self.lastreadtime, readtime, self.max_age)
         self.data = data
         self.lastreadtime = readtime
 
@@ -109,11 +112,17 @@ class HeatmiserFieldUnknown(Notifier):
         else:
             maxage = maxagein
         #now check time
-        if time.time() - self.lastreadtime > maxage:
+        if clock.now() - self.lastreadtime > maxage:
             self._logger.debug("Data item %s too old", self.name)
             return False
         return True
 
+    def freshness_report(self, timenow=None):
+        """Returns dictionary of read, cache hit and age statistics"""
+        if timenow is None:
+            timenow = clock.now()
+        return add_ratios(self.freshness.report(self.lastreadtime, self.max_age, timenow))
+
 class HeatmiserField(HeatmiserFieldUnknown):
     """Base class for fields providing basic method calls"""
     #single value and hence single range
@@ -158,6 +167,7 @@ class HeatmiserField(HeatmiserFieldUnknown):
             raise HeatmiserResponseError('Value %d is unexpected for %s, expected %d'%(
                                             value, self.name, self.expectedvalue))
         self._validate_range(value)
+        self.freshness.record_read(self.lastreadtime, readtime, self.max_age)
         self.data = data
         self.value = value
         self.lastreadtime = readtime
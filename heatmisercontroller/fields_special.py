@@ -1,10 +1,14 @@
 """special field definitions for Heatmiser protocol"""
 from __future__ import absolute_import
 import time
+import math
+from collections import deque
 
+from . import clock
 from .fields import HeatmiserFieldSingle, HeatmiserFieldSingleReadOnly, HeatmiserFieldMulti
 from .fields import VALUES_ON_OFF
 from .hm_constants import CURRENT_TIME_DAY, CURRENT_TIME_HOUR, CURRENT_TIME_MIN, CURRENT_TIME_SEC, TIME_ERR_LIMIT
+from .hm_constants import TIME_ERR_MARGIN, TIME_DRIFT_SAMPLES, TIME_DRIFT_MIN_SPAN
 from .exceptions import HeatmiserResponseError, HeatmiserControllerTimeError
 
 class HeatmiserFieldHotWaterVersion(HeatmiserFieldSingleReadOnly):
@@ -34,19 +38,98 @@ class HeatmiserFieldHotWaterDemand(HeatmiserFieldSingle):
             super().update_value(value, writetime)
 
 class HeatmiserFieldTime(HeatmiserFieldMulti):
-    """Class for time field"""
+    """Class for time field
+
+    Keeps a short history of time errors to model the drift of the device clock, so that
+    the remote time can be predicted and the clock only read when the error may be large."""
     fieldlength = 4
 
     def __init__(self, name, address, max_age):
         self.timeerr = None
+        self.driftsamples = deque(maxlen=TIME_DRIFT_SAMPLES) #list of local time and time error pairs
         validrange = [[1, 7], [0, 23], [0, 59], [0, 59]] #fixed because functions depend on this range.
         super().__init__(name, address, validrange, max_age)
 
+    def _reset(self):
+        """Reset data, values and drift model to unknown."""
+        super()._reset()
+        self.timeerr = None
+        self.driftsamples.clear()
+
     def get_value(self):
         """Return estimated remote time."""
-        estimate = time.time() + self.timeerr
+        estimate = clock.now() + self.predicted_timeerr()
         return self.localtimearray(estimate)
 
+    def remote_timearray(self):
+        """Return estimated remote time, or local time if there is no estimate"""
+        if self.timeerr is None:
+            return self.localtimearray(clock.now())
+        return self.get_value()
+
+    def _drift_model(self):
+        """Least squares fit of time error against local time, returns reference time, error and rate"""
+        if not self.is_drift_modelled():
+            #not enough spread to estimate rate, so use latest error without drift
+            return self.driftsamples[-1][0], self.driftsamples[-1][1], 0.0
+        count = len(self.driftsamples)
+        meantime = sum(sample[0] for sample in self.driftsamples) / count
+        meanerr = sum(sample[1] for sample in self.driftsamples) / count
+        variance = sum((sample[0] - meantime) ** 2 for sample in self.driftsamples)
+        covariance = sum((sample[0] - meantime) * (sample[1] - meanerr) for sample in self.driftsamples)
+        return meantime, meanerr, covariance / variance
+
+    def is_drift_modelled(self):
+        """Returns True if there are enough time comparisons to trust the drift rate"""
+        return (len(self.driftsamples) >= 2 and
+                self.driftsamples[-1][0] - self.driftsamples[0][0] >= TIME_DRIFT_MIN_SPAN)
+
+    def drift_rate(self):
+        """Return the estimated drift of the remote clock in seconds per second"""
+        if len(self.driftsamples) == 0:
+            return 0.0
+        return self._drift_model()[2]
+
+    def predicted_timeerr(self, timenow=None):
+        """Return the predicted time error at a local time, default now"""
+        if len(self.driftsamples) == 0:
+            return self.timeerr
+        if timenow is None:
+            timenow = clock.now()
+        reftime, referr, rate = self._drift_model()
+        return referr + rate * (timenow - reftime)
+
+    def time_to_err_limit(self, timenow=None):
+        """Return seconds until predicted error reaches the margin of TIME_ERR_LIMIT"""
+        if timenow is None:
+            timenow = clock.now()
+        errlimit = TIME_ERR_LIMIT * TIME_ERR_MARGIN
+        predictederr = self.predicted_timeerr(timenow)
+        if predictederr is None:
+            return 0
+        if abs(predictederr) >= errlimit:
+            return 0
+        rate = self.drift_rate()
+        if rate == 0:
+            return float('inf')
+        return (math.copysign(errlimit, rate) - predictederr) / rate
+
+    def needs_resync(self, timenow=None):
+        """Returns True if the predicted error is approaching TIME_ERR_LIMIT"""
+        return self.time_to_err_limit(timenow) <= 0
+
+    def check_data_fresh(self, maxagein=None):
+        """check whether data is fresh
+
+        Once the drift is modelled the field default age is replaced by the predicted error,
+        so the time is only read again when the error is expected to approach the limit."""
+        if maxagein is None and self.check_data_valid() and self.is_drift_modelled():
+            if self.needs_resync():
+                self._logger.debug("Data item %s predicted error too large", self.name)
+                return False
+            return True
+        return super().check_data_fresh(maxagein)
+
     def comparecontrollertime(self):
         """Compare device and local time difference against threshold"""
         # Now do same sanity checking
@@ -60,11 +143,7 @@ class HeatmiserFieldTime(HeatmiserFieldMulti):
         localtimearray = self.localtimearray(self.lastreadtime) #time that time field was read
         localweeksecs = self._weeksecs(localtimearray)
         remoteweeksecs = self._weeksecs(self.value)
-        directdifference = remoteweeksecs - localweeksecs #absolute remote time relative to local time
-        wrappeddifferenceup = directdifference - self.DAYSECS * 7 #compute the absolute difference on rollover
-        wrappeddifferencedown = directdifference + self.DAYSECS * 7 #compute the absolute difference on rollover
-        self.timeerr = min([directdifference, wrappeddifferenceup, wrappeddifferencedown], key=abs)
-        self._logger.debug("Local time %i, remote time %i, error %i"%(localweeksecs, remoteweeksecs, self.timeerr))
+        self._update_timeerr()
 
         if abs(self.timeerr) > self.DAYSECS:
             raise HeatmiserControllerTimeError("Incorrect day : local is %s, sensor is %s" % (localtimearray[CURRENT_TIME_DAY], self.value[CURRENT_TIME_DAY]))
@@ -72,10 +151,40 @@ class HeatmiserFieldTime(HeatmiserFieldMulti):
         if abs(self.timeerr) > TIME_ERR_LIMIT:
             raise HeatmiserControllerTimeError("Time Error %d greater than %d: local is %s, sensor is %s" % (self.timeerr, TIME_ERR_LIMIT, localweeksecs, remoteweeksecs))
 
+    def update_value(self, value, writetime):
+        """Update the field value once successfully written and estimate the resulting error"""
+        super().update_value(value, writetime)
+        self.driftsamples.clear() #clock has been set so previous drift no longer applies
+        self._update_timeerr()
+
+    def restore_drift(self, samples):
+        """Restore drift history from a snapshot, without checking the error against the limit
+
+        With no history the error is recomputed from the restored value and read time."""
+        if samples:
+            self.driftsamples.clear()
+            self.driftsamples.extend(tuple(sample) for sample in samples)
+            self.timeerr = self.driftsamples[-1][1]
+        else:
+            self._update_timeerr()
+
+    def _update_timeerr(self):
+        """Compute error between the stored remote time and local time when it was stored"""
+        localweeksecs = self._weeksecs(self.localtimearray(self.lastreadtime))
+        remoteweeksecs = self._weeksecs(self.value)
+        directdifference = remoteweeksecs - localweeksecs #absolute remote time relative to local time
+        wrappeddifferenceup = directdifference - self.DAYSECS * 7 #compute the absolute difference on rollover
+        wrappeddifferencedown = directdifference + self.DAYSECS * 7 #compute the absolute difference on rollover
+        self.timeerr = min([directdifference, wrappeddifferenceup, wrappeddifferencedown], key=abs)
+        self.driftsamples.append((self.lastreadtime, self.timeerr))
+        self._logger.debug("Local time %i, remote time %i, error %i"%(localweeksecs, remoteweeksecs, self.timeerr))
+
     @staticmethod
-    def localtimearray(timenow=time.time()):
+    def localtimearray(timenow=None):
         """creates an array in heatmiser format for local time. Day 1-7, 1=Monday"""
-        #input time.time() (not local)
+        #input clock.now() (not local), defaults to now
+        if timenow is None:
+            timenow = clock.now()
         localtimenow = time.localtime(timenow)
         nowday = localtimenow.tm_wday + 1 #python tm_wday, range [0, 6], Monday is 0
         nowsecs = min(localtimenow.tm_sec, 59) #python tm_sec range[0, 61]
@@ -9,6 +9,8 @@ from .hm_constants import MASTER_ADDR_MIN, MASTER_ADDR_MAX, SLAVE_ADDR_MIN, SLAV
 from .hm_constants import HMV3_ID
 from .exceptions import HeatmiserResponseError, HeatmiserResponseErrorCRC
 
+_LOGGER = logging.getLogger(__name__)
+
 ### low level framing functions
 
 def form_read_frame(destination, protocol, source, start, length):
@@ -122,7 +124,7 @@ def verify_response(protocol, source, destination, expected_function, expected_l
         # check function
         _check_response_frame_function(expected_function, data)
     except HeatmiserResponseError as err:
-        logging.getLogger(__name__).warning("C%s Invalid Response: %s: %s", source, err, data)
+        _LOGGER.warning("C%s Invalid Response: %s: %s", source, err, data)
         raise
 
     ## missing check that it is valid for this type of controller. Use DCBUnique function not false.
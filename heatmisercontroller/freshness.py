@@ -0,0 +1,76 @@
+"""Freshness telemetry for field data
+
+Each field records how often it is read from the bus, how often requests are
+served from cache, the age of data when it is served and the time its data
+spent past max_age before being refreshed. Reports can be combined across
+fields, devices and networks to see where polling needs tuning.
+"""
+from __future__ import absolute_import
+
+from .metrics import Histogram
+
+AGE_BUCKETS = (1, 5, 10, 30, 60, 300, 900, 3600, 86400) #seconds
+
+class FreshnessStats():
+    """Read, cache hit and age statistics for one field"""
+    def __init__(self):
+        self.reads = 0
+        self.hits = 0
+        self.misses = 0
+        self.ages = Histogram(AGE_BUCKETS) #age of data when served
+        self.stale_time = 0.0 #time past max_age before data was refreshed
+
+    def record_read(self, previousreadtime, readtime, max_age):
+        """Record a read from the bus, adding any time the previous data was past max_age"""
+        self.reads += 1
+        if previousreadtime is not None and readtime is not None and max_age is not None:
+            self.stale_time += max(0.0, readtime - previousreadtime - max_age)
+
+    def record_request(self, fresh):
+        """Record a request for the field, which was a cache hit if data was fresh"""
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def record_serve(self, age):
+        """Record the age of data returned to a caller"""
+        self.ages.observe(age)
+
+    def report(self, lastreadtime=None, max_age=None, timenow=None):
+        """Returns dictionary of statistics, with time past max_age including any current staleness"""
+        stale_time = self.stale_time
+        if lastreadtime is not None and max_age is not None and timenow is not None:
+            stale_time += max(0.0, timenow - lastreadtime - max_age)
+        return {
+            'reads': self.reads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'served': self.ages.count,
+            'age_sum': self.ages.sum,
+            'age_buckets': self.ages.cumulative_counts(),
+            'stale_time': stale_time
+        }
+
+def combine_reports(reports):
+    """Combine freshness reports by summing, adding hit ratio and mean age at serve"""
+    total = {'reads': 0, 'hits': 0, 'misses': 0, 'served': 0, 'age_sum': 0.0, 'stale_time': 0.0}
+    buckets = None
+    for report in reports:
+        for key in total:
+            total[key] += report[key]
+        if buckets is None:
+            buckets = [list(bucket) for bucket in report['age_buckets']]
+        else:
+            for bucket, (_, count) in zip(buckets, report['age_buckets']):
+                bucket[1] += count
+    total['age_buckets'] = [tuple(bucket) for bucket in buckets] if buckets is not None else []
+    add_ratios(total)
+    return total
+
+def add_ratios(report):
+    """Add hit ratio and mean age at serve to a report, None where there is no data"""
+    requests = report['hits'] + report['misses']
+    report['hit_ratio'] = report['hits'] / float(requests) if requests else None
+    report['mean_age'] = report['age_sum'] / report['served'] if report['served'] else None
+    return report
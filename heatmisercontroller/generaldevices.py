@@ -7,6 +7,7 @@ Ian Horsley 2018
 """
 from __future__ import absolute_import
 
+from . import clock
 from .genericdevice import HeatmiserDevice
 from .devices_prt_hw import ThermoStatHotWaterDay
 from .fields import HeatmiserFieldUnknown, HeatmiserFieldSingleReadOnly
@@ -32,9 +33,17 @@ class ThermoStatUnknown(HeatmiserDevice):
         ])
         
     def _set_expected_field_values(self):
-        """set the expected values for fields that should be fixed. Overriding prevents expected model being setup."""
+        """set the expected values for fields that should be fixed. Overriding prevents expected model and length being setup."""
         self.address.expectedvalue = self.set_address
-        self.DCBlen.expectedvalue = self.dcb_length
+
+    def probe(self):
+        """Reads header fields in a single attempt and returns the device fingerprint"""
+        blocklength = self.programmode.last_dcb_byte_address() - self.DCBlen.dcbaddress + 1
+        rawdata = self._adaptor.probe_device(self.set_address, self.set_protocol,
+                                                self.DCBlen.address, blocklength)
+        self.lastreadtime = clock.now()
+        self._procpartpayload(rawdata, 'DCBlen', 'programmode')
+        return self.fingerprint()
 
 class HeatmiserBroadcastDevice(ThermoStatHotWaterDay):
     """Broadcast device class for broadcast set functions and managing reading on all devices
@@ -57,11 +66,11 @@ class HeatmiserBroadcastDevice(ThermoStatHotWaterDay):
     
     #run read functions on all stats
     @run_function_on_all(_controllerlist)
-    def read_field(self, fieldname, maxage=None):
+    def read_field(self, fieldname, maxage=None, deadline=None, timeout=None):
         self._logger.info("All reading %s from %i controllers", fieldname, len(self._controllerlist.list))
             
     @run_function_on_all(_controllerlist)
-    def read_fields(self, fieldnames, maxage=None):
+    def read_fields(self, fieldnames, maxage=None, deadline=None, timeout=None):
         self._logger.info("All reading %s from %i controllers", fieldnames, len(self._controllerlist.list))
         
     @run_function_on_all(_controllerlist)
@@ -83,6 +92,10 @@ class HeatmiserBroadcastDevice(ThermoStatHotWaterDay):
     @run_function_on_all(_controllerlist)
     def read_time(self, maxage=0):
         pass
+
+    @run_function_on_all(_controllerlist)
+    def maintain_time(self):
+        pass
     
     #run set functions which require a read on all stats
     @run_function_on_all(_controllerlist)
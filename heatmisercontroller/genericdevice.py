@@ -6,15 +6,31 @@ Ian Horsley 2018
 """
 from __future__ import absolute_import
 import logging
-import time
 import copy
+import threading
 import serial
 
+from . import clock
 from .fields import HeatmiserFieldSingleReadOnly, HeatmiserFieldDoubleReadOnly
-from .hm_constants import DEFAULT_PROTOCOL, SLAVE_ADDR_MIN, SLAVE_ADDR_MAX
+from .hm_constants import DEFAULT_PROTOCOL, SLAVE_ADDR_MIN, SLAVE_ADDR_MAX, DCB_START
 from .hm_constants import MAX_AGE_LONG
 from .hm_constants import FIELD_NAME_LENGTH
-from .exceptions import HeatmiserResponseError
+from .exceptions import HeatmiserError, HeatmiserResponseError, HeatmiserDeadlineError
+from .deadline import resolve_deadline, time_left, PartialResults
+from .freshness import combine_reports
+from .tracing import start_span
+from .logsupport import LazyFieldNames, LazyPadded
+
+#fields used to recognise a device, for example when cached after finding devices
+FINGERPRINT_FIELDS = ['DCBlen', 'model', 'version', 'programmode']
+
+class InflightRead():
+    """Read of a set of fields from a device that other callers can wait on"""
+    def __init__(self, fieldids):
+        self.fieldids = fieldids
+        self.done = threading.Event()
+        self.error = None
+        self.unrefreshed = set() #fieldids skipped as deadline could not be met
 
 class HeatmiserDevice():
     """General device class"""
@@ -30,6 +46,10 @@ class HeatmiserDevice():
         self.floorlimiting = None
         self.lastwritetime = None
         self.lastreadtime = None
+        self.refresh_queue = None #bus scheduler used to refresh stale fields, set when polling
+        self._inflight = [] #reads currently on the bus, shared with concurrent callers
+        self._inflight_lock = threading.Lock()
+        self._restoring = False #set while restoring a snapshot, so the controller time is not checked
         # initalise variables that may be overriden by settings
         self.set_protocol = DEFAULT_PROTOCOL #
         self.set_expected_prog_mode = None
@@ -77,11 +97,11 @@ class HeatmiserDevice():
 
     @staticmethod
     def _csvlist_field_names_from(fields):
-        """return csv of fieldnames from list of fields"""
-        return ', '.join(field.name for field in fields)
+        """return csv of fieldnames from list of fields, joined only when formatted"""
+        return LazyFieldNames(fields)
         
     def _csvlist_field_names_from_ids(self, fieldids):
-        """return csv of fieldnames from list of fieldids"""
+        """return csv of fieldnames from list of fieldids, joined only when formatted"""
         fields = [self.fields[fieldid] for fieldid in fieldids]
         return self._csvlist_field_names_from(fields)
         
@@ -108,45 +128,160 @@ class HeatmiserDevice():
     def _connect_observers(self):
         """called to connect obersers to fields"""
     
+    def fingerprint(self):
+        """Returns dictionary of the fields that identify a device, None if field unknown"""
+        return {fieldname: getattr(self, fieldname).value if hasattr(self, fieldname) else None
+                for fieldname in FINGERPRINT_FIELDS}
+
+    def get_snapshot(self):
+        """Returns dictionary of field data and read times, which can be stored to restore state
+
+        Data is taken from the fields rather than rawdata so that written values are included."""
+        dcb = bytearray(self.dcb_length)
+        readtimes = {}
+        for field in self.fields:
+            if field.lastreadtime is None or field.data is None:
+                continue
+            dcb[field.dcbaddress:field.last_dcb_byte_address() + 1] = bytearray(field.data)
+            readtimes[field.name] = field.lastreadtime
+        return {
+            'model': self.set_expected_model,
+            'prog_mode': self.set_expected_prog_mode,
+            'dcb': bytes(dcb).hex(),
+            'readtimes': readtimes
+        }
+
+    def restore_snapshot(self, snapshot):
+        """Restores field data and read times from a snapshot, returns number of fields restored"""
+        dcb = list(bytearray.fromhex(snapshot['dcb']))
+        if (snapshot['model'] != self.set_expected_model or
+                snapshot['prog_mode'] != self.set_expected_prog_mode or len(dcb) != self.dcb_length):
+            raise ValueError("Snapshot does not match device type")
+
+        restored = 0
+        self._restoring = True
+        try:
+            for field in self.fields:
+                readtime = snapshot['readtimes'].get(field.name)
+                if readtime is None:
+                    continue
+                data = dcb[field.dcbaddress:field.last_dcb_byte_address() + 1]
+                self.lastreadtime = readtime
+                try:
+                    self._procfield(data, field)
+                except HeatmiserError as err:
+                    self._logger.warning("C%i Field %s restore failed due to %s",
+                                        self.set_address, field.name, str(err))
+                    continue
+                self.rawdata[field.dcbaddress:field.last_dcb_byte_address() + 1] = data
+                restored += 1
+        finally:
+            self._restoring = False
+        self._logger.info("C%i Restored %i fields from snapshot", self.set_address, restored)
+        return restored
+
+    def health(self):
+        """Returns the circuit breaker recording recent failed calls to the device"""
+        return self._adaptor.circuit_breaker(self.set_address)
+
     ## Basic reading and getting functions
     
     def read_raw_data(self, startfieldname, endfieldname):
         """Return subset of raw data"""
         return self.rawdata[getattr(self, startfieldname).dcbaddress:getattr(self, endfieldname).last_dcb_byte_address()]
     
-    def read_all(self):
+    def read_all(self, deadline=None):
         """Returns all the rawdata having got it from the device"""
         try:
-            self.rawdata = self._adaptor.read_all_from_device(self.set_address, self.set_protocol, self.dcb_length)
+            self.rawdata = self._adaptor.read_all_from_device(self.set_address, self.set_protocol,
+                                                                self.dcb_length, deadline=deadline)
         except serial.SerialException as err:
             self._logger.warning("C%i Read all failed, Serial Port error %s",self.set_address, str(err))
             raise
 
-        self._logger.info("C%i Read all",self.set_address)
+        self._logger.debug("C%i Read all",self.set_address)
 
-        self.lastreadtime = time.time()
+        self.lastreadtime = clock.now()
         self._procpayload(self.rawdata)
         return self.rawdata
 
-    def read_field(self, fieldname, maxage=None):
+    def read_field(self, fieldname, maxage=None, deadline=None, timeout=None):
         """Returns a fields value, gets from the device if to old"""
-        return self.read_fields([fieldname], maxage)[0]
+        return self.read_fields([fieldname], maxage, deadline, timeout)[0]
     
-    def read_fields(self, fieldnames, maxage=None):
-        """Returns a list of field values, gets from the device if any are to old"""
+    def read_fields(self, fieldnames, maxage=None, deadline=None, timeout=None):
+        """Returns a list of field values, gets from the device if any are to old
+
+        Given a deadline (as clock.now()) or timeout in seconds, reads that cannot finish in time
+        are skipped. The names of fields not refreshed are listed in incomplete on the result."""
         #only get field from network if
         # maxage = None, older than the default from fields
         # maxage = -1, not read before
         # maxage >=0, older than maxage
         # maxage = 0, always
+        deadline = resolve_deadline(deadline, timeout)
+        with start_span('read_fields', address=self.set_address, fields=len(fieldnames)):
         
-        fieldids = [self._fieldnametonum[fieldname] for fieldname in fieldnames if hasattr(self, fieldname) and (maxage == 0 or not getattr(self, fieldname).check_data_fresh(maxage))]
-        fieldids = list(set(fieldids)) #remove duplicates, ordering doesn't matter
-        if len(fieldids) > 0:
-            self._get_fields(fieldids)
+            fieldids = set() #remove duplicates, ordering doesn't matter
+            for fieldname in fieldnames:
+                if hasattr(self, fieldname):
+                    field = getattr(self, fieldname)
+                    fresh = maxage != 0 and field.check_data_fresh(maxage)
+                    field.freshness.record_request(fresh)
+                    if not fresh:
+                        fieldids.add(self._fieldnametonum[fieldname])
+            unrefreshed = set()
+            if len(fieldids) > 0:
+                unrefreshed = self._get_fields_single_flight(fieldids, deadline)
+
+            self._record_serve(fieldnames)
+            values = [self.fieldsbyname[fieldname].get_value() if hasattr(self, fieldname) else None for fieldname in fieldnames]
+            return PartialResults(values, [fieldname for fieldname in fieldnames
+                                            if self._fieldnametonum.get(fieldname) in unrefreshed])
 
-        return [self.fieldsbyname[fieldname].get_value() if hasattr(self, fieldname) else None for fieldname in fieldnames]
+    def read_fields_cached(self, fieldnames, maxage=None):
+        """Returns a list of (value, age) for fields without waiting for the bus
+
+        Fields older than maxage (as read_fields) are queued for refresh by the bus scheduler.
+        Age is None if the field has not been read."""
+        timenow = clock.now()
+        results = []
+        stalenames = []
+        for fieldname in fieldnames:
+            if not hasattr(self, fieldname):
+                results.append((None, None))
+                continue
+            field = self.fieldsbyname[fieldname]
+            age = None if field.lastreadtime is None else timenow - field.lastreadtime
+            results.append((field.get_value() if age is not None else None, age))
+            fresh = maxage != 0 and field.check_data_fresh(maxage)
+            field.freshness.record_request(fresh)
+            if age is not None:
+                field.freshness.record_serve(age)
+            if not fresh:
+                stalenames.append(fieldname)
+
+        if stalenames:
+            if self.refresh_queue is not None:
+                self.refresh_queue.request_refresh(self, stalenames, maxage)
+            else:
+                self._logger.debug("C%i No bus scheduler to refresh %s", self.set_address, ', '.join(stalenames))
+        return results
     
+    def _record_serve(self, fieldnames):
+        """Record age of field data returned to caller"""
+        timenow = clock.now()
+        for fieldname in fieldnames:
+            field = self.fieldsbyname.get(fieldname)
+            if field is not None and field.lastreadtime is not None:
+                field.freshness.record_serve(timenow - field.lastreadtime)
+
+    def freshness_report(self):
+        """Returns dictionary of freshness statistics for each field and totals for the device"""
+        timenow = clock.now()
+        fields = {field.name: field.freshness_report(timenow) for field in self.fields}
+        return {'fields': fields, 'totals': combine_reports(fields.values())}
+
     def get_field_range(self, firstfieldname, lastfieldname=None):
         """gets fieldrange from device
         safe for blocks crossing gaps in dcb"""
@@ -157,38 +292,98 @@ class HeatmiserDevice():
         lastfieldid = self._fieldnametonum[lastfieldname]
             
         blockstoread = self._get_field_blocks_from_id_range(firstfieldid, lastfieldid)
-        fieldstring = firstfieldname.ljust(FIELD_NAME_LENGTH) + " " + lastfieldname.ljust(FIELD_NAME_LENGTH)
+        fieldstring = LazyFieldNames([self.fields[firstfieldid], self.fields[lastfieldid]])
         self._get_field_blocks(blockstoread, fieldstring)
     
-    def _get_fields(self, fieldids):
+    def _get_fields_single_flight(self, fieldids, deadline=None):
+        """Gets fields from device, waiting on reads already in flight for any fields they cover
+
+        Returns set of fieldids not refreshed before the deadline."""
+        with self._inflight_lock:
+            waitreads = [read for read in self._inflight if read.fieldids & fieldids]
+            remaining = fieldids.difference(*[read.fieldids for read in waitreads])
+            ownread = None
+            if remaining:
+                ownread = InflightRead(remaining)
+                self._inflight.append(ownread)
+
+        unrefreshed = set()
+        if ownread is not None:
+            try:
+                ownread.unrefreshed = self._get_fields(list(remaining), deadline)
+                unrefreshed |= ownread.unrefreshed
+            except (HeatmiserError, serial.SerialException) as err:
+                ownread.error = err
+                raise
+            finally:
+                with self._inflight_lock:
+                    self._inflight.remove(ownread)
+                ownread.done.set()
+
+        for read in waitreads:
+            self._logger.debug("C%i Waiting on read in flight", self.set_address)
+            if not read.done.wait(None if deadline is None else max(0.0, time_left(deadline))):
+                unrefreshed |= read.fieldids & fieldids
+                continue
+            if read.error is not None:
+                raise read.error
+            unrefreshed |= read.unrefreshed & fieldids
+        return unrefreshed
+
+    def _get_fields(self, fieldids, deadline=None):
         """gets fields from device
-        safe for blocks crossing gaps in dcb"""
+        safe for blocks crossing gaps in dcb
+        returns set of fieldids not read before the deadline"""
         blockstoread = self._get_field_blocks_from_id_list(fieldids)
-        self._get_field_blocks(blockstoread, self._csvlist_field_names_from_ids(fieldids))
+        skipped = self._get_field_blocks(blockstoread, self._csvlist_field_names_from_ids(fieldids), deadline)
+        return set(fieldid for fieldid in fieldids for firstfield, lastfield, _ in skipped
+                    if self._fieldnametonum[firstfield.name] <= fieldid <= self._fieldnametonum[lastfield.name])
     
-    def _get_field_blocks(self, blockstoread, fieldstring):
+    def _get_field_blocks(self, blockstoread, fieldstring, deadline=None):
         """gets field blocks from device
-        NOT safe for dcb gaps"""
+        NOT safe for dcb gaps
+        returns list of blocks skipped as they could not be read before the deadline"""
         #blockstoread list of [field, field, blocklength in bytes]
         estimatedreadtime = self._estimate_blocks_read_time(blockstoread)
+        skipped = []
 
-        if estimatedreadtime < self.fullreadtime - 0.02: #if to close to full read time, then read all
+        #if to close to full read time, then read all, unless there is not time for it
+        if not self._use_read_all(estimatedreadtime) or self.fullreadtime > time_left(deadline):
             try:
-                for firstfield, lastfield, blocklength in blockstoread:
+                for index, (firstfield, lastfield, blocklength) in enumerate(blockstoread):
+                    if self._estimate_read_time(blocklength) > time_left(deadline):
+                        self._logger.info("C%i Skipped reading %s to %s, no time left",
+                                self.set_address, firstfield.name, lastfield.name)
+                        skipped.append(blockstoread[index])
+                        continue
                     self._logger.debug("C%i Reading ui %i to %i len %i, proc %s to %s", 
                             self.set_address, firstfield.address, lastfield.address,
                             blocklength, firstfield.name, lastfield.name)
-                    rawdata = self._adaptor.read_from_device(self.set_address, self.set_protocol,
-                            firstfield.address, blocklength)
-                    self.lastreadtime = time.time()
-                    self._procpartpayload(rawdata, firstfield.name, lastfield.name)
+                    with start_span('read_block', address=self.set_address, start=firstfield.address,
+                                    length=blocklength):
+                        try:
+                            rawdata = self._adaptor.read_from_device(self.set_address, self.set_protocol,
+                                    firstfield.address, blocklength, deadline=deadline)
+                        except HeatmiserDeadlineError as err:
+                            self._logger.info("C%i Stopped reading fields %s, %s", self.set_address, fieldstring, str(err))
+                            skipped.extend(blockstoread[index:])
+                            break
+                        self.lastreadtime = clock.now()
+                        self._procpartpayload(rawdata, firstfield.name, lastfield.name)
             except serial.SerialException as err:
                 self._logger.warning("C%i Read failed of fields %s, Serial Port error %s",self.set_address, fieldstring, str(err))
                 raise
-            self._logger.info("C%i Read fields %s, in %i blocks", self.set_address, fieldstring, len(blockstoread))
+            self._logger.debug("C%i Read fields %s, in %i blocks", self.set_address, fieldstring, len(blockstoread) - len(skipped))
         else:
             self._logger.debug("C%i Read fields %s by read_all, %0.3f %0.3f", self.set_address, fieldstring, estimatedreadtime, self.fullreadtime)
-            self.read_all()
+            try:
+                with start_span('read_block', address=self.set_address, start=DCB_START,
+                                length=self.dcb_length, read_all=True):
+                    self.read_all(deadline)
+            except HeatmiserDeadlineError as err:
+                self._logger.info("C%i Stopped reading fields %s, %s", self.set_address, fieldstring, str(err))
+                skipped = blockstoread
+        return skipped
               
         #data can only be requested from the controller in contiguous blocks
         #functions takes a first and last field and separates out the individual blocks available for the controller type
@@ -231,6 +426,75 @@ class HeatmiserDevice():
                                             self.fields[ids].fieldlength])
         return readblocks
     
+    def _use_read_all(self, estimatedreadtime):
+        """Returns True if reading all is about as quick as reading blocks with estimated time"""
+        return estimatedreadtime >= self.fullreadtime - 0.02
+
+    def explain_read(self, fieldnames, maxage=None):
+        """Returns the plan read_fields would use, without using the bus
+
+        Lists the frames with start address, length and estimated time, whether read_all
+        is used and the fields skipped as fresh or not on the device."""
+        fresh = []
+        unknown = []
+        fieldids = set()
+        for fieldname in fieldnames:
+            if not hasattr(self, fieldname):
+                unknown.append(fieldname)
+            elif maxage != 0 and getattr(self, fieldname).check_data_fresh(maxage):
+                fresh.append(fieldname)
+            else:
+                fieldids.add(self._fieldnametonum[fieldname])
+
+        readall = False
+        frames = []
+        if fieldids:
+            blockstoread = self._get_field_blocks_from_id_list(list(fieldids))
+            readall = self._use_read_all(self._estimate_blocks_read_time(blockstoread))
+            if readall:
+                blockstoread = [[self.fields[0], self.fields[-1], self.dcb_length]]
+            for firstfield, lastfield, blocklength in blockstoread:
+                frames.append({
+                    'start': DCB_START if readall else firstfield.address,
+                    'length': blocklength,
+                    'first': firstfield.name,
+                    'last': lastfield.name,
+                    'time': self.fullreadtime if readall else self._estimate_read_time(blocklength)
+                })
+        return self._explain_plan(frames, fresh=fresh, unknown=unknown, read_all=readall)
+
+    def explain_write(self, fieldnames, values):
+        """Returns the plan set_fields would use, without using the bus
+
+        Lists the frames with start address, length and estimated time."""
+        fields = [getattr(self, fieldname) for fieldname in fieldnames if hasattr(self, fieldname)]
+        frames = [{
+            'start': blockfields[0].address,
+            'length': lengthbytes,
+            'first': blockfields[0].name,
+            'last': blockfields[-1].name,
+            'time': self._estimate_write_time(lengthbytes)
+        } for blockfields, lengthbytes, _, _ in self._get_payload_blocks_from_list(fields, values)]
+        return self._explain_plan(frames,
+                                    unknown=[fieldname for fieldname in fieldnames if not hasattr(self, fieldname)])
+
+    def _explain_plan(self, frames, **details):
+        """Adds estimated total time, including bus reset between frames, to a plan"""
+        plan = {'address': self.set_address, 'frames': frames}
+        plan.update(details)
+        plan['estimated_time'] = (sum(frame['time'] for frame in frames) +
+                                    self._adaptor.min_time_between_reads() * max(0, len(frames) - 1))
+        return plan
+
+    def estimate_fields_read_time(self, fieldnames):
+        """estimates the time to read a set of fields, allowing for the read_all fallback"""
+        fieldids = list(set(self._fieldnametonum[fieldname] for fieldname in fieldnames
+                            if fieldname in self._fieldnametonum))
+        if len(fieldids) == 0:
+            return 0
+        blockstoread = self._get_field_blocks_from_id_list(fieldids)
+        return min(self._estimate_blocks_read_time(blockstoread), self.fullreadtime)
+
     def _estimate_blocks_read_time(self, blocks):
         """estimates read time for a set of blocks, including the COM_BUS_RESET_TIME between blocks
         excludes the COM_BUS_RESET_TIME before first block"""
@@ -243,6 +507,12 @@ class HeatmiserDevice():
         based on empirical measurements of one prt_hw_model and 5 prt_e_model"""
         return length * 0.002075 + 0.070727
 
+    @classmethod
+    def _estimate_write_time(cls, length):
+        """estimates the time for a call to write_to_device without COM_BUS_RESET_TIME
+        assumes same as a read, because the payload moves from the response to the request"""
+        return cls._estimate_read_time(length)
+
     def _procfield(self, data, fieldinfo):
         """Process data for a single field storing in relevant."""
         #self._logger.debug("Processing %s data %s"%(fieldinfo.name, data))
@@ -262,34 +532,38 @@ class HeatmiserDevice():
         
     def _procpayload(self, rawdata, firstfieldid=0, lastfieldid=False):
         """Split payload with field information and processes each field"""
-        self._logger.debug("C%i Processing Payload from field %i to %i",
-                        self.set_address,
-                        firstfieldid,
-                        lastfieldid)
-        if not lastfieldid:
-            lastfieldid = len(self.fields)
+        with start_span('process_payload', address=self.set_address, length=len(rawdata)):
+            self._logger.debug("C%i Processing Payload from field %i to %i",
+                            self.set_address,
+                            firstfieldid,
+                            lastfieldid)
+            if not lastfieldid:
+                lastfieldid = len(self.fields)
         
-        fullfirstdcbadd = self.fields[firstfieldid].dcbaddress
+            fullfirstdcbadd = self.fields[firstfieldid].dcbaddress
         
-        for field in self.fields[firstfieldid:lastfieldid + 1]:
-            length = field.fieldlength
-            dcbadd = field.dcbaddress - fullfirstdcbadd #adjust for the start of the request
+            for field in self.fields[firstfieldid:lastfieldid + 1]:
+                length = field.fieldlength
+                dcbadd = field.dcbaddress - fullfirstdcbadd #adjust for the start of the request
             
-            try:
-                self._procfield(rawdata[dcbadd:dcbadd+length], field)
-            except HeatmiserResponseError as err:
-                self._logger.warning("C%i Field %s process failed due to %s",
-                                    self.set_address,
-                                    field.name,
-                                    str(err))
-
-        self.rawdata[fullfirstdcbadd:fullfirstdcbadd+len(rawdata)] = rawdata
+                try:
+                    self._procfield(rawdata[dcbadd:dcbadd+length], field)
+                except HeatmiserResponseError as err:
+                    self._logger.warning("C%i Field %s process failed due to %s",
+                                        self.set_address,
+                                        field.name,
+                                        str(err))
+
+            self.rawdata[fullfirstdcbadd:fullfirstdcbadd+len(rawdata)] = rawdata
     
     ## Basic set field functions
     
-    def set_field(self, fieldname, values):
-        """Set a field (single member of fields) on a device to a state or values. Defined for all known field lengths."""
+    def set_field(self, fieldname, values, deadline=None, timeout=None):
+        """Set a field (single member of fields) on a device to a state or values. Defined for all known field lengths.
+
+        Raises HeatmiserDeadlineError if the write cannot finish before deadline or timeout."""
         #values must not be list for field length 1 or 2
+        deadline = resolve_deadline(deadline, timeout)
         fieldid = self._fieldnametonum[fieldname]
         field = self.fields[fieldid]
         numericvalues = field.write_value_from_text(values) #convert to numbers if input was text
@@ -300,32 +574,38 @@ class HeatmiserDevice():
         
         #adjust for logging
         printvalues = numericvalues if isinstance(numericvalues, list) else [numericvalues]
+        self._check_write_time(field.fieldlength, fieldname, deadline)
             
         try:
             self._adaptor.write_to_device(self.set_address,
                                             self.set_protocol,
                                             field.address,
                                             field.fieldlength,
-                                            payloadbytes)
+                                            payloadbytes,
+                                            deadline=deadline)
         except serial.SerialException as err:
             self._logger.warning("C%i failed to set field %s to %s, due to %s",
                                 self.set_address,
-                                fieldname.ljust(FIELD_NAME_LENGTH),
+                                LazyPadded(fieldname, FIELD_NAME_LENGTH),
                                 printvalues,
                                 str(err))
             raise
         self._logger.info("C%i set field %s to %s",
                         self.set_address,
-                        fieldname.ljust(FIELD_NAME_LENGTH),
+                        LazyPadded(fieldname, FIELD_NAME_LENGTH),
                         printvalues)
         
-        self.lastwritetime = time.time()
+        self.lastwritetime = clock.now()
         field.update_value(numericvalues, self.lastwritetime)
     
-    def set_fields(self, fieldnames, values):
-        """Set multiple fields on a device to a state or payload."""
+    def set_fields(self, fieldnames, values, deadline=None, timeout=None):
+        """Set multiple fields on a device to a state or payload.
+
+        Blocks are written in address order. Raises HeatmiserDeadlineError at the first block
+        that cannot be written before deadline or timeout, earlier blocks remain written."""
         #It groups adjacent fields and issues multiple sets if required.
         #inputs must be matching length lists
+        deadline = resolve_deadline(deadline, timeout)
         
         #Get fields
         fields = [getattr(self, fieldname) for fieldname in fieldnames if hasattr(self, fieldname)]
@@ -338,12 +618,14 @@ class HeatmiserDevice():
                                 lengthbytes,
                                 fields[0].name,
                                 fields[-1].name)
+                self._check_write_time(lengthbytes, self._csvlist_field_names_from(fields), deadline)
                 self._adaptor.write_to_device(self.set_address,
                                                 self.set_protocol,
                                                 fields[0].address,
                                                 lengthbytes,
-                                                payloadbytes)
-                self.lastwritetime = time.time()
+                                                payloadbytes,
+                                                deadline=deadline)
+                self.lastwritetime = clock.now()
                 self._update_fields_values(writtenvalues, fields)
         except serial.SerialException as err:
             self._logger.warning("C%i settings failed of fields %s, Serial Port error %s",
@@ -356,6 +638,11 @@ class HeatmiserDevice():
                         self._csvlist_field_names_from(fields),
                         len(outputdata))
 
+    def _check_write_time(self, length, fieldstring, deadline):
+        """Raises HeatmiserDeadlineError if a write of length cannot finish before the deadline"""
+        if self._estimate_write_time(length) > time_left(deadline):
+            raise HeatmiserDeadlineError("C%i no time left to set %s"%(self.set_address, fieldstring))
+
     def _update_fields_values(self, values, fields):
         """update the field values once data successfully written"""
         for field, value in zip(fields, values):
@@ -9,6 +9,9 @@ BYTEMASK = 0xff
 
 DONT_CARE_LENGTH = 1
 TIME_ERR_LIMIT = 10
+TIME_ERR_MARGIN = 0.8 #fraction of TIME_ERR_LIMIT at which predicted drift triggers a read or resync
+TIME_DRIFT_SAMPLES = 8 #number of time comparisons kept for the drift model
+TIME_DRIFT_MIN_SPAN = 3600 #minimum spread of time comparisons before drift model is trusted
 
 #
 # HM Version 3 Magic Numbers
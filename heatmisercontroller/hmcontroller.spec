@@ -1,11 +1,20 @@
 [ setup ]
   retry_time_interval = integer(default = 5)
   check_time_interval = integer(default = 1)
+  snapshot_file = string(default = '') #file to store device state for warm start, not used if empty
+  snapshot_interval = integer(default = 300) #minimum time between periodic snapshots
 
 [ controller ]
   auto_connect = boolean(default = True)
-  write_max_retries = integer()
-  read_max_retries = integer()
+  write_max_retries = integer(default = 3)
+  read_max_retries = integer(default = 2)
+  retry_backoff = float(default = 0) #wait before first retry, doubles for each retry
+  retry_jitter = float(default = 0) #fraction of the wait added at random
+  breaker_failure_threshold = integer(default = 5) #failed calls before calls to a device are skipped
+  breaker_reset_time = float(default = 60) #time before a device with open breaker is tried again
+  metrics_enabled = boolean(default = False) #record bus metrics, see metrics_snapshot on network
+  frame_trace_size = integer(0, default = 0) #bytes of recent frames kept for dumps after failures, 0 for off
+  capture_file = string(default = '') #file all bus frames are appended to for replay, not used if empty
   my_master_addr = integer()
 
 [ serial ]
@@ -16,6 +25,7 @@
 	
 	COM_TIMEOUT = float(default=1) #time to wait for full response
 	COM_START_TIMEOUT = float(default=0.1) #time to wait for start of response
+	COM_PROBE_START_TIMEOUT = float(default=0.05) #time to wait for start of response when finding devices
 	COM_MIN_TIMEOUT = float(default=0.1) # min remaining time after first byte read
 	COM_SEND_MIN_TIME = float(default=1)  #minimum time between sending commands to a device (broadcast only??)
 	COM_BUS_RESET_TIME = float(default=0.1)
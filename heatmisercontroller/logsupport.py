@@ -0,0 +1,124 @@
+"""Low overhead logging support for the bus paths
+
+Log arguments that are costly to build, like joined field names, are wrapped in
+lazy objects which are only formatted if a record is emitted. FrameRing keeps
+the most recent frames in a fixed size binary buffer, so they can be dumped
+after a failure without logging every frame at debug level.
+"""
+from __future__ import absolute_import
+import struct
+import threading
+
+from . import clock
+from .hm_constants import MIN_FRAME_RESP_LENGTH
+
+FRAME_SENT = 0
+FRAME_RECEIVED = 1
+DIRECTION_NAMES = {FRAME_SENT: 'TX', FRAME_RECEIVED: 'RX'}
+#frame records are a header of time, direction and length followed by the frame bytes
+FRAME_HEADER = struct.Struct('<dBH')
+CAPTURE_MAGIC = b'HMCAP\x01' #start of files of frame records, see capture module
+MIN_FRAME_RING_SIZE = FRAME_HEADER.size + MIN_FRAME_RESP_LENGTH #room for the shortest frame
+
+class LazyFieldNames():
+    """Comma separated names of fields, joined when formatted"""
+    __slots__ = ('_fields',)
+
+    def __init__(self, fields):
+        self._fields = fields
+
+    def __str__(self):
+        return ', '.join(field.name for field in self._fields)
+
+class LazyPadded():
+    """Name padded to a width, padded when formatted"""
+    __slots__ = ('_name', '_width')
+
+    def __init__(self, name, width):
+        self._name = name
+        self._width = width
+
+    def __str__(self):
+        return self._name.ljust(self._width)
+
+class LazyCall():
+    """Result of calling func with args, called when formatted"""
+    __slots__ = ('_func', '_args')
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+    def __str__(self):
+        return str(self._func(*self._args))
+
+class FrameRing():
+    """Fixed size binary ring buffer of recent frames
+
+    The oldest records are overwritten when the buffer is full."""
+    _header = FRAME_HEADER
+
+    def __init__(self, size=4096):
+        if size < MIN_FRAME_RING_SIZE:
+            raise ValueError("Frame ring size %i is less than the minimum of %i" % (size, MIN_FRAME_RING_SIZE))
+        self.size = size
+        self._buffer = bytearray(size)
+        self._records = [] #(offset, length) of records in buffer, oldest first
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, direction, data, timestamp=None):
+        """Record a frame, so the ring can be used as an adaptor frame tap"""
+        self.record(direction, data, timestamp)
+
+    def record(self, direction, data, timestamp=None):
+        """Add a frame to the buffer, frames larger than the buffer are truncated"""
+        if timestamp is None:
+            timestamp = clock.now()
+        payload = bytes(bytearray(data))[:self.size - self._header.size]
+        length = self._header.size + len(payload)
+        with self._lock:
+            if self._position + length > self.size:
+                self._position = 0
+            start = self._position
+            end = start + length
+            #drop records that will be overwritten
+            self._records = [(offset, reclen) for offset, reclen in self._records
+                                if offset + reclen <= start or offset >= end]
+            self._header.pack_into(self._buffer, start, timestamp, direction, len(payload))
+            self._buffer[start + self._header.size:end] = payload
+            self._records.append((start, length))
+            self._position = end
+
+    def __len__(self):
+        return len(self._records)
+
+    def frames(self):
+        """Returns list of (time, direction, bytes) for frames held, oldest first"""
+        with self._lock:
+            result = []
+            for offset, _ in self._records:
+                timestamp, direction, length = self._header.unpack_from(self._buffer, offset)
+                start = offset + self._header.size
+                result.append((timestamp, direction, bytes(self._buffer[start:start + length])))
+            return result
+
+    def dump(self):
+        """Returns frames held as lines of text with time, direction and hex bytes"""
+        return '\n'.join("%.3f %s %s" % (timestamp, DIRECTION_NAMES.get(direction, direction),
+                                        ' '.join('%02x' % byte for byte in bytearray(data)))
+                            for timestamp, direction, data in self.frames())
+
+    def write(self, filename):
+        """Write frames held to file in the capture format, so they can be replayed"""
+        with open(filename, 'wb') as fhandle:
+            fhandle.write(CAPTURE_MAGIC)
+            for timestamp, direction, data in self.frames():
+                fhandle.write(self._header.pack(timestamp, direction, len(data)))
+                fhandle.write(data)
+
+    def clear(self):
+        """Remove all frames"""
+        with self._lock:
+            self._records = []
+            self._position = 0
@@ -0,0 +1,182 @@
+"""In process metrics for bus transactions
+
+Counters, histograms and gauges are held in a registry, labelled for example by
+device address. The registry can be read as a snapshot dictionary or in the
+Prometheus text format for scraping. When metrics are disabled the null
+registry is used, which ignores all updates.
+"""
+from __future__ import absolute_import
+import threading
+
+from . import clock
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+class Histogram():
+    """Count of observations in buckets, with their sum"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets) #not cumulative
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add an observation"""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """Returns list of (upper bound, count of observations less or equal)"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class MetricFamily():
+    """Metric with a name and type, holding a value for each set of labels"""
+    def __init__(self, name, metrictype, helptext, buckets=None, func=None):
+        self.name = name
+        self.metrictype = metrictype
+        self.helptext = helptext
+        self.buckets = buckets
+        self.func = func #gauges are read from a function when collected
+        self.series = {} #by sorted tuple of label items
+        self._lock = threading.Lock()
+
+    def inc(self, amount, labels):
+        """Increase counter for labels"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, value, labels):
+        """Add observation to histogram for labels"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def collect(self):
+        """Returns list of (labels, value) with histograms as dictionaries"""
+        if self.metrictype == GAUGE:
+            return [((), self.func())]
+        with self._lock:
+            if self.metrictype == COUNTER:
+                return list(self.series.items())
+            return [(key, {'count': histogram.count, 'sum': histogram.sum,
+                            'buckets': histogram.cumulative_counts()})
+                    for key, histogram in self.series.items()]
+
+class MetricsRegistry():
+    """Holds metric families and provides snapshot and Prometheus text output"""
+    enabled = True
+
+    def __init__(self):
+        self.starttime = clock.now()
+        self._families = {}
+
+    def counter(self, name, helptext=''):
+        """Declare a counter"""
+        return self._families.setdefault(name, MetricFamily(name, COUNTER, helptext))
+
+    def histogram(self, name, helptext='', buckets=DEFAULT_BUCKETS):
+        """Declare a histogram"""
+        return self._families.setdefault(name, MetricFamily(name, HISTOGRAM, helptext, buckets))
+
+    def gauge(self, name, helptext, func):
+        """Declare a gauge, func is called to get the value when collected"""
+        return self._families.setdefault(name, MetricFamily(name, GAUGE, helptext, func=func))
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter, declaring it if needed"""
+        family = self._families.get(name)
+        if family is None:
+            family = self.counter(name)
+        family.inc(amount, labels)
+
+    def observe(self, name, value, **labels):
+        """Add observation to a histogram, declaring it if needed"""
+        family = self._families.get(name)
+        if family is None:
+            family = self.histogram(name)
+        family.observe(value, labels)
+
+    def snapshot(self):
+        """Returns dictionary of metric name to dictionary of label string to value"""
+        return {name: {self._label_string(key): value for key, value in family.collect()}
+                for name, family in self._families.items()}
+
+    def to_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format"""
+        lines = []
+        for name in sorted(self._families):
+            family = self._families[name]
+            lines.append("# HELP %s %s" % (name, family.helptext))
+            lines.append("# TYPE %s %s" % (name, family.metrictype))
+            for key, value in sorted(family.collect(), key=lambda item: item[0]):
+                if family.metrictype != HISTOGRAM:
+                    lines.append("%s%s %s" % (name, self._label_string(key), self._format_value(value)))
+                    continue
+                for bound, count in value['buckets']:
+                    lines.append("%s_bucket%s %i" % (name, self._label_string(key + (('le', repr(bound)),)), count))
+                lines.append("%s_bucket%s %i" % (name, self._label_string(key + (('le', '+Inf'),)), value['count']))
+                lines.append("%s_sum%s %s" % (name, self._label_string(key), self._format_value(value['sum'])))
+                lines.append("%s_count%s %i" % (name, self._label_string(key), value['count']))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _label_string(key):
+        """Format label items as {name="value",...}"""
+        if not key:
+            return ''
+        return '{' + ','.join('%s="%s"' % (label, value) for label, value in key) + '}'
+
+    @staticmethod
+    def _format_value(value):
+        """Format number for Prometheus"""
+        if isinstance(value, float):
+            return repr(value)
+        return str(value)
+
+class NullMetricsRegistry():
+    """Registry used when metrics are disabled, all updates are ignored"""
+    enabled = False
+
+    def counter(self, name, helptext=''):
+        """Ignored"""
+
+    def histogram(self, name, helptext='', buckets=DEFAULT_BUCKETS):
+        """Ignored"""
+
+    def gauge(self, name, helptext, func):
+        """Ignored"""
+
+    def inc(self, name, amount=1, **labels):
+        """Ignored"""
+
+    def observe(self, name, value, **labels):
+        """Ignored"""
+
+    @staticmethod
+    def snapshot():
+        """No metrics are held"""
+        return {}
+
+    @staticmethod
+    def to_prometheus():
+        """No metrics are held"""
+        return ''
+
+NULL_METRICS = NullMetricsRegistry()
@@ -6,21 +6,36 @@ Ian Horsley 2018
 """
 from __future__ import absolute_import
 import os
+import math
+import json
+import atexit
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import serial
 
 # Import our own stuff
-from .genericdevice import DEVICETYPES
+from . import clock
+from .genericdevice import DEVICETYPES, FINGERPRINT_FIELDS
 from .generaldevices import HeatmiserBroadcastDevice, ThermoStatUnknown
 from .adaptor import HeatmiserAdaptor
-from .hm_constants import SLAVE_ADDR_MIN, SLAVE_ADDR_MAX
-from .exceptions import HeatmiserResponseError
+from .polling import HeatmiserPoller, DEFAULT_POLL_GROUPS
+from .capacity import admit_groups, plan_capacity, MAX_BUS_UTILISATION
+from .hm_constants import SLAVE_ADDR_MIN, SLAVE_ADDR_MAX, MIN_FRAME_SEND_LENGTH
+from .exceptions import HeatmiserError, HeatmiserResponseError
+from .deadline import resolve_deadline, time_left, PartialResults
+from .freshness import combine_reports
 from . import setup as hms
 
+#small set of frequently changing fields read from all devices first when warming up
+WARM_UP_HOT_FIELDS = ['remoteairtemp', 'floortemp', 'airtemp', 'errorcode',
+                        'heatingdemand', 'hotwaterdemand']
+
 class HeatmiserNetwork():
     """Class that connects a set of devices (from configuration) and an adpator."""
     ### stat list setup
 
-    def __init__(self, configfile=None):
+    def __init__(self, configfile=None, adaptor_factory=None):
         self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
         self._logger.debug('creating an instance of %s', self.__class__.__name__)
         # Select default configuration file if none provided
@@ -37,7 +52,11 @@ class HeatmiserNetwork():
             raise
 
         # Initialize and connect to heatmiser network, probably through serial port
-        self.adaptor = HeatmiserAdaptor(self._setup)
+        #factory called with setup allows another adaptor, for example to replay a capture
+        self.adaptor = (adaptor_factory or HeatmiserAdaptor)(self._setup)
+        self.adaptor.metrics.counter('heatmiser_polls_total', 'Background polls of devices by result')
+        self.adaptor.metrics.gauge('heatmiser_devices', 'Number of devices on network',
+                                    lambda: len(self.controllers))
 
         # Load device list from settings or find devices if none listed
         self.controllers = []
@@ -48,11 +67,25 @@ class HeatmiserNetwork():
         else: #if devices not defined then auto run find devices.
             self.find_devices()
 
+        self.warmup_metrics = {}
+        self._warmup_thread = None
+        self.poller = None
+        self.capacity_plan = None
+
         # Create a broadcast device
         setattr(self, "All",
                     HeatmiserBroadcastDevice(self.adaptor, "Broadcast to All", self.controllers))
         self._current = self.All
 
+        # Restore device state from last run and store again on exit
+        self._snapshot_file = settings['setup']['snapshot_file']
+        self._snapshot_interval = settings['setup']['snapshot_interval']
+        self._last_snapshot_time = clock.now()
+        if self._snapshot_file:
+            if os.path.exists(self._snapshot_file):
+                self.load_snapshot()
+            atexit.register(self.save_snapshot)
+
     def _set_stat_list(self, statlist, generalsettings):
         """Store list of devives and create objects for each"""
         self._statlist = statlist
@@ -78,29 +111,283 @@ class HeatmiserNetwork():
         self._addresses_in_use.append(controllersettings['address'])
         return new_device
 
-    def find_devices(self, max_address=SLAVE_ADDR_MAX):
-        """Find devices on the network not in the configuration file"""
+    def find_devices(self, max_address=SLAVE_ADDR_MAX, fast=False, cachefile=None, rescan=False,
+                        deadline=None, timeout=None):
+        """Find devices on the network not in the configuration file
+
+        fast uses a single header read per address without retries and a short first byte
+        timeout. If cachefile is given, found devices are stored with their fingerprint and
+        on later calls only the cached addresses are checked, unless rescan is True. A scan
+        finding nothing is not stored, and an empty or unreadable cache gives a full scan.
+        Given a deadline (as clock.now()) or timeout in seconds, the search stops when the time
+        is used up.
+        Returns list of devices added, with addresses not checked listed in incomplete."""
+        deadline = resolve_deadline(deadline, timeout)
         unused_addresses = [address for address in range(SLAVE_ADDR_MIN, max_address + 1) if address not in self._addresses_in_use]
-        for address in unused_addresses:
+        cached = None
+        if cachefile is not None and not rescan:
+            cached = self._load_discovery_cache(cachefile)
+        if cached is not None:
+            unused_addresses = [address for address in unused_addresses if address in cached]
+
+        found = {}
+        new_devices = []
+        unchecked = []
+        for index, address in enumerate(unused_addresses):
+            controllersettings = {'address': address}
+            test_device = ThermoStatUnknown(self.adaptor, controllersettings, self._setup.settings['devicesgeneral'])
             try:
-                controllersettings = {'address': address}
-                test_device = ThermoStatUnknown(self.adaptor, controllersettings, self._setup.settings['devicesgeneral'])
-                # use fields from device rather to set the expected mode and type
-                test_device.read_fields(['model', 'programmode'], 0)
+                if time_left(deadline) > 0 and fast:
+                    test_device.probe()
+                elif time_left(deadline) > 0:
+                    # use fields from device rather to set the expected mode and type
+                    # all fingerprint fields are read so it can be compared with a fast scan
+                    test_device.read_fields(FINGERPRINT_FIELDS, 0, deadline)
             except HeatmiserResponseError as err:
                 self._logger.info("C%i device not found, library error %s", address, err)
-            else:
-                model = test_device.model.read_value_text()
-                prog_mode = test_device.programmode.read_value_text()
-                self._logger.info("C%i device %s found, with program %s", address, model, prog_mode)
-                controllersettings = {
-                    'address': address,
-                    'expected_model': model,
-                    'expected_prog_mode': prog_mode
-                }
-                new_device = self.add_device("C%i"%address, controllersettings, self._setup.settings['devicesgeneral'])
-                self.controllers.append(new_device)
-                self._addresses_in_use.append(address)
+                continue
+            if time_left(deadline) <= 0 and test_device.lastreadtime is None:
+                unchecked = unused_addresses[index:]
+                self._logger.warning("Device search stopped at deadline, %i addresses not checked", len(unchecked))
+                break
+            if test_device.model.is_unknown() or test_device.programmode.is_unknown():
+                self._logger.info("C%i device not recognised", address)
+                continue
+
+            fingerprint = test_device.fingerprint()
+            if cached is not None and cached[address] != fingerprint:
+                self._logger.warning("C%i device changed from %s to %s", address, cached[address], fingerprint)
+            model = test_device.model.read_value_text()
+            prog_mode = test_device.programmode.read_value_text()
+            self._logger.info("C%i device %s found, with program %s", address, model, prog_mode)
+            controllersettings = {
+                'address': address,
+                'expected_model': model,
+                'expected_prog_mode': prog_mode
+            }
+            new_device = self.add_device("C%i"%address, controllersettings, self._setup.settings['devicesgeneral'])
+            self.controllers.append(new_device)
+            new_devices.append(new_device)
+            found[address] = fingerprint
+
+        if cachefile is not None and found:
+            #an empty scan, for example with the bus unplugged, would hide all devices on later scans
+            if cached is not None:
+                #keep cached devices that were not checked in time
+                found.update((address, cached[address]) for address in unchecked)
+            self._save_discovery_cache(cachefile, found)
+        return PartialResults(new_devices, unchecked)
+
+    def _load_discovery_cache(self, cachefile):
+        """Load addresses and fingerprints of previously found devices, None if no cache or empty"""
+        try:
+            with open(cachefile) as fhandle:
+                cache = json.load(fhandle)
+        except (IOError, ValueError) as err:
+            self._logger.info("Discovery cache %s not loaded, %s", cachefile, err)
+            return None
+        if not cache:
+            self._logger.info("Discovery cache %s is empty, checking all addresses", cachefile)
+            return None
+        return {int(address): fingerprint for address, fingerprint in cache.items()}
+
+    def _save_discovery_cache(self, cachefile, found):
+        """Store addresses and fingerprints of found devices"""
+        try:
+            with open(cachefile, 'w') as fhandle:
+                json.dump({str(address): fingerprint for address, fingerprint in found.items()}, fhandle)
+        except IOError as err:
+            self._logger.warning("Discovery cache %s not saved, %s", cachefile, err)
+
+    def sync_time(self):
+        """Set the time on all devices with a single broadcast
+
+        The broadcast is delayed so that the end of the frame lands on a second boundary,
+        which is the resolution of the device clocks. The time error estimate for each
+        device is then updated without reading the time back."""
+        framelength = MIN_FRAME_SEND_LENGTH + self.All.currenttime.fieldlength
+        transmittime = self.adaptor.frame_transmit_time(framelength)
+        #hold the bus from timing the broadcast until it is sent, so no other frame delays it
+        with self.adaptor._bus_lock: #pylint: disable=protected-access
+            earliestarrival = max(clock.now(), self.adaptor.bus_ready_time()) + transmittime
+            targettime = math.ceil(earliestarrival)
+            waittime = targettime - transmittime - clock.now()
+            if waittime > 0:
+                self._logger.debug("All waiting %.3f before sending time", waittime)
+                clock.sleep(waittime)
+
+            timearray = self.All.currenttime.localtimearray(targettime)
+            self.All.set_field('currenttime', timearray)
+        for controller in self.controllers:
+            if hasattr(controller, 'currenttime'):
+                controller.lastwritetime = targettime
+                controller.currenttime.update_value(timearray, targettime)
+        self._logger.info("All time synchronised to %s", timearray)
+        return timearray
+
+    def warm_up(self, background=True):
+        """Read hot fields from all devices, then the remaining fields, optionally in background
+
+        Temperatures for every zone are available after a short read of each device instead
+        of after a full read of every device. Timing is recorded in warmup_metrics, including
+        temperature_map_time, the seconds until hot fields were known for all devices."""
+        starttime = clock.now()
+        self.warmup_metrics = {
+            'start_time': starttime,
+            'temperature_map_time': None,
+            'complete_time': None,
+            'failed': []
+        }
+        for controller in self.controllers:
+            self._warm_up_read(controller, WARM_UP_HOT_FIELDS)
+        if not self.warmup_metrics['failed']:
+            self.warmup_metrics['temperature_map_time'] = clock.now() - starttime
+            self._logger.info("All temperatures read in %.2f s", self.warmup_metrics['temperature_map_time'])
+
+        if background:
+            self._warmup_thread = threading.Thread(target=self._warm_up_remaining,
+                                                    name='heatmiser-warmup', daemon=True)
+            self._warmup_thread.start()
+        else:
+            self._warm_up_remaining()
+        return self.warmup_metrics
+
+    def _warm_up_remaining(self):
+        """Read all stale fields on all devices, completing the warm up"""
+        for controller in self.controllers:
+            self._warm_up_read(controller, [field.name for field in controller.fields])
+        if not self.warmup_metrics['failed']:
+            self.warmup_metrics['complete_time'] = clock.now() - self.warmup_metrics['start_time']
+            self._logger.info("All fields read in %.2f s", self.warmup_metrics['complete_time'])
+
+    def _warm_up_read(self, controller, fieldnames):
+        """Read stale fields from a device for warm up, logging and recording failures"""
+        try:
+            controller.read_fields(fieldnames)
+        except (HeatmiserError, serial.SerialException) as err:
+            self._logger.warning("C%i warm up read failed due to %s", controller.set_address, err)
+            if controller.set_address not in self.warmup_metrics['failed']:
+                self.warmup_metrics['failed'].append(controller.set_address)
+
+    def start_polling(self, groups=None, max_utilisation=MAX_BUS_UTILISATION, degrade=True, policies=None):
+        """Start polling all devices in the background, using groups of fields with own intervals
+
+        groups is a list of polling.PollGroup, defaults to polling.DEFAULT_POLL_GROUPS.
+        If the groups need more than max_utilisation of the bus, intervals are stretched to
+        fit if degrade, otherwise HeatmiserCapacityError is raised.
+        policies is a list of polling.PollPolicy, such as polling.SchedulePolicy.
+        The poller also refreshes stale fields for read_fields_cached, use groups=[] to only do that."""
+        if self.poller is not None:
+            self.poller.stop()
+        self.capacity_plan = admit_groups(self, groups, max_utilisation, degrade)
+        self.poller = HeatmiserPoller(self, self.capacity_plan.groups, policies)
+        for controller in self.controllers:
+            controller.refresh_queue = self.poller
+        self.poller.start()
+        return self.poller
+
+    def explain_poll(self, groups=None, maxage=0):
+        """Returns the read plans for one poll of each group on every device, without using the bus
+
+        groups defaults to those being polled, or polling.DEFAULT_POLL_GROUPS if not polling.
+        maxage is passed to each explain_read, the default of 0 gives the cost of a full poll."""
+        if groups is None:
+            groups = self.poller.groups if self.poller is not None else DEFAULT_POLL_GROUPS
+        resettime = self.adaptor.min_time_between_reads()
+        plans = []
+        for group in groups:
+            for controller in self.controllers:
+                if not hasattr(controller, 'explain_read'):
+                    continue
+                fieldnames = [fieldname for fieldname in group.fieldnames if hasattr(controller, fieldname)]
+                if not fieldnames:
+                    continue
+                plan = controller.explain_read(fieldnames, maxage)
+                plan['group'] = group.name
+                plan['interval'] = group.interval
+                plans.append(plan)
+        return {
+            'plans': plans,
+            'frames': sum(len(plan['frames']) for plan in plans),
+            'estimated_time': sum(plan['estimated_time'] for plan in plans),
+            'utilisation': sum((plan['estimated_time'] + resettime) / plan['interval']
+                                for plan in plans if plan['frames'])
+        }
+
+    def plan_polling(self, groups=None, max_utilisation=MAX_BUS_UTILISATION):
+        """Returns report of bus utilisation and headroom for polling groups, without polling"""
+        return plan_capacity(self, groups, max_utilisation).report()
+
+    def stop_polling(self):
+        """Stop background polling"""
+        if self.poller is not None:
+            self.poller.stop()
+        for controller in self.controllers:
+            controller.refresh_queue = None
+
+    def freshness_report(self):
+        """Returns dictionary of freshness statistics totals for each device and the network"""
+        devices = {getattr(controller, 'name', "C%i"%controller.set_address): controller.freshness_report()['totals']
+                    for controller in self.controllers}
+        return {'devices': devices, 'totals': combine_reports(devices.values())}
+
+    def metrics_snapshot(self):
+        """Returns dictionary of bus and polling metrics, empty if metrics_enabled is off"""
+        return self.adaptor.metrics.snapshot()
+
+    def metrics_prometheus(self):
+        """Returns bus and polling metrics in Prometheus text format"""
+        return self.adaptor.metrics.to_prometheus()
+
+    def save_snapshot(self, filename=None):
+        """Store the state of all devices to file, so it can be restored after a restart"""
+        if filename is None:
+            filename = self._snapshot_file
+        snapshot = {
+            'time': clock.now(),
+            'devices': {str(controller.set_address): controller.get_snapshot()
+                        for controller in self.controllers}
+        }
+        tempfilename = filename + '.tmp'
+        try:
+            with open(tempfilename, 'w') as fhandle:
+                json.dump(snapshot, fhandle, separators=(',', ':'))
+            os.replace(tempfilename, filename) #replace in one step so file is never partial
+        except (IOError, OSError) as err:
+            self._logger.warning("Snapshot %s not saved, %s", filename, err)
+            return
+        self._last_snapshot_time = snapshot['time']
+        self._logger.debug("Snapshot saved to %s", filename)
+
+    def save_snapshot_if_due(self):
+        """Store the state of all devices if snapshot_interval has passed since last stored"""
+        if self._snapshot_file and clock.now() - self._last_snapshot_time >= self._snapshot_interval:
+            self.save_snapshot()
+
+    def load_snapshot(self, filename=None):
+        """Restore the state of devices from file, returns number of devices restored"""
+        if filename is None:
+            filename = self._snapshot_file
+        try:
+            with open(filename) as fhandle:
+                snapshot = json.load(fhandle)
+        except (IOError, ValueError) as err:
+            self._logger.warning("Snapshot %s not loaded, %s", filename, err)
+            return 0
+
+        restored = 0
+        for controller in self.controllers:
+            devicesnapshot = snapshot['devices'].get(str(controller.set_address))
+            if devicesnapshot is None:
+                continue
+            try:
+                controller.restore_snapshot(devicesnapshot)
+            except (ValueError, KeyError) as err:
+                self._logger.warning("C%i snapshot not restored, %s", controller.set_address, err)
+                continue
+            restored += 1
+        self._logger.info("Restored %i devices from snapshot %s", restored, filename)
+        return restored
 
     def get_stat_address(self, shortname):
         """Get network address from device name."""
@@ -126,3 +413,12 @@ class HeatmiserNetwork():
         for obj in self.controllers:
             results.append(getattr(obj, method)(*args, **kwargs))
         return results
+
+def find_devices_on_networks(networks, **kwargs):
+    """Find devices on several networks in parallel, each network must use a separate bus
+
+    Takes the same keyword arguments as HeatmiserNetwork.find_devices.
+    Returns list of the devices added to each network."""
+    with ThreadPoolExecutor(max_workers=max(1, len(networks))) as executor:
+        futures = [executor.submit(network.find_devices, **kwargs) for network in networks]
+        return [future.result() for future in futures]
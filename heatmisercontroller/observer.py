@@ -101,3 +101,7 @@ class Notifier():
     def delete_notifable_changed(self, method):
         """Remove notifiable."""
         self.nots_changed.delete_observer(method)
+    def count_notifables(self):
+        """report number of notifiable methods of all types"""
+        return (sum(notifier.count_observers() for notifier in self.nots_is.values())
+                + self.nots_is_not.count_observers() + self.nots_changed.count_observers())
@@ -0,0 +1,326 @@
+"""Background polling of Heatmiser devices
+
+Fields are polled in groups, each with its own cadence. A timetable of
+(device, group) tasks is kept for the whole bus, with the tasks for each group
+spread evenly across its interval so the bus is not loaded in bursts.
+Poll policies can move the next poll of a task, for example to follow the
+heating and hot water schedules of a device. The poller also services refresh
+requests for stale fields from non-blocking reads, ahead of the timetable.
+"""
+from __future__ import absolute_import
+import logging
+import threading
+import serial
+
+from . import clock
+from .exceptions import HeatmiserError
+
+class PollGroup():
+    """Set of fields that are polled together at a fixed interval"""
+    def __init__(self, name, fieldnames, interval):
+        self.name = name
+        self.fieldnames = fieldnames
+        self.interval = interval
+
+    def __repr__(self):
+        return "PollGroup(%s, %i fields, every %.0fs)" % (self.name, len(self.fieldnames), self.interval)
+
+HEAT_SCHEDULE_FIELDS = ['mon_heat', 'tues_heat', 'wed_heat', 'thurs_heat', 'fri_heat', 'sat_heat',
+                        'sun_heat', 'wday_heat', 'wend_heat']
+WATER_SCHEDULE_FIELDS = ['mon_water', 'tues_water', 'wed_water', 'thurs_water', 'fri_water',
+                        'sat_water', 'sun_water', 'wday_water', 'wend_water']
+
+DEFAULT_POLL_GROUPS = [
+    PollGroup('temperatures', ['remoteairtemp', 'floortemp', 'airtemp', 'errorcode',
+                                'heatingdemand', 'hotwaterdemand'], 10),
+    PollGroup('state', ['setroomtemp', 'onoff', 'keylock', 'runmode', 'holidayhours',
+                        'tempholdmins', 'frostprotdisable', 'frosttemp'], 60),
+    PollGroup('schedules', HEAT_SCHEDULE_FIELDS + WATER_SCHEDULE_FIELDS, 3600)
+]
+
+class PollTask():
+    """Entry in the polling timetable for one group on one device"""
+    def __init__(self, device, group, next_due):
+        self.device = device
+        self.group = group
+        self.fieldnames = [fieldname for fieldname in group.fieldnames if hasattr(device, fieldname)]
+        self.interval = group.interval
+        self.next_due = next_due
+        self.bustime = device.estimate_fields_read_time(self.fieldnames) #estimated bus time per poll
+        self.current_interval = group.interval #interval after poll policies are applied
+        self.lastpolltime = None
+        self.policystate = {} #state kept by poll policies, by policy
+
+    def __repr__(self):
+        return "PollTask(C%s %s due %.1f)" % (self.device.set_address, self.group.name, self.next_due)
+
+class PollPolicy():
+    """Base class for policies that adjust when a task is next polled"""
+    def next_due(self, task, now, due):
+        """Returns the time the task should next be polled, given the time due from its interval"""
+        return due
+
+class SchedulePolicy(PollPolicy):
+    """Polls state groups less often between schedule transitions, and just after each transition
+
+    Between transitions the interval of the groups is stretched. The next poll is brought
+    forward to settle seconds after the next transition of the heating or hot water schedule,
+    as that is when setroomtemp and demand are expected to change."""
+    def __init__(self, groupnames=('state',), stretch=4, settle=30):
+        self.groupnames = groupnames
+        self.stretch = stretch
+        self.settle = settle
+
+    def next_due(self, task, now, due):
+        if task.group.name not in self.groupnames:
+            return due
+        relaxed = now + task.interval * self.stretch
+        totransition = self.seconds_to_transition(task.device)
+        if totransition is None:
+            return due
+        return min(relaxed, now + totransition + self.settle)
+
+    @staticmethod
+    def seconds_to_transition(device):
+        """Seconds until the next transition of any device schedule, None if no schedule is known"""
+        if not hasattr(device, 'currenttime'):
+            return None
+        timearray = device.currenttime.remote_timearray()
+        times = []
+        for schedule in (getattr(device, 'heat_schedule', None), getattr(device, 'water_schedule', None)):
+            if schedule is not None and schedule.is_known():
+                seconds = schedule.get_seconds_to_next_item(timearray)
+                if seconds is not None:
+                    times.append(seconds)
+        return min(times) if times else None
+
+class VolatilityPolicy(PollPolicy):
+    """Adapts the interval of groups to how quickly their values are changing
+
+    The rate of change of the fields in each task is tracked as an exponential moving average.
+    While the values move by more than threshold per interval, the interval is shortened
+    down to min_factor of the group interval. While they are stable, it is backed off
+    exponentially up to max_factor. Fields with observers attached back off less far."""
+    def __init__(self, groupnames=('temperatures',), min_factor=0.5, max_factor=8, backoff=2,
+                    threshold=0.5, smoothing=0.5):
+        self.groupnames = groupnames
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.backoff = backoff
+        self.threshold = threshold
+        self.smoothing = smoothing
+
+    def next_due(self, task, now, due):
+        if task.group.name not in self.groupnames or task.lastpolltime is None:
+            return due
+        values = [getattr(task.device, fieldname).value for fieldname in task.fieldnames]
+        state = task.policystate.get(self) #[values, polltime, rate, factor]
+        if state is None:
+            task.policystate[self] = [values, task.lastpolltime, 0.0, 1.0]
+            return due
+        lastvalues, lastpolltime, rate, factor = state
+        if task.lastpolltime == lastpolltime:
+            #poll failed, nothing new to learn
+            return due
+
+        newrate = self._rate_of_change(lastvalues, values, task.lastpolltime - lastpolltime)
+        rate = self.smoothing * newrate + (1 - self.smoothing) * rate
+        if rate * task.interval >= self.threshold:
+            factor = max(self.min_factor, min(factor, 1.0) / self.backoff)
+        else:
+            factor = min(self._max_factor(task), factor * self.backoff)
+        task.policystate[self] = [values, task.lastpolltime, rate, factor]
+        return max(now, due + task.interval * (factor - 1))
+
+    def factor(self, task):
+        """Returns the current interval multiplier for a task"""
+        state = task.policystate.get(self)
+        return 1.0 if state is None else state[3]
+
+    def _max_factor(self, task):
+        """Largest backoff for a task, reduced for each observer of its fields"""
+        observers = sum(getattr(task.device, fieldname).count_notifables() for fieldname in task.fieldnames)
+        return max(1.0, self.max_factor / (1.0 + observers))
+
+    @staticmethod
+    def _rate_of_change(lastvalues, values, elapsed):
+        """Largest rate of change of numeric values, per second"""
+        if elapsed <= 0:
+            return 0.0
+        rates = [abs(value - lastvalue) / elapsed for lastvalue, value in zip(lastvalues, values)
+                    if isinstance(value, (int, float)) and isinstance(lastvalue, (int, float))]
+        return max(rates) if rates else 0.0
+
+class HeatmiserPoller():
+    """Polls devices on a network in a background thread, following a timetable for the bus"""
+    def __init__(self, network, groups=None, policies=None):
+        self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self._logger.debug('creating an instance of %s', self.__class__.__name__)
+        self._network = network
+        self.groups = DEFAULT_POLL_GROUPS if groups is None else groups
+        self.policies = [] if policies is None else policies
+        self.tasks = []
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self._refreshes = {} #by device id, [device, {fieldname: maxage}]
+        self._thread = None
+        self.build_timetable()
+
+    def build_timetable(self, now=None):
+        """Create poll tasks with start times spread evenly across each group interval"""
+        if now is None:
+            now = clock.now()
+        self.tasks = []
+        devices = [device for device in self._network.controllers if hasattr(device, 'read_fields')]
+        for groupindex, group in enumerate(self.groups):
+            if not group.interval:
+                continue #not polled, as in capacity planning
+            # offset groups slightly so that groups with the same interval do not coincide
+            groupoffset = groupindex * self._network.adaptor.min_time_between_reads()
+            for deviceindex, device in enumerate(devices):
+                offset = group.interval * deviceindex / len(devices) + groupoffset
+                task = PollTask(device, group, now + offset)
+                if task.fieldnames:
+                    self.tasks.append(task)
+
+        # move tasks later so that no two start before the previous has left the bus
+        self.tasks.sort(key=lambda task: task.next_due)
+        slotend = now
+        for task in self.tasks:
+            task.next_due = max(task.next_due, slotend)
+            slotend = task.next_due + task.bustime + self._network.adaptor.min_time_between_reads()
+        self._logger.debug("Timetable built with %i tasks", len(self.tasks))
+
+    def start(self):
+        """Start polling in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._logger.warning("Polling already running")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='heatmiser-poller', daemon=True)
+        self._thread.start()
+        self._logger.info("Polling started for %i tasks", len(self.tasks))
+
+    def stop(self, timeout=None):
+        """Stop polling and wait for the current poll to finish"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._logger.info("Polling stopped")
+
+    def is_running(self):
+        """Returns True if background polling thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """Poll loop, run in background thread"""
+        while not self._stop_event.is_set():
+            waittime = self.run_once()
+            self._network.save_snapshot_if_due()
+            clock.wait(self._wake_event, waittime)
+            self._wake_event.clear()
+
+    def request_refresh(self, device, fieldnames, maxage=None):
+        """Queue fields on a device to be read as soon as the bus is free
+
+        Requests for fields that are already queued are collapsed into one read."""
+        with self._refresh_lock:
+            pending = self._refreshes.setdefault(id(device), [device, {}])[1]
+            newnames = [fieldname for fieldname in fieldnames if fieldname not in pending]
+            for fieldname in newnames:
+                pending[fieldname] = maxage
+        if newnames:
+            self._logger.debug("C%s refresh queued for %s", device.set_address, ', '.join(newnames))
+            self._wake_event.set()
+
+    def pending_refreshes(self):
+        """Returns number of fields waiting to be refreshed"""
+        with self._refresh_lock:
+            return sum(len(pending) for _, pending in self._refreshes.values())
+
+    def _take_refreshes(self):
+        """Remove and return all queued refreshes"""
+        with self._refresh_lock:
+            refreshes = self._refreshes
+            self._refreshes = {}
+        return refreshes
+
+    def run_once(self, now=None):
+        """Poll all devices that have tasks due, returns seconds until the next task is due"""
+        if now is None:
+            now = clock.now()
+        duetasks = sorted((task for task in self.tasks if task.next_due <= now),
+                            key=lambda task: task.next_due)
+
+        # refreshes are serviced first, as callers are waiting on them
+        refreshes = self._take_refreshes()
+        for device, pending in refreshes.values():
+            if self._stop_event.is_set():
+                break
+            self._refresh_device(device, pending)
+
+        # merge tasks on the same device so each device is read once, in order of first due
+        bydevice = {}
+        for task in duetasks:
+            bydevice.setdefault(id(task.device), []).append(task)
+        for devicetasks in bydevice.values():
+            if self._stop_event.is_set():
+                break
+            self._poll_device(devicetasks[0].device, devicetasks)
+            for task in devicetasks:
+                self._reschedule(task, now)
+
+        if not self.tasks:
+            return 1.0
+        return max(0.0, min(task.next_due for task in self.tasks) - clock.now())
+
+    def _poll_device(self, device, tasks):
+        """Read fields for a set of tasks from a device in one planned read"""
+        fieldnames = []
+        for task in tasks:
+            fieldnames.extend(fieldname for fieldname in task.fieldnames if fieldname not in fieldnames)
+        # skip fields read recently by other callers
+        maxage = min(task.current_interval for task in tasks) / 2.0
+        try:
+            device.read_fields(fieldnames, maxage)
+        except (HeatmiserError, serial.SerialException) as err:
+            self._logger.warning("C%s poll of %s failed due to %s", device.set_address,
+                                ', '.join(task.group.name for task in tasks), err)
+            self._network.adaptor.metrics.inc('heatmiser_polls_total', address=device.set_address, result='failed')
+            return False
+        self._network.adaptor.metrics.inc('heatmiser_polls_total', address=device.set_address, result='ok')
+        polltime = clock.now()
+        for task in tasks:
+            task.lastpolltime = polltime
+        return True
+
+    def _refresh_device(self, device, pending):
+        """Read queued fields from a device, fields with the same maxage are read together"""
+        bymaxage = {}
+        for fieldname, maxage in pending.items():
+            bymaxage.setdefault(maxage, []).append(fieldname)
+        for maxage, fieldnames in bymaxage.items():
+            try:
+                device.read_fields(fieldnames, maxage)
+            except (HeatmiserError, serial.SerialException) as err:
+                self._logger.warning("C%s refresh of %s failed due to %s", device.set_address,
+                                    ', '.join(fieldnames), err)
+
+    def _reschedule(self, task, now):
+        """Set next due time, keeping the task phase unless it has fallen more than an interval behind"""
+        basedue = task.next_due + task.interval
+        if basedue <= now:
+            basedue = now + task.interval
+        due = basedue
+        for policy in self.policies:
+            due = policy.next_due(task, now, due)
+        task.current_interval = max(task.interval + due - basedue, self._network.adaptor.min_time_between_reads())
+        task.next_due = due
+
+    def bus_utilisation(self):
+        """Fraction of bus time used by polling at the current task intervals"""
+        resettime = self._network.adaptor.min_time_between_reads()
+        return sum((task.bustime + resettime) / task.current_interval for task in self.tasks)
@@ -0,0 +1,126 @@
+"""Replay of captured bus traffic
+
+ReplaySerial stands in for the serial port. Each frame the adaptor sends is
+matched to the next sent frame in the capture and the frames received after it
+are returned to the adaptor, after the recorded delay scaled by the speed.
+ReplayAdaptor uses it so that a HeatmiserNetwork and its devices, observers and
+planners can be rerun against production traffic, for example
+
+    HeatmiserNetwork(configfile, adaptor_factory=lambda setup: ReplayAdaptor(setup, 'bus.cap', speed=10))
+
+A speed of None replays without any delays.
+"""
+from __future__ import absolute_import
+import logging
+import serial
+
+from . import clock
+from .adaptor import HeatmiserAdaptor
+from .capture import read_capture
+from .logsupport import FRAME_SENT, FRAME_RECEIVED
+
+#serial settings that are times, scaled by the replay speed
+COM_TIME_SETTINGS = ['COM_TIMEOUT', 'COM_START_TIMEOUT', 'COM_PROBE_START_TIMEOUT', 'COM_MIN_TIMEOUT',
+                        'COM_SEND_MIN_TIME', 'COM_BUS_RESET_TIME']
+
+class ReplaySerial(serial.SerialBase):
+    """Serial port that answers sent frames with the responses from a capture"""
+    #defaults for settings that are not in the configuration
+    COM_TIMEOUT = 1.0
+    COM_START_TIMEOUT = 0.1
+    COM_PROBE_START_TIMEOUT = 0.05
+    COM_MIN_TIMEOUT = 0.1
+    COM_SEND_MIN_TIME = 1.0
+    COM_BUS_RESET_TIME = 0.1
+
+    def __init__(self, frames, speed=1.0):
+        self._logger = logging.getLogger(__name__).getChild(self.__class__.__name__)
+        self._frames = frames
+        self.speed = speed
+        self.position = 0 #index of next frame in capture
+        self.matched = 0
+        self.skipped = 0 #frames in capture passed over to find a match
+        self.mismatches = 0 #frames sent with no match left in capture
+        self._input = b''
+        self._sendtime = None #capture and real time of last matched send
+        super(ReplaySerial, self).__init__()
+
+    def open(self):
+        """Open port, replay does not need a port name"""
+        self.is_open = True
+
+    def close(self):
+        """Close port"""
+        self.is_open = False
+
+    def _reconfigure_port(self, force_update=False):
+        """Nothing to configure"""
+
+    def is_finished(self):
+        """Returns True when all frames in the capture have been replayed or skipped"""
+        return self.position >= len(self._frames)
+
+    @property
+    def in_waiting(self):
+        """Number of response bytes available"""
+        return len(self._input)
+
+    def reset_input_buffer(self):
+        """Discard response bytes"""
+        self._input = b''
+
+    def write(self, data):
+        """Match frame to the next sent frame in the capture and queue the responses after it"""
+        data = bytes(data)
+        self._input = b''
+        for index in range(self.position, len(self._frames)):
+            timestamp, direction, frame = self._frames[index]
+            if direction == FRAME_SENT and frame == data:
+                self.skipped += index - self.position
+                self.position = index + 1
+                self.matched += 1
+                self._sendtime = (timestamp, clock.now())
+                return len(data)
+        self.mismatches += 1
+        self._sendtime = None
+        self._logger.warning("Replay has no match for sent frame %s", list(bytearray(data)))
+        return len(data)
+
+    def read(self, size=1):
+        """Returns up to size bytes of the next response, nothing if the capture had no response"""
+        if not self._input and self._sendtime is not None and self.position < len(self._frames):
+            timestamp, direction, frame = self._frames[self.position]
+            if direction == FRAME_RECEIVED:
+                self.position += 1
+                if self.speed:
+                    elapsed = clock.now() - self._sendtime[1]
+                    delay = (timestamp - self._sendtime[0]) / float(self.speed) - elapsed
+                    if delay > 0:
+                        clock.sleep(delay)
+                self._input = frame
+        if not self._input:
+            if self.timeout:
+                clock.sleep(self.timeout) #timeouts are already scaled by the adaptor settings
+            return b''
+        data, self._input = self._input[:size], self._input[size:]
+        return data
+
+class ReplayAdaptor(HeatmiserAdaptor):
+    """Adaptor that replays a capture file instead of using a serial port
+
+    Serial timings are scaled by the speed so that retries and bus settling are accelerated too."""
+    def __init__(self, setup, filename, speed=1.0):
+        self.speed = speed
+        self._frames = read_capture(filename)
+        super(ReplayAdaptor, self).__init__(setup)
+
+    def _create_port(self):
+        """Returns port answering from the capture"""
+        return ReplaySerial(self._frames, self.speed)
+
+    def _update_settings(self, settings):
+        """Update settings, scaling serial timings by the speed"""
+        super(ReplayAdaptor, self)._update_settings(settings)
+        for name in COM_TIME_SETTINGS:
+            value = settings['serial'].get(name, getattr(ReplaySerial, name))
+            setattr(self.serport, name, value / float(self.speed) if self.speed else 0.0)
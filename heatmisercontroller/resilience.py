@@ -0,0 +1,94 @@
+"""Retry policies and circuit breakers for operations on the bus
+
+A retry policy sets how many attempts are made and how long to wait between
+them. A circuit breaker is kept for each device address, after repeated failed
+operations it opens and calls fail straight away without using the bus, until
+an occasional probe call succeeds.
+"""
+from __future__ import absolute_import
+import random
+import threading
+
+from . import clock
+
+class RetryPolicy():
+    """Number of attempts and exponential backoff with jitter between them"""
+    def __init__(self, attempts=3, backoff=0.0, backoff_factor=2.0, max_backoff=2.0, jitter=0.0):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff #wait before first retry
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter #fraction of the wait added at random
+
+    def __repr__(self):
+        return "RetryPolicy(%i attempts, backoff %.2fs)" % (self.attempts, self.backoff)
+
+    def delay(self, retry):
+        """Seconds to wait before a retry, retry is 1 for the first retry"""
+        wait = min(self.max_backoff, self.backoff * self.backoff_factor ** (retry - 1))
+        return wait * (1 + random.uniform(0, self.jitter))
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+class CircuitBreaker():
+    """Tracks failed operations on a device and stops calls after repeated failures
+
+    After failure_threshold consecutive failures the breaker opens. Once reset_time has passed
+    a single probe call is allowed, which closes the breaker on success or opens it again.
+    If a probe never reports back, another probe is allowed after a further reset_time."""
+    def __init__(self, failure_threshold=5, reset_time=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_time = reset_time
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.openedtime = None
+        self.probetime = None #time last probe was allowed when half open
+        self._lock = threading.Lock()
+
+    def allow(self, timenow=None):
+        """Returns True if a call may be made, moving to half open when it is time to probe"""
+        if timenow is None:
+            timenow = clock.now()
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self._probe_due(timenow):
+                self.state = BREAKER_HALF_OPEN
+                self.probetime = timenow
+                return True
+            return False
+
+    def _probe_due(self, timenow):
+        """Returns True if open for reset_time, or half open with probe outstanding for reset_time"""
+        if self.state == BREAKER_OPEN:
+            return timenow >= self.openedtime + self.reset_time
+        if self.state == BREAKER_HALF_OPEN:
+            return timenow >= self.probetime + self.reset_time
+        return False
+
+    def is_available(self, timenow=None):
+        """Returns True if a call would be allowed, without changing state"""
+        if timenow is None:
+            timenow = clock.now()
+        with self._lock:
+            return self.state == BREAKER_CLOSED or self._probe_due(timenow)
+
+    def record_success(self):
+        """Close breaker after a successful call"""
+        with self._lock:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.openedtime = None
+            self.probetime = None
+
+    def record_failure(self, timenow=None):
+        """Count a failed call, opening the breaker if there have been too many or probe failed"""
+        if timenow is None:
+            timenow = clock.now()
+        with self._lock:
+            self.failures += 1
+            if self.state == BREAKER_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = BREAKER_OPEN
+                self.openedtime = timenow
@@ -1,7 +1,7 @@
 """Classes for holding and processing Heatmier heating and hot water schedule fields"""
 
 from __future__ import absolute_import
-from .hm_constants import CURRENT_TIME_DAY, CURRENT_TIME_HOUR, CURRENT_TIME_MIN
+from .hm_constants import CURRENT_TIME_DAY, CURRENT_TIME_HOUR, CURRENT_TIME_MIN, CURRENT_TIME_SEC
 
 #mapping for chunks of heating schedule for a day
 MAP_HOUR = 0
@@ -16,6 +16,9 @@ SCH_ENT_MIN = 2
 SCH_ENT_TEMP = 3
 #useful constants
 HOUR_MINUTES = 60
+MINUTE_SECONDS = 60
+DAY_HOURS = 24
+WEEK_DAYS = 7
 
 class Scheduler():
     """General Schedule base class, providing a set of inherited methods"""
@@ -42,6 +45,10 @@ class Scheduler():
             raise ValueError('Schedule entry wrong length %i'%len(entry))
         self.entries[entry] = schedule
 
+    def is_known(self):
+        """Returns True if all entries used by the schedule have been set"""
+        return all(self.entries[entry] is not None for entry in self.entrynames)
+
     def set_raw_field(self, field):
         """Set single field to schedule from field pointer"""
         self.set_raw(field.name, field.value)
@@ -111,9 +118,22 @@ class Scheduler():
         if scheduletarget is None:
             tomschedule = self._get_next_schedule_entry(timearray)
             scheduletarget = self._get_first_item_from_an_entry(tomschedule)
+            if scheduletarget is None:
+                return None
             return [self._get_next_day(timearray)] + scheduletarget
         else:
             return [timearray[CURRENT_TIME_DAY]] + scheduletarget
+
+    def get_seconds_to_next_item(self, timearray):
+        """Gets the seconds from a time to the next item in schedule, None if no next item"""
+        nextitem = self.get_next_schedule_item(timearray)
+        if nextitem is None:
+            return None
+        nowseconds = (((timearray[CURRENT_TIME_DAY] - 1) * DAY_HOURS + timearray[CURRENT_TIME_HOUR])
+                        * HOUR_MINUTES + timearray[CURRENT_TIME_MIN]) * MINUTE_SECONDS + timearray[CURRENT_TIME_SEC]
+        itemseconds = (((nextitem[SCH_ENT_DAY] - 1) * DAY_HOURS + nextitem[SCH_ENT_HOUR])
+                        * HOUR_MINUTES + nextitem[SCH_ENT_MIN]) * MINUTE_SECONDS
+        return (itemseconds - nowseconds) % (WEEK_DAYS * DAY_HOURS * HOUR_MINUTES * MINUTE_SECONDS)
             
     def _get_next_item_from_an_entry(self, schedule, timearray):
         """Gets the next item from a days schedule"""
@@ -160,7 +180,7 @@ class Scheduler():
     def _get_first_item_from_an_entry(self, schedule):
         """Gets the first item from a days schedule"""
         #gets first schedule entry if valid (not 24)
-        firstentry = self._chunks(schedule, self.valuesperentry).next()
+        firstentry = next(self._chunks(schedule, self.valuesperentry))
         if firstentry[MAP_HOUR] != HOUR_UNUSED:
             return firstentry
         return None
@@ -59,7 +59,7 @@ class Thermostat():
     def _text_function_over_prog(infields):
         infields.read_field('currenttime', MAX_AGE_MEDIUM)
             
-        locatimenow = infields.currenttime.localtimearray()
+        locatimenow = infields.currenttime.remote_timearray()
         scheduletarget = infields.heat_schedule.get_current_schedule_item(locatimenow)
 
         if infields.setroomtemp.is_unknown():
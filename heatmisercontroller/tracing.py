@@ -0,0 +1,185 @@
+"""Lightweight tracing of bus operations
+
+Spans follow the OpenTelemetry model (trace id, span id, parent, start and end
+time, attributes and status) without depending on it. The tracer is a no-op
+until one is set with set_tracer, so tracing costs little when not in use.
+ChromeTraceExporter writes finished spans as Chrome trace events, which can be
+viewed as a flame chart in chrome://tracing or Perfetto.
+"""
+from __future__ import absolute_import
+import os
+import json
+import random
+import threading
+
+from . import clock
+
+STATUS_UNSET = 'UNSET'
+STATUS_OK = 'OK'
+STATUS_ERROR = 'ERROR'
+
+class Span():
+    """Timed operation within a trace"""
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.parent = parent
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = STATUS_UNSET
+        self.thread_id = threading.current_thread().ident
+        self.start_time = clock.now()
+        self.end_time = None
+
+    def __repr__(self):
+        return "Span(%s %s)" % (self.name, self.attributes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, _traceback):
+        if exc_value is not None:
+            self.record_exception(exc_value)
+        self.end()
+        return False
+
+    def set_attribute(self, key, value):
+        """Add or update an attribute"""
+        self.attributes[key] = value
+
+    def record_exception(self, err):
+        """Mark span as failed with the exception"""
+        self.status = STATUS_ERROR
+        self.attributes['exception.type'] = type(err).__name__
+        self.attributes['exception.message'] = str(err)
+
+    def duration(self):
+        """Seconds from start to end, None if not ended"""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def end(self):
+        """End span and pass it to exporters"""
+        if self.end_time is not None:
+            return
+        self.end_time = clock.now()
+        if self.status == STATUS_UNSET:
+            self.status = STATUS_OK
+        self._tracer.end_span(self)
+
+class Tracer():
+    """Creates spans as children of the current span of each thread and exports them when ended"""
+    def __init__(self, exporters=None):
+        self.exporters = [] if exporters is None else exporters
+        self._local = threading.local()
+
+    def current_span(self):
+        """Returns the span in progress on this thread, None if there is none"""
+        return getattr(self._local, 'span', None)
+
+    def start_span(self, name, **attributes):
+        """Start span as child of the current span, use as a context manager to end it"""
+        span = Span(self, name, self.current_span(), attributes)
+        self._local.span = span
+        return span
+
+    def end_span(self, span):
+        """Restore parent as current span and export"""
+        if self.current_span() is span:
+            self._local.span = span.parent
+        for exporter in self.exporters:
+            exporter.export(span)
+
+class NoopSpan():
+    """Span that records nothing, returned when tracing is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, _traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        """Ignored"""
+
+    def record_exception(self, err):
+        """Ignored"""
+
+    def end(self):
+        """Ignored"""
+
+NOOP_SPAN = NoopSpan()
+
+class NoopTracer():
+    """Tracer used when tracing is off"""
+    exporters = []
+
+    @staticmethod
+    def current_span():
+        """No spans are recorded"""
+        return None
+
+    @staticmethod
+    def start_span(name, **attributes):
+        """Returns span that records nothing"""
+        return NOOP_SPAN
+
+NOOP_TRACER = NoopTracer()
+_TRACER = NOOP_TRACER
+
+def set_tracer(tracer):
+    """Set tracer used by the library, None turns tracing off"""
+    global _TRACER
+    _TRACER = NOOP_TRACER if tracer is None else tracer
+
+def get_tracer():
+    """Returns tracer used by the library"""
+    return _TRACER
+
+def start_span(name, **attributes):
+    """Start span on the library tracer, use as a context manager"""
+    return _TRACER.start_span(name, **attributes)
+
+class ChromeTraceExporter():
+    """Collects ended spans as Chrome trace events and writes them as JSON"""
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def export(self, span):
+        """Store span as a complete event, times in microseconds"""
+        args = dict(span.attributes)
+        args['status'] = span.status
+        args['span_id'] = '%016x' % span.span_id
+        if span.parent_id is not None:
+            args['parent_id'] = '%016x' % span.parent_id
+        event = {
+            'name': span.name,
+            'cat': 'heatmiser',
+            'ph': 'X',
+            'ts': span.start_time * 1e6,
+            'dur': span.duration() * 1e6,
+            'pid': self._pid,
+            'tid': span.thread_id,
+            'args': args
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def to_json(self):
+        """Returns trace as JSON string"""
+        with self._lock:
+            return json.dumps({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, default=str)
+
+    def write(self, filename):
+        """Write trace to file"""
+        with open(filename, 'w') as fhandle:
+            fhandle.write(self.to_json())
+
+    def clear(self):
+        """Remove stored events"""
+        with self._lock:
+            self.events = []
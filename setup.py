@@ -26,12 +26,16 @@ setup(name='heatmisercontroller',
         'configobj',
         'transitions'
       ],
+      extras_require={
+        'analysis': ['numpy']
+      },
       test_suite="tests",
       scripts=[
         'bin/hm_get_example.py',
         'bin/hm_set_example.py',
         'bin/hm_find_example.py',
-        'bin/hm_check_time_example.py'
+        'bin/hm_check_time_example.py',
+        'bin/hm_analyse_capture.py'
       ],
 
       include_package_data=True,
@@ -1,8 +1,12 @@
 """Lookbock self class for overloading serial port in unitests and mock adaptor"""
+import os
 import serial
 import logging
 from heatmisercontroller.adaptor import HeatmiserAdaptor
+from heatmisercontroller.network import HeatmiserNetwork
 from heatmisercontroller.exceptions import HeatmiserResponseError
+from heatmisercontroller.hm_constants import FUNC_READ
+from heatmisercontroller.framing import Crc16
 
 class SerialTestClass(object):
     """A mock serial port test class"""
@@ -44,21 +48,54 @@ class MockHeatmiserAdaptor(HeatmiserAdaptor):
         self.arguments = []
         self.outputs = []
         
-    def write_to_device(self, network_address, protocol, unique_address, length, payload):
+    def write_to_device(self, network_address, protocol, unique_address, length, payload, deadline=None):
         """Stores the arguments sent to write"""
         self.arguments.append((network_address, protocol, unique_address, length, payload))
 
     def setresponse(self, inputs):
         """Sets responses to read from device.
         
-        Expects a list of lists"""
+        Expects a list of lists, a None entry gives no response"""
         self.outputs = inputs
 
-    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False):
+    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False, deadline=None):
         """Stores the arguments sent to read and provides a response"""
         if len(self.outputs) > 0:
             self.arguments.append((network_address, protocol, unique_start_address, expected_length, readall))
-            logging.debug("Response %s"%(', '.join(str(x) for x in self.outputs[0])))
-            return self.outputs.pop(0)
+            response = self.outputs.pop(0)
+            if response is None:
+                raise HeatmiserResponseError("No Response")
+            logging.debug("Response %s"%(', '.join(str(x) for x in response)))
+            return response
         else:
             raise HeatmiserResponseError("No Response")
+
+    def probe_device(self, network_address, protocol, unique_start_address, expected_length):
+        """Stores the arguments sent to probe and provides a response"""
+        return self.read_from_device(network_address, protocol, unique_start_address, expected_length)
+
+def create_network(addresses):
+    """Create network with mock adaptor and prt_e day devices at addresses"""
+    module_path = os.path.abspath(os.path.dirname(__file__))
+    configfile = os.path.join(module_path, "nocontrollers.conf")
+    hmn = HeatmiserNetwork(configfile)
+    hmn.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+    for address in addresses:
+        settings = {'address': address, 'expected_model': 'prt_e_model', 'expected_prog_mode': 'day'}
+        hmn.controllers.append(hmn.add_device("C%i"%address, settings,
+                                                hmn._setup.settings['devicesgeneral']))
+    return hmn
+
+def read_response(source, start, payload, destination=129):
+    """Returns read response frame from a device, including CRC"""
+    length = 11 + len(payload)
+    frame = [destination, length & 0xff, length >> 8, source, FUNC_READ,
+                start & 0xff, start >> 8, len(payload) & 0xff, len(payload) >> 8] + payload
+    return frame + Crc16().run(frame)
+
+def fast_setup():
+    """Returns setup with serial timeouts short enough for tests at 19200 baud"""
+    setup = SetupTestClass()
+    setup.settings['serial'] = {'COM_BUS_RESET_TIME': 0.001, 'COM_TIMEOUT': 0.3, 'COM_START_TIMEOUT': 0.05,
+                                'COM_MIN_TIMEOUT': 0.05, 'COM_SEND_MIN_TIME': 0.001}
+    return setup
@@ -3,8 +3,13 @@ import unittest
 import logging
 from serial import SerialException
 
-from heatmisercontroller.adaptor import HeatmiserAdaptor
-from heatmisercontroller.exceptions import HeatmiserResponseError
+from heatmisercontroller.adaptor import HeatmiserAdaptor, retryer
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
+from heatmisercontroller.resilience import RetryPolicy, CircuitBreaker, BREAKER_OPEN
+from heatmisercontroller.metrics import NULL_METRICS
+from heatmisercontroller.exceptions import HeatmiserResponseError, HeatmiserDeadlineError
+from heatmisercontroller.exceptions import HeatmiserCircuitOpenError
 from .mock_serial import SerialTestClass, SetupTestClass
 from heatmisercontroller.hm_constants import HMV3_ID
 from heatmisercontroller.framing import Crc16
@@ -154,6 +159,21 @@ class TestReadWrite(unittest.TestCase):
         # Check that the returned data from the serial port == goodmessage
         self.assertEqual(retasarray, goodrequest)
         
+    def test_read_deadline_passed(self):
+        with self.assertRaises(HeatmiserDeadlineError):
+            self.func.read_from_device(5, HMV3_ID, 34, 4, deadline=0)
+        self.assertEqual(b'', self.serialport.serialPort.read(10))
+
+    def test_read_circuit_breaker(self):
+        self.func.breaker_failure_threshold = 1
+        with self.assertRaises(HeatmiserResponseError):
+            self.func.read_from_device(5, HMV3_ID, 34, 4)
+        self.assertEqual({5: 'open'}, self.func.breaker_states())
+        self.serialport.serialPort.reset_input_buffer()
+        with self.assertRaises(HeatmiserCircuitOpenError):
+            self.func.read_from_device(5, HMV3_ID, 34, 4)
+        self.assertEqual(b'', self.serialport.serialPort.read(10))
+
     def test_readall(self):
         goodresponse = [129, 21, 0, 5, 0, 0, 0, 10, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 33, 245]
         goodrequest = [5, 10, 129, 0, 0, 0, 255, 255, 65, 6]
@@ -167,6 +187,64 @@ class TestReadWrite(unittest.TestCase):
         retasarray = list(bytearray(ret))
         # Check that the returned data from the serial port == goodmessage
         self.assertEqual(retasarray, goodrequest)
-        
+
+class RetryerTestClass(object):
+    """Minimal adaptor with a retried read that fails with a set error"""
+    read_retry_policy = RetryPolicy(2)
+    metrics = NULL_METRICS
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_time=60)
+        self.errors = []
+
+    def circuit_breaker(self, _network_address):
+        """Single breaker for all addresses"""
+        return self.breaker
+
+    def dump_frame_trace(self, _network_address):
+        """No frame trace"""
+
+    @retryer('read_retry_policy')
+    def read(self, _network_address):
+        """Raise next error, taking a second on the clock"""
+        clock.sleep(1)
+        raise self.errors.pop(0)
+
+class TestRetryerBreaker(unittest.TestCase):
+    """Half open probes that end without a response error must open the breaker again"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        clock.set_clock(SimulatedClock(1000))
+        self.func = RetryerTestClass()
+        self.func.breaker.record_failure()
+        clock.sleep(60)
+
+    def tearDown(self):
+        clock.set_clock(None)
+
+    def test_probe_deadline(self):
+        self.func.errors = [HeatmiserResponseError("No Response")]
+        with self.assertRaises(HeatmiserDeadlineError):
+            self.func.read(5, deadline=clock.now() + 0.5)
+        self.assertEqual(BREAKER_OPEN, self.func.breaker.state)
+        self.assertFalse(self.func.breaker.allow())
+        clock.sleep(60)
+        self.assertTrue(self.func.breaker.is_available())
+
+    def test_probe_serial_error(self):
+        self.func.errors = [SerialException("port gone")]
+        with self.assertRaises(SerialException):
+            self.func.read(5)
+        self.assertEqual(BREAKER_OPEN, self.func.breaker.state)
+        clock.sleep(60)
+        self.assertTrue(self.func.breaker.allow())
+
+    def test_deadline_before_probe(self):
+        with self.assertRaises(HeatmiserDeadlineError):
+            self.func.read(5, deadline=clock.now())
+        #the breaker was not moved to half open, so a probe is still available
+        self.assertEqual(BREAKER_OPEN, self.func.breaker.state)
+        self.assertTrue(self.func.breaker.is_available())
+
 if __name__ == '__main__':
     unittest.main()
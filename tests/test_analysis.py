@@ -0,0 +1,78 @@
+"""Unittests for heatmisercontroller.analysis module"""
+from __future__ import absolute_import
+import unittest
+import random
+
+from heatmisercontroller.analysis import crc_valid, analyse_capture
+from heatmisercontroller.logsupport import FRAME_SENT, FRAME_RECEIVED
+from heatmisercontroller.hm_constants import HMV3_ID
+from heatmisercontroller.framing import form_read_frame
+from .mock_serial import read_response
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def request(address):
+    """Returns read request frame as bytes"""
+    return bytes(bytearray(form_read_frame(address, HMV3_ID, 129, 38, 2)))
+
+def response(address, crcok=True):
+    """Returns read response frame as bytes, with a bad CRC if crcok is False"""
+    frame = read_response(address, 38, [0, 180])
+    if not crcok:
+        frame[-1] ^= 0xff
+    return bytes(bytearray(frame))
+
+class TestCrcValid(unittest.TestCase):
+    """Unit tests for CRC checks"""
+    def setUp(self):
+        self.frames = [request(1), response(2), response(3, False), b'\x01', b'',
+                        bytes(bytearray(read_response(4, 0, [1] * 50)))]
+
+    def test_python(self):
+        self.assertEqual([True, True, False, False, False, True], crc_valid(self.frames, use_numpy=False))
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_numpy_matches_python(self):
+        rand = random.Random(1)
+        frames = self.frames + [bytes(bytearray(rand.randrange(256) for _ in range(rand.randrange(12, 16))))
+                                for _ in range(200)]
+        frames += [response(address % 32 + 1) for address in range(100)]
+        self.assertEqual(crc_valid(frames, use_numpy=False), crc_valid(frames, use_numpy=True))
+
+class TestAnalyseCapture(unittest.TestCase):
+    """Unit tests for capture statistics"""
+    def test_statistics(self):
+        frames = [(0.0, FRAME_SENT, request(1)), (0.1, FRAME_RECEIVED, response(1)),
+                    (0.5, FRAME_SENT, request(2)), #timeout
+                    (1.5, FRAME_SENT, request(2)), (1.6, FRAME_RECEIVED, response(2, False)),
+                    (2.6, FRAME_SENT, request(2)), (2.9, FRAME_RECEIVED, response(2)),
+                    (3.0, FRAME_SENT, request(1)), (3.2, FRAME_RECEIVED, response(1)),
+                    (3.3, FRAME_RECEIVED, response(1))]
+        stats = analyse_capture(frames, interval=2.0, use_numpy=False)
+        self.assertEqual(10, stats['frames'])
+        self.assertEqual(4, stats['crc_valid'])
+        self.assertEqual(1, stats['crc_invalid'])
+        self.assertEqual(1, stats['unsolicited'])
+        address1 = stats['addresses'][1]
+        self.assertEqual((2, 0), (address1['transactions'], address1['retries']))
+        self.assertAlmostEqual(0.2, address1['latency']['max'])
+        self.assertAlmostEqual(0.1, address1['latency']['p50'])
+        address2 = stats['addresses'][2]
+        self.assertEqual((2, 1, 1, 2), (address2['transactions'], address2['timeouts'],
+                                        address2['crc_failures'], address2['retries']))
+        #the first request to address 1 is repeated later, but after success so is not a retry
+        self.assertEqual({1: 2, 3: 1}, stats['retry_chains'])
+        self.assertEqual({10: 5}, stats['frame_lengths']['sent'])
+        self.assertEqual([0.0, 2.0], [start for start, _ in stats['utilisation']])
+        self.assertAlmostEqual((10 + 13 + 10 + 10 + 13) * 10 / 4800.0 / 2, stats['utilisation'][0][1])
+
+    def test_empty(self):
+        stats = analyse_capture([])
+        self.assertEqual(0, stats['frames'])
+        self.assertEqual([], stats['utilisation'])
+
+if __name__ == '__main__':
+    unittest.main()
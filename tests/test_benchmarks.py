@@ -0,0 +1,66 @@
+"""Unittests for the benchmark suite"""
+from __future__ import absolute_import
+import unittest
+import logging
+
+from benchmarks.cases import CASES
+from benchmarks.runner import run_cases, compare
+from benchmarks.soak import run_soak
+from heatmisercontroller import clock
+
+class TestBenchmarks(unittest.TestCase):
+    """Unit tests for benchmark cases and baseline comparison"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_cases_run(self):
+        names = [name for name, _ in CASES]
+        self.assertEqual(len(names), len(set(names)))
+        for _, setup in CASES:
+            setup()()
+
+    def test_run_cases(self):
+        results = run_cases(CASES[:2], repeat=1, min_time=0.001)
+        self.assertEqual([name for name, _ in CASES[:2]], list(results['benchmarks']))
+        for result in results['benchmarks'].values():
+            self.assertGreater(result['seconds'], 0)
+            self.assertGreaterEqual(result['calls'], 1)
+            self.assertGreater(result['relative'], 0)
+        self.assertGreater(results['calibration'], 0)
+
+    def test_compare(self):
+        baseline = {'benchmarks': {'a': {'relative': 1.0}, 'b': {'relative': 2.0}, 'old': {'relative': 1.0}}}
+        results = {'benchmarks': {'a': {'relative': 1.4}, 'b': {'relative': 3.2}, 'new': {'relative': 1.0}}}
+        comparison = compare(results, baseline, tolerance=0.5)
+        self.assertEqual([('a', 1.0, 1.4, 1.4, False), ('b', 2.0, 3.2, 1.6, True)],
+                            [(name, expected, relative, round(ratio, 3), regressed)
+                            for name, expected, relative, ratio, regressed in comparison])
+
+class TestSoak(unittest.TestCase):
+    """Unit tests for fleet soak harness"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_soak(self):
+        systemclock = clock.get_clock()
+        report = run_soak(stats=3, duration=900, dropout=0.05, write_interval=30)
+        self.assertIs(systemclock, clock.get_clock())
+        self.assertEqual(900, report['duration'])
+        self.assertLess(report['wall_time'], 30)
+        self.assertGreater(report['polls'], 200)
+        self.assertGreater(report['fields_per_second'], 1)
+        self.assertGreater(report['retries'], 0)
+        self.assertGreater(report['timeouts'], 0)
+        self.assertEqual(29, report['writes']['count']) #not at the end time
+        self.assertGreater(report['writes']['latency']['p50'], 0)
+        temperatures = report['staleness']['temperatures']
+        self.assertGreater(temperatures['count'], 0)
+        self.assertLessEqual(temperatures['p50'], temperatures['p99'])
+        self.assertLess(temperatures['p50'], 20)
+
+    def test_fleet_size(self):
+        with self.assertRaises(ValueError):
+            run_soak(stats=0, duration=10)
+
+if __name__ == '__main__':
+    unittest.main()
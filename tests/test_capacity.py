@@ -0,0 +1,54 @@
+"""Unittests for heatmisercontroller.capacity module"""
+from __future__ import absolute_import
+import unittest
+import logging
+
+from heatmisercontroller.capacity import plan_capacity, admit_groups
+from heatmisercontroller.polling import PollGroup
+from heatmisercontroller.exceptions import HeatmiserCapacityError
+from .mock_serial import create_network
+
+class TestCapacity(unittest.TestCase):
+    """Unit tests for capacity planning."""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.hmn = create_network(range(1, 9))
+
+    def test_plan(self):
+        groups = [PollGroup('temps', ['airtemp'], 10)]
+        plan = plan_capacity(self.hmn, groups)
+        readtime = self.hmn.C1._estimate_read_time(2) + 0.1
+        self.assertAlmostEqual(8 * readtime / 10, plan.utilisation)
+        self.assertTrue(plan.is_feasible())
+        self.assertAlmostEqual(1 - plan.utilisation, plan.headroom())
+        self.assertGreater(plan.write_rate(), 0)
+        self.assertEqual(10, plan.report()['groups']['temps']['interval'])
+
+    def test_plan_zero(self):
+        groups = [PollGroup('temps', ['airtemp'], 10), PollGroup('off', ['setroomtemp'], 0)]
+        plan = plan_capacity(self.hmn, groups)
+        self.assertEqual(0, plan.report()['groups']['off']['utilisation'])
+        self.assertAlmostEqual(plan.grouputilisation['temps'], plan.utilisation)
+
+        hmn = create_network([])
+        hmn.adaptor.min_time_between_reads = lambda: 0
+        plan = plan_capacity(hmn, groups)
+        self.assertEqual(0, plan.utilisation)
+        self.assertEqual(0, plan.write_rate())
+
+    def test_reject(self):
+        groups = [PollGroup('temps', ['airtemp', 'setroomtemp'], 1)]
+        with self.assertRaises(HeatmiserCapacityError):
+            admit_groups(self.hmn, groups, degrade=False)
+
+    def test_degrade(self):
+        groups = [PollGroup('temps', ['airtemp', 'setroomtemp'], 1),
+                    PollGroup('state', ['onoff'], 2)]
+        plan = admit_groups(self.hmn, groups, 0.5)
+        self.assertTrue(plan.degraded)
+        self.assertTrue(plan.is_feasible())
+        self.assertAlmostEqual(0.5, plan.utilisation)
+        self.assertAlmostEqual(2, plan.groups[1].interval / plan.groups[0].interval)
+
+if __name__ == '__main__':
+    unittest.main()
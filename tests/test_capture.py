@@ -0,0 +1,96 @@
+"""Unittests for heatmisercontroller.capture and replay modules"""
+from __future__ import absolute_import
+import unittest
+import logging
+import os
+import time
+import tempfile
+import shutil
+
+from heatmisercontroller.capture import CaptureWriter, read_capture
+from heatmisercontroller.replay import ReplayAdaptor
+from heatmisercontroller.adaptor import HeatmiserAdaptor
+from heatmisercontroller.network import HeatmiserNetwork
+from heatmisercontroller.logsupport import FRAME_SENT, FRAME_RECEIVED
+from heatmisercontroller.exceptions import HeatmiserError, HeatmiserResponseError
+from heatmisercontroller.hm_constants import HMV3_ID
+from heatmisercontroller.framing import form_read_frame
+from .mock_serial import SerialTestClass, SetupTestClass, read_response
+
+class TestCapture(unittest.TestCase):
+    """Unit tests for capturing and replaying frames"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'bus.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_write_read(self):
+        capture = CaptureWriter(self.filename)
+        capture(FRAME_SENT, [1, 2, 3], 10.0)
+        capture.close()
+        capture = CaptureWriter(self.filename) #appends
+        capture(FRAME_RECEIVED, [4, 5], 11.0)
+        capture.close()
+        capture(FRAME_RECEIVED, [6], 12.0) #ignored once closed
+        self.assertEqual([(10.0, FRAME_SENT, b'\x01\x02\x03'), (11.0, FRAME_RECEIVED, b'\x04\x05')],
+                            read_capture(self.filename))
+        #truncated record is ignored
+        with open(self.filename, 'ab') as fhandle:
+            fhandle.write(b'\x00\x01')
+        self.assertEqual(2, len(read_capture(self.filename)))
+
+    def test_not_capture(self):
+        with open(self.filename, 'wb') as fhandle:
+            fhandle.write(b'not a capture')
+        with self.assertRaises(HeatmiserError):
+            read_capture(self.filename)
+        with self.assertRaises(HeatmiserError):
+            CaptureWriter(self.filename)
+
+    def test_capture_and_replay(self):
+        serialport = SerialTestClass()
+        adaptor = HeatmiserAdaptor(SetupTestClass())
+        adaptor.serport = serialport.serialPort
+        adaptor.start_capture(self.filename)
+        serialport.serialPort.write([129, 15, 0, 5, 0, 34, 0, 4, 0, 1, 2, 3, 4, 48, 246])
+        self.assertEqual([1, 2, 3, 4], adaptor.read_from_device(5, HMV3_ID, 34, 4))
+        adaptor.stop_capture()
+        self.assertEqual([FRAME_SENT, FRAME_RECEIVED], [frame[1] for frame in read_capture(self.filename)])
+
+        replay = ReplayAdaptor(SetupTestClass(), self.filename, speed=None)
+        self.assertEqual([1, 2, 3, 4], replay.read_from_device(5, HMV3_ID, 34, 4))
+        self.assertTrue(replay.serport.is_finished())
+        #no more responses in capture
+        with self.assertRaises(HeatmiserResponseError):
+            replay.read_from_device(5, HMV3_ID, 34, 4)
+        self.assertEqual(1, replay.serport.matched)
+
+    def test_replay_speed(self):
+        capture = CaptureWriter(self.filename)
+        capture(FRAME_SENT, form_read_frame(5, HMV3_ID, 129, 34, 4), 10.0)
+        capture(FRAME_RECEIVED, read_response(5, 34, [1, 2, 3, 4]), 10.4)
+        capture.close()
+        replay = ReplayAdaptor(SetupTestClass(), self.filename, speed=2)
+        starttime = time.time()
+        self.assertEqual([1, 2, 3, 4], replay.read_from_device(5, HMV3_ID, 34, 4))
+        self.assertAlmostEqual(0.2, time.time() - starttime, delta=0.1)
+
+    def test_replay_network(self):
+        capture = CaptureWriter(self.filename)
+        capture(FRAME_SENT, [0, 10, 129, 0, 0, 0, 0, 0, 0, 0], 9.0) #unrelated frame is skipped
+        capture(FRAME_SENT, form_read_frame(1, HMV3_ID, 129, 38, 2), 10.0)
+        capture(FRAME_RECEIVED, read_response(1, 38, [0, 180]), 10.1)
+        capture.close()
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        hmn = HeatmiserNetwork(os.path.join(module_path, "nocontrollers.conf"),
+                                adaptor_factory=lambda setup: ReplayAdaptor(setup, self.filename, speed=None))
+        settings = {'address': 1, 'expected_model': 'prt_e_model', 'expected_prog_mode': 'day'}
+        hmn.controllers.append(hmn.add_device("C1", settings, hmn._setup.settings['devicesgeneral']))
+        self.assertEqual([18.0], hmn.C1.read_fields(['airtemp'], 0))
+        self.assertEqual(1, hmn.adaptor.serport.skipped)
+
+if __name__ == '__main__':
+    unittest.main()
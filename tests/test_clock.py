@@ -0,0 +1,78 @@
+"""Unittests for heatmisercontroller.clock module"""
+from __future__ import absolute_import
+import unittest
+import logging
+import threading
+import time
+
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock, SYSTEM_CLOCK, set_clock, get_clock
+from heatmisercontroller.emulator import HeatmiserEmulator, EmulatorAdaptor
+from heatmisercontroller.genericdevice import DEVICETYPES
+from heatmisercontroller.fields_special import HeatmiserFieldTime
+from .mock_serial import fast_setup
+
+class TestSimulatedClock(unittest.TestCase):
+    """Unit tests for simulated clock"""
+    def tearDown(self):
+        set_clock(None)
+
+    def test_sleep_advances(self):
+        simclock = SimulatedClock(1000.0)
+        starttime = time.time()
+        simclock.sleep(3600)
+        simclock.sleep(-1)
+        self.assertEqual(4600.0, simclock.now())
+        self.assertLess(time.time() - starttime, 1)
+        simclock.set_time(5000.0)
+        self.assertEqual(5000.0, simclock.now())
+
+    def test_wait(self):
+        simclock = SimulatedClock(0.0)
+        event = threading.Event()
+        self.assertFalse(simclock.wait(event, 10))
+        self.assertEqual(10.0, simclock.now())
+        event.set()
+        self.assertTrue(simclock.wait(event, 10))
+        self.assertEqual(10.0, simclock.now())
+
+    def test_library_clock(self):
+        self.assertIs(SYSTEM_CLOCK, get_clock())
+        set_clock(SimulatedClock(100.0))
+        self.assertEqual(100.0, clock.now())
+        clock.sleep(5)
+        self.assertEqual(105.0, clock.now())
+        #default time for local time array is taken from the library clock
+        self.assertEqual(HeatmiserFieldTime.localtimearray(105.0), HeatmiserFieldTime.localtimearray())
+
+class TestSimulatedEmulator(unittest.TestCase):
+    """Unit tests for running the whole stack on a simulated clock"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.simclock = SimulatedClock(1000000.0)
+        set_clock(self.simclock)
+
+    def tearDown(self):
+        set_clock(None)
+
+    def test_hours_of_reads(self):
+        emulator = HeatmiserEmulator(latency=0.05)
+        stat = emulator.add_stat(1)
+        stat.set_value('setroomtemp', 22)
+        adaptor = EmulatorAdaptor(fast_setup(), emulator)
+        device = DEVICETYPES['prt_e_model']['day'](adaptor, {'address': 1, 'expected_model': 'prt_e_model',
+                                                            'expected_prog_mode': 'day'})
+        starttime = time.time()
+        temperatures = []
+        for _ in range(12):
+            temperatures.append(device.read_field('airtemp', 0))
+            self.assertTrue(device.airtemp.check_data_fresh(10))
+            clock.sleep(600)
+            self.assertFalse(device.airtemp.check_data_fresh(10))
+        self.assertLess(time.time() - starttime, 5)
+        self.assertGreater(self.simclock.now() - 1000000.0, 7200)
+        self.assertEqual(18, temperatures[0])
+        self.assertGreater(max(temperatures), 21)
+
+if __name__ == '__main__':
+    unittest.main()
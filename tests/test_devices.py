@@ -2,13 +2,17 @@
 import unittest
 import logging
 import time
+import threading
 
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
 from heatmisercontroller.fields import HeatmiserFieldSingleReadOnly, HeatmiserFieldDoubleReadOnly
 from heatmisercontroller.devices_prt_e import ThermoStatDay
 from heatmisercontroller.devices_prt_hw import  ThermoStatHotWaterDay
 from heatmisercontroller.generaldevices import HeatmiserBroadcastDevice
 from heatmisercontroller.hm_constants import HMV3_ID, PROG_MODE_DAY
-from heatmisercontroller.exceptions import HeatmiserResponseError, HeatmiserControllerTimeError
+from heatmisercontroller.exceptions import HeatmiserResponseError, HeatmiserControllerTimeError, HeatmiserDeadlineError
+from heatmisercontroller.exceptions import HeatmiserCircuitOpenError
 
 from .mock_serial import SetupTestClass, MockHeatmiserAdaptor
 
@@ -17,7 +21,7 @@ class ArgumentStore(object):
     def __init__(self):
         self.arguments = ()
     
-    def store(self, *args):
+    def store(self, *args, **_kwargs):
         """Method used to replace other writing methods"""
         self.arguments = args
 
@@ -38,7 +42,34 @@ class TestBroadcastController(unittest.TestCase):
     def test_read_fields(self):
         responses = [[0, 0, 0, 0, 0, 0, 0, 170], [0, 1, 0, 0, 0, 0, 0, 180]]
         self.adaptor.setresponse(responses)
-        self.assertEqual([[0, 17], [1, 18]], self.func.read_fields(['tempholdmins', 'airtemp'], 0))
+        results = self.func.read_fields(['tempholdmins', 'airtemp'], 0)
+        self.assertEqual([[0, 17], [1, 18]], [result.value for result in results])
+        self.assertTrue(all(result.is_ok() for result in results))
+
+    def test_read_fields_skips_unhealthy(self):
+        dev3 = ThermoStatHotWaterDay(self.adaptor, dict(self.settings, address=3))
+        self.func._controllerlist.list.insert(0, dev3)
+        for _ in range(5):
+            dev3.health().record_failure()
+        responses = [[0, 0, 0, 0, 0, 0, 0, 170], [0, 1, 0, 0, 0, 0, 0, 180]]
+        self.adaptor.setresponse(responses)
+        results = self.func.read_fields(['tempholdmins', 'airtemp'], 0)
+        self.assertTrue(results[0].is_skipped())
+        self.assertIsInstance(results[0].error, HeatmiserCircuitOpenError)
+        self.assertEqual([[0, 17], [1, 18]], [result.value for result in results[1:]])
+        self.assertEqual(2, len(self.adaptor.arguments))
+
+    def test_read_fields_continues_after_deadline(self):
+        def raise_deadline(*_args, **_kwargs):
+            """Replaces read_fields on the first device"""
+            raise HeatmiserDeadlineError("no time left")
+        self.func._controllerlist.list[0].read_fields = raise_deadline
+        self.adaptor.setresponse([[0, 1, 0, 0, 0, 0, 0, 180]])
+        results = self.func.read_fields(['tempholdmins', 'airtemp'], 0)
+        self.assertIsInstance(results[0].error, HeatmiserDeadlineError)
+        self.assertFalse(results[0].is_skipped())
+        self.assertTrue(results[1].is_ok())
+        self.assertEqual([1, 18], results[1].value)
         
 class TestReadingData(unittest.TestCase):
     """Unittests for reading data functions"""
@@ -214,6 +245,33 @@ class TestReadingData(unittest.TestCase):
         self.assertEqual(lta,self.func.read_time())
 
 
+class TestExplain(unittest.TestCase):
+    """Unittests for explaining read and write plans without using the bus"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.settings = {'address':1, 'protocol':HMV3_ID, 'long_name':'test controller', 'expected_model':'prt_e_model', 'expected_prog_mode':PROG_MODE_DAY}
+        self.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        self.func = ThermoStatDay(self.adaptor, self.settings)
+
+    def test_explain_read(self):
+        self.func.airtemp.update_data([0, 180], time.time())
+        plan = self.func.explain_read(['airtemp', 'setroomtemp', 'hotwaterdemand'])
+        self.assertEqual(['airtemp'], plan['fresh'])
+        self.assertEqual(['hotwaterdemand'], plan['unknown'])
+        self.assertFalse(plan['read_all'])
+        self.assertEqual([18], [frame['start'] for frame in plan['frames']])
+        self.assertAlmostEqual(self.func._estimate_read_time(1), plan['estimated_time'])
+        #fallback to read all
+        plan = self.func.explain_read([field.name for field in self.func.fields], 0)
+        self.assertTrue(plan['read_all'])
+        self.assertEqual([(0, self.func.dcb_length)], [(frame['start'], frame['length']) for frame in plan['frames']])
+        self.assertEqual([], self.adaptor.arguments)
+
+    def test_explain_write(self):
+        plan = self.func.explain_write(['setroomtemp', 'onoff'], [20, 1])
+        self.assertEqual([(18, 1), (21, 1)], [(frame['start'], frame['length']) for frame in plan['frames']])
+        self.assertEqual([], self.adaptor.arguments)
+
 class TestHWfloorlimit(unittest.TestCase):
     """Unittests for other functions"""
     def setUp(self):
@@ -406,6 +464,144 @@ class TestSettingData(unittest.TestCase):
         self.func.set_field('onoff', 'OFF')
         self.assertEqual(self.tester.arguments, [(5, 3, 21, 1, [0])])
         self.assertEqual(self.func.onoff.value, 0)
-    
+
+class BlockingMockHeatmiserAdaptor(MockHeatmiserAdaptor):
+    """Mock adaptor whose reads wait until released, so that reads overlap"""
+    def __init__(self, setup):
+        super(BlockingMockHeatmiserAdaptor, self).__init__(setup)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False, deadline=None):
+        self.started.set()
+        self.release.wait(10) #only times out if a test has failed
+        return super(BlockingMockHeatmiserAdaptor, self).read_from_device(network_address, protocol,
+                                                                        unique_start_address, expected_length, readall, deadline)
+
+class WaitCountingEvent(threading.Event):
+    """Event that counts the threads that have waited on it"""
+    def __init__(self):
+        super(WaitCountingEvent, self).__init__()
+        self.waiting = 0
+        self._counted = threading.Condition()
+
+    def wait(self, timeout=None):
+        with self._counted:
+            self.waiting += 1
+            self._counted.notify_all()
+        return super(WaitCountingEvent, self).wait(timeout)
+
+    def wait_for_waiters(self, count):
+        """Returns True once count threads are waiting"""
+        with self._counted:
+            return self._counted.wait_for(lambda: self.waiting >= count, 10)
+
+class TestSingleFlight(unittest.TestCase):
+    """Unittests for collapsing concurrent reads"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.settings = {'address':1, 'protocol':HMV3_ID, 'long_name':'test controller', 'expected_model':'prt_e_model', 'expected_prog_mode':PROG_MODE_DAY}
+        self.adaptor = BlockingMockHeatmiserAdaptor(SetupTestClass())
+        self.func = ThermoStatDay(self.adaptor, self.settings)
+
+    def _run_concurrently(self, target, count):
+        """Run target in count threads, the first holding the bus until the others wait on its read"""
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        threads[0].start()
+        self.assertTrue(self.adaptor.started.wait(10))
+        inflight = WaitCountingEvent()
+        self.func._inflight[0].done = inflight
+        for thread in threads[1:]:
+            thread.start()
+        self.assertTrue(inflight.wait_for_waiters(count - 1))
+        self.adaptor.release.set()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_reads_collapse(self):
+        self.adaptor.setresponse([[0, 180]])
+        results = []
+        self._run_concurrently(lambda: results.append(self.func.read_fields(['airtemp'], 0)), 3)
+        self.assertEqual([(1, 3, 38, 2, False)], self.adaptor.arguments)
+        self.assertEqual([[18]] * 3, results)
+
+    def test_concurrent_read_error_shared(self):
+        self.adaptor.setresponse([None])
+        errors = []
+        def read():
+            try:
+                self.func.read_fields(['airtemp'], 0)
+            except HeatmiserResponseError as err:
+                errors.append(err)
+        self._run_concurrently(read, 2)
+        self.assertEqual(1, len(self.adaptor.arguments))
+        self.assertEqual(2, len(errors))
+        self.assertEqual([], self.func._inflight)
+
+class TestFreshness(unittest.TestCase):
+    """Unittests for freshness telemetry"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.settings = {'address':1, 'protocol':HMV3_ID, 'long_name':'test controller', 'expected_model':'prt_e_model', 'expected_prog_mode':PROG_MODE_DAY}
+        self.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        self.func = ThermoStatDay(self.adaptor, self.settings)
+
+    def test_hits_and_misses(self):
+        self.adaptor.setresponse([[0, 180]])
+        self.func.read_fields(['airtemp'])
+        self.func.read_fields(['airtemp'])
+        self.func.read_fields_cached(['airtemp'])
+        report = self.func.freshness_report()
+        airtemp = report['fields']['airtemp']
+        self.assertEqual((1, 2, 1), (airtemp['reads'], airtemp['hits'], airtemp['misses']))
+        self.assertEqual(3, airtemp['served'])
+        self.assertLess(airtemp['mean_age'], 1)
+        self.assertEqual(3, report['totals']['hits'] + report['totals']['misses'])
+
+class ClockMockHeatmiserAdaptor(MockHeatmiserAdaptor):
+    """Mock adaptor whose reads take 0.1s on the library clock"""
+    def read_from_device(self, network_address, protocol, unique_start_address, expected_length, readall=False, deadline=None):
+        clock.sleep(0.1)
+        return super(ClockMockHeatmiserAdaptor, self).read_from_device(network_address, protocol,
+                                                                        unique_start_address, expected_length, readall, deadline)
+
+class TestDeadline(unittest.TestCase):
+    """Unittests for reads and writes with a time budget"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        clock.set_clock(SimulatedClock(1000))
+        self.settings = {'address':1, 'protocol':HMV3_ID, 'long_name':'test controller', 'expected_model':'prt_e_model', 'expected_prog_mode':PROG_MODE_DAY}
+        self.adaptor = ClockMockHeatmiserAdaptor(SetupTestClass())
+        self.func = ThermoStatDay(self.adaptor, self.settings)
+
+    def tearDown(self):
+        clock.set_clock(None)
+
+    def test_read_no_time(self):
+        result = self.func.read_fields(['airtemp', 'setroomtemp'], 0, deadline=clock.now() - 1)
+        self.assertEqual([None, None], result)
+        self.assertEqual(['airtemp', 'setroomtemp'], result.incomplete)
+        self.assertEqual([], self.adaptor.arguments)
+
+    def test_read_partial(self):
+        #time for first block only
+        self.adaptor.setresponse([[17], [0, 180]])
+        result = self.func.read_fields(['airtemp', 'setroomtemp'], 0, timeout=0.15)
+        self.assertEqual([(1, 3, 18, 1, False)], self.adaptor.arguments)
+        self.assertEqual([None, 17], result)
+        self.assertEqual(['airtemp'], result.incomplete)
+        self.assertFalse(result.is_complete())
+
+    def test_read_complete(self):
+        self.adaptor.setresponse([[17], [0, 180]])
+        result = self.func.read_fields(['airtemp', 'setroomtemp'], 0, timeout=5)
+        self.assertEqual([18, 17], result)
+        self.assertTrue(result.is_complete())
+
+    def test_set_no_time(self):
+        with self.assertRaises(HeatmiserDeadlineError):
+            self.func.set_fields(['setroomtemp'], [20], timeout=0)
+        self.assertEqual([], self.adaptor.arguments)
+
 if __name__ == '__main__':
     unittest.main()
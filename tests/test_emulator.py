@@ -0,0 +1,130 @@
+"""Unittests for heatmisercontroller.emulator module"""
+from __future__ import absolute_import
+import unittest
+import logging
+import os
+
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
+from heatmisercontroller.emulator import HeatmiserEmulator, EmulatorAdaptor, PtyTransport, VirtualStat
+from heatmisercontroller.adaptor import HeatmiserAdaptor
+from heatmisercontroller.network import HeatmiserNetwork
+from heatmisercontroller.exceptions import HeatmiserResponseError
+from heatmisercontroller.hm_constants import HMV3_ID, BROADCAST_ADDR
+from .mock_serial import fast_setup
+
+class TestVirtualStat(unittest.TestCase):
+    """Unit tests for virtual stat memory and temperatures"""
+    def test_layout(self):
+        stat = VirtualStat(3, 'prt_hw_model', 'week', starttime=0)
+        self.assertEqual(stat.dcb_length, stat.get_value('DCBlen'))
+        self.assertEqual(3, stat.get_value('address'))
+        #airtemp is unique address 38, read high byte first
+        self.assertEqual(b'\x00\xb4', stat.read(38, 2, 0))
+        self.assertIsNone(stat.read(26, 2, 0)) #gap in dcb
+        #two byte fields are written low byte first, read only fields are not written
+        stat.write(24, [44, 1], 0)
+        self.assertEqual(300, stat.get_value('holidayhours'))
+        stat.write(38, [0, 0], 0)
+        self.assertEqual(18, stat.get_value('airtemp'))
+
+    def test_temperature_evolves(self):
+        stat = VirtualStat(1, starttime=0)
+        stat.advance(600)
+        self.assertEqual(1, stat.get_value('heatingdemand'))
+        self.assertAlmostEqual(19.0, stat.get_value('airtemp'))
+        stat.advance(3600)
+        self.assertEqual(0, stat.get_value('heatingdemand'))
+        stat.set_value('onoff', 0)
+        stat.advance(20000)
+        self.assertLess(stat.get_value('airtemp'), 18)
+
+    def test_address_range(self):
+        with self.assertRaises(ValueError):
+            VirtualStat(33)
+
+class TestEmulator(unittest.TestCase):
+    """Unit tests for emulator through adaptor"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.emulator = HeatmiserEmulator(baudrate=19200, seed=1)
+        self.emulator.add_stat(1, 'prt_e_model', 'day')
+        self.emulator.add_stat(2, 'prt_hw_model', 'week')
+        self.adaptor = EmulatorAdaptor(fast_setup(), self.emulator)
+
+    def test_read_write(self):
+        self.assertEqual([0, 180], self.adaptor.read_from_device(1, HMV3_ID, 38, 2))
+        self.adaptor.write_to_device(2, HMV3_ID, 18, 1, [25])
+        self.assertEqual(25, self.emulator.stats[2].get_value('setroomtemp'))
+        data = self.adaptor.read_all_from_device(2, HMV3_ID, self.emulator.stats[2].dcb_length)
+        self.assertEqual(self.emulator.stats[2].dcb_length, len(data))
+
+    def test_broadcast(self):
+        self.adaptor.write_to_device(BROADCAST_ADDR, HMV3_ID, 18, 1, [15])
+        self.assertEqual([15, 15], [stat.get_value('setroomtemp') for stat in self.emulator.stats.values()])
+        self.assertEqual(1, self.emulator.counts['broadcasts'])
+
+    def test_dropout_and_noise(self):
+        self.emulator.dropout = 1.0
+        with self.assertRaises(HeatmiserResponseError):
+            self.adaptor.read_from_device(1, HMV3_ID, 38, 2)
+        self.emulator.dropout = 0
+        self.emulator.noise = 1.0
+        with self.assertRaises(HeatmiserResponseError):
+            self.adaptor.read_from_device(2, HMV3_ID, 38, 2)
+        self.assertEqual(2, self.emulator.counts['corrupted'])
+
+    def test_unknown_address(self):
+        with self.assertRaises(HeatmiserResponseError):
+            self.adaptor.read_from_device(5, HMV3_ID, 38, 2)
+
+    def test_latency(self):
+        self.addCleanup(clock.set_clock, None)
+        clock.set_clock(SimulatedClock())
+        self.emulator.latency = 0.01
+        starttime = clock.now()
+        self.adaptor.read_from_device(1, HMV3_ID, 38, 2)
+        #request and response take 23 bytes on the wire, allow for rounding of the epoch time
+        self.assertGreaterEqual(clock.now() - starttime, 0.01 + 23 * 10 / 19200.0 - 1e-6)
+        self.assertLess(clock.now() - starttime, 0.1)
+        #response later than the start timeout is left for the next read
+        self.emulator.latency = 0.2
+        with self.assertRaises(HeatmiserResponseError):
+            self.adaptor.read_from_device(1, HMV3_ID, 38, 2)
+
+    def test_network(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        hmn = HeatmiserNetwork(os.path.join(module_path, "nocontrollers.conf"),
+                                adaptor_factory=lambda setup: EmulatorAdaptor(setup, self.emulator))
+        hmn.adaptor.serport.COM_BUS_RESET_TIME = 0.001
+        settings = {'address': 2, 'expected_model': 'prt_hw_model', 'expected_prog_mode': 'week'}
+        hmn.controllers.append(hmn.add_device("C2", settings, hmn._setup.settings['devicesgeneral']))
+        hmn.C2.read_all()
+        self.assertEqual(18, hmn.C2.airtemp.value)
+        self.assertEqual(self.emulator.stats[2].get_value('wday_water'), hmn.C2.wday_water.value)
+        hmn.C2.set_field('hotwaterdemand', 1)
+        self.assertEqual(1, self.emulator.stats[2].get_value('hotwaterdemand'))
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "pseudo terminals not available")
+class TestPtyTransport(unittest.TestCase):
+    """Unit tests for emulator served on a pseudo terminal"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.emulator = HeatmiserEmulator()
+        self.emulator.add_stat(1)
+        self.transport = PtyTransport(self.emulator)
+        self.transport.start()
+
+    def tearDown(self):
+        self.transport.stop()
+
+    def test_read(self):
+        setup = fast_setup()
+        adaptor = HeatmiserAdaptor(setup)
+        adaptor.serport.port = self.transport.port
+        adaptor.serport.baudrate = 4800
+        self.assertEqual([0, 180], adaptor.read_from_device(1, HMV3_ID, 38, 2))
+        adaptor.serport.close()
+
+if __name__ == '__main__':
+    unittest.main()
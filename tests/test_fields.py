@@ -111,6 +111,33 @@ class TestFields(unittest.TestCase):
         print(func.localtimearray(time.time()))
         print(fieldtime.get_value())
         
+    def test_drift_model(self):
+        fieldtime = HeatmiserFieldTime('test1', 5, MAX_AGE_LONG)
+        basetime = self.time_from_array([1, 12, 0, 0])
+        #clock gains one second every hour
+        for hour in range(4):
+            readtime = basetime + hour * 3600
+            fieldtime.update_data(fieldtime.localtimearray(readtime + hour), readtime)
+            fieldtime.comparecontrollertime()
+        self.assertTrue(fieldtime.is_drift_modelled())
+        self.assertAlmostEqual(fieldtime.drift_rate(), 1.0 / 3600)
+        self.assertAlmostEqual(fieldtime.predicted_timeerr(basetime + 5 * 3600), 5)
+        self.assertAlmostEqual(fieldtime.time_to_err_limit(basetime + 5 * 3600), 3 * 3600)
+        self.assertTrue(fieldtime.needs_resync(basetime + 8 * 3600))
+
+    def test_drift_model_reset_on_write(self):
+        fieldtime = HeatmiserFieldTime('test1', 5, MAX_AGE_LONG)
+        basetime = time.time()
+        fieldtime.update_data(fieldtime.localtimearray(basetime - 7200 + 3), basetime - 7200)
+        fieldtime.comparecontrollertime()
+        fieldtime.update_data(fieldtime.localtimearray(basetime + 5), basetime)
+        fieldtime.comparecontrollertime()
+        self.assertTrue(fieldtime.is_drift_modelled())
+        fieldtime.update_value(fieldtime.localtimearray(basetime), basetime)
+        self.assertFalse(fieldtime.is_drift_modelled())
+        self.assertEqual(fieldtime.timeerr, 0)
+        self.assertEqual(fieldtime.predicted_timeerr(), 0)
+
 def get_offset(timenum):
     #gettime zone offset for that date
     is_dst = time.daylight and time.localtime(timenum).tm_isdst > 0
@@ -127,6 +154,22 @@ class TestUpdates(unittest.TestCase):
         HeatmiserFieldSingleReadOnly('model', 0, [], None).update_data([4], None)
         #self.func._procfield([PROG_MODES[PROG_MODE_DAY]], HeatmiserFieldSingleReadOnly('programmode', 0, [], None))
         
+    def test_freshness(self):
+        field = HeatmiserFieldSingleReadOnly('test', 0, [0, 1], 10)
+        field.update_data([1], 100)
+        field.update_data([1], 105)
+        field.update_data([1], 125) #10s past max_age
+        field.freshness.record_request(True)
+        field.freshness.record_request(False)
+        field.freshness.record_serve(3)
+        report = field.freshness_report(130)
+        self.assertEqual(3, report['reads'])
+        self.assertEqual(10, report['stale_time'])
+        self.assertEqual(0.5, report['hit_ratio'])
+        self.assertEqual(3, report['mean_age'])
+        #includes current staleness
+        self.assertEqual(15, field.freshness_report(140)['stale_time'])
+
     def test_updatedata_range(self):
         field = HeatmiserFieldSingleReadOnly('test', 0, [0, 1], None)
         with self.assertRaises(HeatmiserResponseError):
@@ -0,0 +1,82 @@
+"""Unittests for heatmisercontroller.logsupport module"""
+from __future__ import absolute_import
+import unittest
+import logging
+
+from heatmisercontroller.logsupport import FrameRing, LazyFieldNames, LazyPadded, FRAME_SENT, FRAME_RECEIVED
+from heatmisercontroller.logsupport import MIN_FRAME_RING_SIZE
+from heatmisercontroller.adaptor import HeatmiserAdaptor
+from heatmisercontroller.hm_constants import HMV3_ID
+from .mock_serial import SerialTestClass, SetupTestClass
+
+class NamedField(object):
+    """Object with a field name"""
+    def __init__(self, name):
+        self.name = name
+
+class TestLazy(unittest.TestCase):
+    """Unit tests for lazy log arguments"""
+    def test_field_names(self):
+        names = LazyFieldNames([NamedField('airtemp'), NamedField('setroomtemp')])
+        self.assertEqual('airtemp, setroomtemp', str(names))
+        self.assertEqual('C1 airtemp, setroomtemp', "C%i %s" % (1, names))
+
+    def test_padded(self):
+        self.assertEqual('air  ', str(LazyPadded('air', 5)))
+
+class TestFrameRing(unittest.TestCase):
+    """Unit tests for frame ring buffer"""
+    def test_record(self):
+        ring = FrameRing(100)
+        ring(FRAME_SENT, [1, 2, 3], 10.0)
+        ring(FRAME_RECEIVED, [4, 5], 11.0)
+        self.assertEqual([(10.0, FRAME_SENT, b'\x01\x02\x03'), (11.0, FRAME_RECEIVED, b'\x04\x05')], ring.frames())
+        self.assertEqual('10.000 TX 01 02 03\n11.000 RX 04 05', ring.dump())
+
+    def test_overwrite_oldest(self):
+        ring = FrameRing(50) #holds three records of 11 header bytes and 5 data bytes
+        for index in range(5):
+            ring.record(FRAME_SENT, [index] * 5, float(index))
+        self.assertEqual([2.0, 3.0, 4.0], [frame[0] for frame in ring.frames()])
+        ring.record(FRAME_SENT, [5] * 5, 5.0)
+        self.assertEqual([3.0, 4.0, 5.0], [frame[0] for frame in ring.frames()])
+        self.assertEqual(b'\x05' * 5, ring.frames()[-1][2])
+        ring.clear()
+        self.assertEqual(0, len(ring))
+
+    def test_min_size(self):
+        with self.assertRaises(ValueError):
+            FrameRing(MIN_FRAME_RING_SIZE - 1)
+        ring = FrameRing(MIN_FRAME_RING_SIZE)
+        ring.record(FRAME_RECEIVED, [1] * 7, 1.0)
+        self.assertEqual([(1.0, FRAME_RECEIVED, b'\x01' * 7)], ring.frames())
+
+class TestAdaptorFrameTrace(unittest.TestCase):
+    """Unit tests for frame taps on adaptor"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.serialport = SerialTestClass()
+        setup = SetupTestClass()
+        setup.settings['controller']['frame_trace_size'] = 1024
+        self.func = HeatmiserAdaptor(setup)
+        self.func.serport = self.serialport.serialPort
+
+    def test_read_frames(self):
+        frames = []
+        self.func.add_frame_tap(lambda direction, data, timestamp: frames.append((direction, list(data))))
+        response = [129, 15, 0, 5, 0, 34, 0, 4, 0, 1, 2, 3, 4, 48, 246]
+        self.serialport.serialPort.write(response)
+        self.func.read_from_device(5, HMV3_ID, 34, 4)
+        self.assertEqual([FRAME_SENT, FRAME_RECEIVED], [direction for direction, _ in frames])
+        self.assertEqual(response, frames[1][1])
+        self.assertEqual([FRAME_SENT, FRAME_RECEIVED], [frame[1] for frame in self.func.frame_trace.frames()])
+        self.assertIsNotNone(self.func.lastsendtime)
+
+    def test_disabled(self):
+        adaptor = HeatmiserAdaptor(SetupTestClass())
+        self.assertIsNone(adaptor.frame_trace)
+        self.assertEqual([], adaptor.frame_taps)
+        self.assertIsNone(adaptor.lastsendtime)
+
+if __name__ == '__main__':
+    unittest.main()
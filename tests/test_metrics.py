@@ -0,0 +1,79 @@
+"""Unittests for heatmisercontroller.metrics module"""
+from __future__ import absolute_import
+import unittest
+import logging
+
+from heatmisercontroller.metrics import MetricsRegistry, NULL_METRICS
+from heatmisercontroller.adaptor import HeatmiserAdaptor
+from heatmisercontroller.hm_constants import HMV3_ID
+from .mock_serial import SerialTestClass, SetupTestClass
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Unit tests for metrics registry"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.metrics = MetricsRegistry()
+
+    def test_counter(self):
+        self.metrics.counter('test_total', 'Test counter')
+        self.metrics.inc('test_total', address=1)
+        self.metrics.inc('test_total', 2, address=1)
+        self.metrics.inc('test_total', address=2)
+        self.assertEqual({'test_total': {'{address="1"}': 3, '{address="2"}': 1}}, self.metrics.snapshot())
+
+    def test_histogram(self):
+        self.metrics.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+        self.metrics.observe('test_seconds', 0.05)
+        self.metrics.observe('test_seconds', 0.5)
+        self.metrics.observe('test_seconds', 5)
+        value = self.metrics.snapshot()['test_seconds']['']
+        self.assertEqual(3, value['count'])
+        self.assertEqual([(0.1, 1), (1, 2)], value['buckets'])
+
+    def test_prometheus(self):
+        self.metrics.histogram('test_seconds', 'Test histogram', buckets=(0.1,))
+        self.metrics.observe('test_seconds', 0.05, address=1)
+        self.metrics.gauge('test_ratio', 'Test gauge', lambda: 0.5)
+        self.assertEqual('# HELP test_ratio Test gauge\n'
+                        '# TYPE test_ratio gauge\n'
+                        'test_ratio 0.5\n'
+                        '# HELP test_seconds Test histogram\n'
+                        '# TYPE test_seconds histogram\n'
+                        'test_seconds_bucket{address="1",le="0.1"} 1\n'
+                        'test_seconds_bucket{address="1",le="+Inf"} 1\n'
+                        'test_seconds_sum{address="1"} 0.05\n'
+                        'test_seconds_count{address="1"} 1\n', self.metrics.to_prometheus())
+
+    def test_null(self):
+        NULL_METRICS.inc('test_total', address=1)
+        NULL_METRICS.observe('test_seconds', 1)
+        self.assertEqual({}, NULL_METRICS.snapshot())
+        self.assertEqual('', NULL_METRICS.to_prometheus())
+
+class TestAdaptorMetrics(unittest.TestCase):
+    """Unit tests for metrics recorded by adaptor"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.serialport = SerialTestClass()
+        setup = SetupTestClass()
+        setup.settings['controller']['metrics_enabled'] = True
+        self.func = HeatmiserAdaptor(setup)
+        self.func.serport = self.serialport.serialPort
+
+    def test_read_metrics(self):
+        self.serialport.serialPort.write([129, 15, 0, 5, 0, 34, 0, 4, 0, 1, 2, 3, 4, 48, 246])
+        self.func.read_from_device(5, HMV3_ID, 34, 4)
+        snapshot = self.func.metrics.snapshot()
+        self.assertEqual(1, snapshot['heatmiser_read_latency_seconds']['{address="5"}']['count'])
+        self.assertEqual(1, snapshot['heatmiser_first_byte_wait_seconds']['']['count'])
+        self.assertEqual(10, snapshot['heatmiser_bytes_sent_total'][''])
+        self.assertEqual(15, snapshot['heatmiser_bytes_received_total'][''])
+        self.assertGreater(snapshot['heatmiser_bus_busy_ratio'][''], 0)
+
+    def test_disabled(self):
+        adaptor = HeatmiserAdaptor(SetupTestClass())
+        self.assertFalse(adaptor.metrics.enabled)
+        self.assertEqual({}, adaptor.metrics.snapshot())
+
+if __name__ == '__main__':
+    unittest.main()
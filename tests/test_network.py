@@ -3,12 +3,38 @@ from __future__ import absolute_import
 import unittest
 import logging
 import os
+import tempfile
+import json
+import threading
 
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
 from heatmisercontroller.network import HeatmiserNetwork
+from heatmisercontroller.fields_special import HeatmiserFieldTime
 from heatmisercontroller.exceptions import HeatmiserControllerSetupInitError
 from heatmisercontroller.genericdevice import HeatmiserDevice
 from .mock_serial import SetupTestClass, MockHeatmiserAdaptor
 
+class BusCheckingClock(SimulatedClock):
+    """Simulated clock recording whether another thread could take the bus lock during each sleep"""
+    def __init__(self, start, buslock):
+        super().__init__(start)
+        self.buslock = buslock
+        self.busfree = []
+
+    def sleep(self, seconds):
+        thread = threading.Thread(target=self._try_lock)
+        thread.start()
+        thread.join()
+        super().sleep(seconds)
+
+    def _try_lock(self):
+        """Try to take the bus lock without waiting"""
+        acquired = self.buslock.acquire(blocking=False)
+        if acquired:
+            self.buslock.release()
+        self.busfree.append(acquired)
+
 class TestNetwork(unittest.TestCase):
     """Unit tests for network class."""
     def setUp(self):
@@ -31,7 +57,8 @@ class TestNetwork(unittest.TestCase):
         hmn.adaptor = adaptor
 
         #queue some data to recieve
-        responses = [[4, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1], [4, 0, 1, 0, 0, 0, 0, 2, 0, 0, 0, 0, 1]]
+        responses = [[1, 37, 0, 22, 4, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1],
+                        [1, 37, 0, 22, 4, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0, 0, 1]]
         adaptor.setresponse(responses)
         
         hmn.find_devices(3)
@@ -41,12 +68,207 @@ class TestNetwork(unittest.TestCase):
         self.assertIsInstance(hmn.controllers[1], HeatmiserDevice)
         self.assertEqual(hmn.controllers[1].set_address, 2)
         
+    def test_network_find_deadline(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        hmn = HeatmiserNetwork(configfile)
+        hmn.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        found = hmn.find_devices(3, timeout=0)
+        self.assertEqual([], found)
+        self.assertEqual([1, 2, 3], found.incomplete)
+        self.assertEqual([], hmn.adaptor.arguments)
+
+    def test_network_find_fast_cached(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        cachefile = os.path.join(tempfile.mkdtemp(), "discovery.json")
+
+        hmn = HeatmiserNetwork(configfile)
+        adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.adaptor = adaptor
+        header1 = [1, 37, 0, 22, 4, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+        header3 = [0, 75, 0, 22, 3, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0]
+        adaptor.setresponse([header1, None, header3])
+        hmn.find_devices(3, fast=True, cachefile=cachefile)
+        self.assertEqual([(1, 3, 0, 17, False), (2, 3, 0, 17, False), (3, 3, 0, 17, False)], adaptor.arguments)
+        self.assertEqual([1, 3], [controller.set_address for controller in hmn.controllers])
+        self.assertEqual('week', hmn.C3.set_expected_prog_mode)
+
+        #restart only checks cached addresses
+        hmn = HeatmiserNetwork(configfile)
+        adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.adaptor = adaptor
+        adaptor.setresponse([header1, header3])
+        hmn.find_devices(fast=True, cachefile=cachefile)
+        self.assertEqual([(1, 3, 0, 17, False), (3, 3, 0, 17, False)], adaptor.arguments)
+        self.assertEqual(2, len(hmn.controllers))
+
+    def test_network_find_cached_fingerprint(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        cachedir = tempfile.mkdtemp()
+        header1 = [1, 37, 0, 22, 4, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+
+        #full and fast scans store the same fingerprint, so either can be compared with the other
+        caches = []
+        for fast in (False, True):
+            cachefile = os.path.join(cachedir, "discovery%i.json" % fast)
+            hmn = HeatmiserNetwork(configfile)
+            hmn.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+            hmn.adaptor.setresponse([header1])
+            hmn.find_devices(1, fast=fast, cachefile=cachefile)
+            with open(cachefile) as fhandle:
+                caches.append(json.load(fhandle))
+        self.assertEqual(caches[1], caches[0])
+        self.assertIsNotNone(caches[0]['1']['DCBlen'])
+        self.assertIsNotNone(caches[0]['1']['version'])
+
+    def test_network_find_empty_cache(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        cachefile = os.path.join(tempfile.mkdtemp(), "discovery.json")
+        header1 = [1, 37, 0, 22, 4, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+
+        #scan with nothing on the bus does not store a cache
+        hmn = HeatmiserNetwork(configfile)
+        hmn.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.find_devices(2, fast=True, cachefile=cachefile)
+        self.assertFalse(os.path.exists(cachefile))
+
+        #empty cache, as written by earlier versions, gives a full scan
+        with open(cachefile, 'w') as fhandle:
+            fhandle.write('{}')
+        hmn = HeatmiserNetwork(configfile)
+        adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.adaptor = adaptor
+        adaptor.setresponse([header1, None])
+        hmn.find_devices(2, fast=True, cachefile=cachefile)
+        self.assertEqual([(1, 3, 0, 17, False), (2, 3, 0, 17, False)], adaptor.arguments)
+        self.assertEqual([1], [controller.set_address for controller in hmn.controllers])
+        with open(cachefile) as fhandle:
+            self.assertIn('"1"', fhandle.read())
+
     def test_network_stat_add(self):
         module_path = os.path.abspath(os.path.dirname(__file__))
         configfile = os.path.join(module_path, "hmcontroller.conf")
         hmn = HeatmiserNetwork(configfile)
         self.assertEqual(1, hmn.get_stat_address('Kit'))
     
+    def test_network_sync_time(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "hmcontroller.conf")
+        hmn = HeatmiserNetwork(configfile)
+
+        setup = SetupTestClass()
+        adaptor = MockHeatmiserAdaptor(setup)
+        hmn.adaptor = adaptor
+        hmn.All._adaptor = adaptor
+
+        timearray = hmn.sync_time()
+
+        self.assertEqual([(255, 3, 43, 4, timearray)], adaptor.arguments)
+        for controller in hmn.controllers:
+            self.assertEqual(timearray, controller.currenttime.value)
+            self.assertEqual(0, controller.currenttime.timeerr)
+
+    def test_network_sync_time_holds_bus(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "hmcontroller.conf")
+        hmn = HeatmiserNetwork(configfile)
+        adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.adaptor = adaptor
+        hmn.All._adaptor = adaptor
+        simclock = BusCheckingClock(1000.5, adaptor._bus_lock)
+        clock.set_clock(simclock)
+        self.addCleanup(clock.set_clock, None)
+
+        hmn.sync_time()
+        #bus could not be taken by another thread while waiting for the second boundary
+        self.assertEqual([False], simclock.busfree)
+        self.assertEqual(1, len(adaptor.arguments))
+
+    def test_network_snapshot(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "hmcontroller.conf")
+        snapshotfile = os.path.join(tempfile.mkdtemp(), "snapshot.json")
+
+        hmn = HeatmiserNetwork(configfile)
+        hmn.Kit.lastreadtime = 1000
+        hmn.Kit._procpartpayload([1, 1, 17, 0, 17, 0, 0, 0, 1], 'remoteairtemp', 'hotwaterdemand')
+        hmn.save_snapshot(snapshotfile)
+
+        hmn = HeatmiserNetwork(configfile)
+        self.assertEqual(5, hmn.load_snapshot(snapshotfile))
+        self.assertEqual(25.7, hmn.Kit.remoteairtemp.value)
+        self.assertEqual(1, hmn.Kit.hotwaterdemand.value)
+        self.assertEqual(1000, hmn.Kit.remoteairtemp.lastreadtime)
+        self.assertIsNone(hmn.Kit.setroomtemp.lastreadtime)
+        self.assertIsNone(hmn.B1.airtemp.lastreadtime)
+
+    @staticmethod
+    def _time_snapshot_network(timearray, readtime, timedrift):
+        """Returns network with a prt_e device and a snapshot file holding only its currenttime"""
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        snapshotfile = os.path.join(tempfile.mkdtemp(), "snapshot.json")
+        hmn = HeatmiserNetwork(configfile)
+        hmn.adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        settings = {'address': 1, 'expected_model': 'prt_e_model', 'expected_prog_mode': 'day'}
+        hmn.controllers.append(hmn.add_device('C1', settings, hmn._setup.settings['devicesgeneral']))
+
+        snapshot = hmn.C1.get_snapshot()
+        dcb = bytearray(hmn.C1.dcb_length)
+        dcb[hmn.C1.currenttime.dcbaddress:hmn.C1.currenttime.last_dcb_byte_address() + 1] = bytearray(timearray)
+        snapshot['dcb'] = bytes(dcb).hex()
+        snapshot['readtimes'] = {'currenttime': readtime}
+        snapshot['timedrift'] = timedrift
+        with open(snapshotfile, 'w') as fhandle:
+            json.dump({'time': readtime, 'devices': {'1': snapshot}}, fhandle)
+        return hmn, snapshotfile
+
+    def test_network_snapshot_no_writes(self):
+        #controller time a day out from the read time, which would be corrected if read from the device
+        hmn, snapshotfile = self._time_snapshot_network([1, 0, 0, 0], 1000.0, [])
+        self.assertEqual(1, hmn.load_snapshot(snapshotfile))
+        self.assertEqual([], hmn.adaptor.arguments)
+        self.assertEqual([1, 0, 0, 0], hmn.C1.currenttime.value)
+        self.assertFalse(hmn.C1._restoring)
+
+    def test_network_snapshot_time_error(self):
+        clock.set_clock(SimulatedClock(2000))
+        self.addCleanup(clock.set_clock, None)
+        localtimearray = HeatmiserFieldTime.localtimearray
+        #controller a minute ahead when read, without drift history the error comes from the value
+        hmn, snapshotfile = self._time_snapshot_network(localtimearray(1060), 1000.0, [])
+        hmn.load_snapshot(snapshotfile)
+        self.assertEqual(60, hmn.C1.currenttime.timeerr)
+        self.assertEqual(localtimearray(2060), hmn.C1.currenttime.get_value())
+        self.assertEqual(localtimearray(2060), hmn.C1.currenttime.remote_timearray())
+
+        #with drift history the latest error is used
+        hmn, snapshotfile = self._time_snapshot_network(localtimearray(1060), 1000.0, [[1000.0, 30]])
+        hmn.load_snapshot(snapshotfile)
+        self.assertEqual(30, hmn.C1.currenttime.timeerr)
+        self.assertEqual(localtimearray(2030), hmn.C1.currenttime.remote_timearray())
+
+    def test_network_warm_up(self):
+        module_path = os.path.abspath(os.path.dirname(__file__))
+        configfile = os.path.join(module_path, "nocontrollers.conf")
+        hmn = HeatmiserNetwork(configfile)
+        adaptor = MockHeatmiserAdaptor(SetupTestClass())
+        hmn.adaptor = adaptor
+        settings = {'address': 1, 'expected_model': 'prt_e_model', 'expected_prog_mode': 'day'}
+        hmn.controllers.append(hmn.add_device('C1', settings, hmn._setup.settings['devicesgeneral']))
+
+        #hot fields respond, remaining fields do not
+        adaptor.setresponse([[1, 1, 0, 170, 0, 180, 0, 1]])
+        metrics = hmn.warm_up(background=False)
+        self.assertEqual([(1, 3, 34, 8, False)], adaptor.arguments)
+        self.assertEqual(18, hmn.C1.airtemp.value)
+        self.assertIsNotNone(metrics['temperature_map_time'])
+        self.assertIsNone(metrics['complete_time'])
+        self.assertEqual([1], metrics['failed'])
+
     def test_no_file(self):
         with self.assertRaises(HeatmiserControllerSetupInitError):
             HeatmiserNetwork('nofile.conf')
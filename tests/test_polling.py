@@ -0,0 +1,157 @@
+"""Unittests for heatmisercontroller.polling module"""
+from __future__ import absolute_import
+import unittest
+import logging
+import time
+
+from heatmisercontroller import clock
+from heatmisercontroller.clock import SimulatedClock
+from heatmisercontroller.polling import HeatmiserPoller, PollGroup, SchedulePolicy, VolatilityPolicy
+from .mock_serial import create_network
+
+class TestPoller(unittest.TestCase):
+    """Unit tests for poller class."""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.hmn = create_network([1, 2])
+        self.groups = [PollGroup('temps', ['airtemp', 'hotwaterdemand'], 10),
+                        PollGroup('state', ['setroomtemp'], 60)]
+
+    def test_timetable_spread(self):
+        poller = HeatmiserPoller(self.hmn, self.groups)
+        poller.build_timetable(0)
+        self.assertEqual(4, len(poller.tasks))
+        temps = [task.next_due for task in poller.tasks if task.group.name == 'temps']
+        self.assertEqual([0, 5], temps)
+        #tasks do not overlap on the bus
+        for first, second in zip(poller.tasks, poller.tasks[1:]):
+            self.assertGreaterEqual(second.next_due, first.next_due + first.bustime)
+
+    def test_run_once_merges_device_reads(self):
+        poller = HeatmiserPoller(self.hmn, self.groups)
+        poller.build_timetable(0)
+        self.hmn.adaptor.setresponse([[17], [0, 180], [18], [0, 190]])
+        poller.run_once(100)
+        self.assertEqual([(1, 3, 18, 1, False), (1, 3, 38, 2, False),
+                            (2, 3, 18, 1, False), (2, 3, 38, 2, False)], self.hmn.adaptor.arguments)
+        self.assertEqual(18, self.hmn.C1.airtemp.value)
+        self.assertEqual(18, self.hmn.C2.setroomtemp.value)
+        #next due keeps to interval after falling behind
+        self.assertEqual([110, 110, 160, 160], sorted(task.next_due for task in poller.tasks))
+
+    def test_failed_poll_reschedules(self):
+        poller = HeatmiserPoller(self.hmn, self.groups)
+        poller.build_timetable(0)
+        poller.run_once(0)
+        self.assertTrue(all(task.lastpolltime is None for task in poller.tasks))
+        self.assertEqual([5, 10], sorted(task.next_due for task in poller.tasks if task.group.name == 'temps'))
+
+    def test_zero_interval_not_polled(self):
+        clock.set_clock(SimulatedClock(0))
+        self.addCleanup(clock.set_clock, None)
+        groups = [PollGroup('temps', ['airtemp', 'hotwaterdemand'], 10), PollGroup('off', ['setroomtemp'], 0)]
+        poller = HeatmiserPoller(self.hmn, groups)
+        poller.build_timetable(0)
+        self.assertEqual(['temps', 'temps'], [task.group.name for task in poller.tasks])
+        self.assertEqual(5, poller.run_once(0))
+        self.assertGreater(poller.bus_utilisation(), 0)
+
+    def test_schedule_policy(self):
+        policy = SchedulePolicy(stretch=4, settle=30)
+        poller = HeatmiserPoller(self.hmn, self.groups, [policy])
+        poller.build_timetable(0)
+        statetask = [task for task in poller.tasks if task.group.name == 'state'][0]
+        tempstask = [task for task in poller.tasks if task.group.name == 'temps'][0]
+        #schedule unknown, so interval is kept
+        poller._reschedule(statetask, 1000)
+        self.assertEqual(1060, statetask.next_due)
+
+        device = statetask.device
+        device.heat_schedule.set_raw_all([7, 0, 21, 9, 0, 12, 17, 0, 21, 22, 30, 15])
+        device.currenttime.remote_timearray = lambda: [2, 12, 0, 0]
+        #far from transition so interval is stretched
+        poller._reschedule(statetask, 1000)
+        self.assertEqual(1240, statetask.next_due)
+        #poll just after transition
+        device.currenttime.remote_timearray = lambda: [2, 16, 59, 0]
+        poller._reschedule(statetask, 1000)
+        self.assertEqual(1090, statetask.next_due)
+        #other groups are not affected
+        tempstask.next_due = 1000
+        poller._reschedule(tempstask, 1000)
+        self.assertEqual(1010, tempstask.next_due)
+
+    def _poll_temps(self, poller, task, polltime, value):
+        """Simulate poll of temps task returning airtemp value"""
+        task.device.airtemp.value = value
+        task.lastpolltime = polltime
+        task.next_due = polltime
+        poller._reschedule(task, polltime)
+
+    def test_volatility_policy(self):
+        policy = VolatilityPolicy(groupnames=('temps',), min_factor=0.5, max_factor=4, threshold=0.5)
+        poller = HeatmiserPoller(self.hmn, self.groups, [policy])
+        task = [task for task in poller.tasks if task.group.name == 'temps'][0]
+        self._poll_temps(poller, task, 0, 20)
+        self.assertEqual(10, task.next_due)
+        #stable so backs off exponentially to bound
+        self._poll_temps(poller, task, 10, 20)
+        self.assertEqual(30, task.next_due)
+        self._poll_temps(poller, task, 30, 20)
+        self.assertEqual(70, task.next_due)
+        self.assertEqual(40, task.current_interval)
+        self._poll_temps(poller, task, 70, 20)
+        self.assertEqual(4, policy.factor(task))
+        #moving so shortens interval
+        self._poll_temps(poller, task, 110, 25)
+        self.assertEqual(0.5, policy.factor(task))
+        self.assertEqual(115, task.next_due)
+        self.assertLess(poller.bus_utilisation(), 1)
+        #state is kept on the task, so a rebuilt timetable starts afresh
+        poller.build_timetable()
+        task = [task for task in poller.tasks if task.group.name == 'temps'][0]
+        self.assertEqual(1.0, policy.factor(task))
+
+    def test_volatility_policy_observers(self):
+        policy = VolatilityPolicy(groupnames=('temps',), max_factor=4)
+        poller = HeatmiserPoller(self.hmn, self.groups, [policy])
+        task = [task for task in poller.tasks if task.group.name == 'temps'][0]
+        task.device.airtemp.add_notifable_changed(lambda field: None)
+        for polltime in range(0, 100, 10):
+            self._poll_temps(poller, task, polltime, 20)
+        self.assertEqual(2, policy.factor(task))
+
+    def test_stale_while_revalidate(self):
+        poller = HeatmiserPoller(self.hmn, [])
+        self.hmn.C1.refresh_queue = poller
+        self.assertEqual([(None, None)], self.hmn.C1.read_fields_cached(['airtemp']))
+        #duplicate requests collapse into a single read
+        self.hmn.C1.read_fields_cached(['airtemp', 'setroomtemp'])
+        self.assertEqual(2, poller.pending_refreshes())
+        self.assertEqual([], self.hmn.adaptor.arguments)
+
+        self.hmn.adaptor.setresponse([[17], [0, 180]])
+        poller.run_once(0)
+        self.assertEqual([(1, 3, 18, 1, False), (1, 3, 38, 2, False)], self.hmn.adaptor.arguments)
+        self.assertEqual(0, poller.pending_refreshes())
+        value, age = self.hmn.C1.read_fields_cached(['airtemp'])[0]
+        self.assertEqual(18, value)
+        self.assertLess(age, 1)
+        self.assertEqual(0, poller.pending_refreshes())
+
+class TestExplain(unittest.TestCase):
+    """Unit tests for explaining poll plans."""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.hmn = create_network([1, 2])
+
+    def test_explain_poll(self):
+        groups = [PollGroup('temps', ['airtemp'], 10)]
+        explained = self.hmn.explain_poll(groups)
+        self.assertEqual(2, explained['frames'])
+        readtime = self.hmn.C1._estimate_read_time(2)
+        self.assertAlmostEqual(2 * readtime, explained['estimated_time'])
+        self.assertAlmostEqual(2 * (readtime + 0.1) / 10, explained['utilisation'])
+
+if __name__ == '__main__':
+    unittest.main()
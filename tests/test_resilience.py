@@ -0,0 +1,68 @@
+"""Unittests for heatmisercontroller.resilience module"""
+from __future__ import absolute_import
+import unittest
+import logging
+
+from heatmisercontroller.resilience import RetryPolicy, CircuitBreaker
+from heatmisercontroller.resilience import BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+
+class TestRetryPolicy(unittest.TestCase):
+    """Unit tests for retry policy"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_backoff(self):
+        policy = RetryPolicy(4, backoff=0.1, max_backoff=0.3)
+        self.assertEqual([0.1, 0.2, 0.3], [policy.delay(retry) for retry in range(1, 4)])
+        self.assertEqual(0, RetryPolicy(2).delay(1))
+
+    def test_jitter(self):
+        policy = RetryPolicy(3, backoff=0.1, jitter=0.5)
+        for _ in range(20):
+            self.assertTrue(0.1 <= policy.delay(1) <= 0.15)
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Unit tests for circuit breaker"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_time=60)
+
+    def test_opens_after_failures(self):
+        self.breaker.record_failure(0)
+        self.assertTrue(self.breaker.allow(1))
+        self.breaker.record_failure(1)
+        self.assertEqual(BREAKER_OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow(2))
+
+    def test_success_resets(self):
+        self.breaker.record_failure(0)
+        self.breaker.record_success()
+        self.breaker.record_failure(1)
+        self.assertEqual(BREAKER_CLOSED, self.breaker.state)
+
+    def test_probe(self):
+        self.breaker.record_failure(0)
+        self.breaker.record_failure(0)
+        #single probe allowed after reset time
+        self.assertTrue(self.breaker.allow(60))
+        self.assertEqual(BREAKER_HALF_OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow(60))
+        #failed probe opens again
+        self.breaker.record_failure(61)
+        self.assertFalse(self.breaker.allow(100))
+        self.assertTrue(self.breaker.allow(121))
+        self.breaker.record_success()
+        self.assertEqual(BREAKER_CLOSED, self.breaker.state)
+
+    def test_lost_probe(self):
+        self.breaker.record_failure(0)
+        self.breaker.record_failure(0)
+        self.assertTrue(self.breaker.allow(60))
+        #probe that never reports back does not block the device for ever
+        self.assertFalse(self.breaker.is_available(100))
+        self.assertTrue(self.breaker.is_available(120))
+        self.assertTrue(self.breaker.allow(120))
+        self.assertFalse(self.breaker.allow(121))
+
+if __name__ == '__main__':
+    unittest.main()
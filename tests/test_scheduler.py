@@ -32,6 +32,17 @@ class TestSchedulerDayHeat(unittest.TestCase):
         self.assertEqual([24, 0, 12, 24, 0, 12, 24, 0, 12, 24, 0, 12], self.func.pad_schedule([]))
         self.assertEqual([1, 2, 3, 24, 0, 12, 24, 0, 12, 24, 0, 12], self.func.pad_schedule([1, 2, 3]))
 
+    def test_seconds_to_next_item(self):
+        self.assertFalse(self.func.is_known())
+        self.func.set_raw_all([7, 0, 21, 9, 0, 12, 17, 0, 21, 22, 30, 15])
+        self.assertTrue(self.func.is_known())
+        self.assertEqual(3600 - 30, self.func.get_seconds_to_next_item([2, 6, 0, 30]))
+        self.assertEqual(30 * 60, self.func.get_seconds_to_next_item([2, 22, 0, 0]))
+        #wraps to first item of next day, and from sunday to monday
+        self.assertEqual(8.5 * 3600, self.func.get_seconds_to_next_item([7, 22, 30, 0]))
+        self.func.set_raw('tues_heat', self.func.pad_schedule([]))
+        self.assertIsNone(self.func.get_seconds_to_next_item([1, 23, 0, 0]))
+
 class TestSchedulerWeekWater(unittest.TestCase):
     """Tests for week water class"""
     def setUp(self):
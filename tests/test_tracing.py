@@ -0,0 +1,75 @@
+"""Unittests for heatmisercontroller.tracing module"""
+from __future__ import absolute_import
+import unittest
+import logging
+import json
+
+from heatmisercontroller.tracing import Tracer, ChromeTraceExporter, set_tracer, get_tracer, start_span
+from heatmisercontroller.tracing import NOOP_TRACER, NOOP_SPAN, STATUS_OK, STATUS_ERROR
+from .mock_serial import create_network
+
+class TestTracer(unittest.TestCase):
+    """Unit tests for tracer and spans"""
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.exporter = ChromeTraceExporter()
+        self.tracer = Tracer([self.exporter])
+
+    def tearDown(self):
+        set_tracer(None)
+
+    def test_nested_spans(self):
+        with self.tracer.start_span('outer', address=1) as outer:
+            with self.tracer.start_span('inner') as inner:
+                self.assertIs(inner, self.tracer.current_span())
+            self.assertIs(outer, self.tracer.current_span())
+        self.assertIsNone(self.tracer.current_span())
+        self.assertEqual(outer.span_id, inner.parent_id)
+        self.assertEqual(outer.trace_id, inner.trace_id)
+        self.assertIsNone(outer.parent_id)
+        self.assertEqual(STATUS_OK, outer.status)
+        #inner span ends first
+        self.assertEqual(['inner', 'outer'], [event['name'] for event in self.exporter.events])
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.start_span('failing') as span:
+                raise ValueError('bad')
+        self.assertEqual(STATUS_ERROR, span.status)
+        self.assertEqual('ValueError', span.attributes['exception.type'])
+        self.assertIsNone(self.tracer.current_span())
+
+    def test_noop_default(self):
+        self.assertIs(NOOP_TRACER, get_tracer())
+        with start_span('ignored', address=1) as span:
+            span.set_attribute('key', 1)
+        self.assertIs(NOOP_SPAN, span)
+
+    def test_chrome_export(self):
+        with self.tracer.start_span('outer', address=1):
+            pass
+        trace = json.loads(self.exporter.to_json())
+        event = trace['traceEvents'][0]
+        self.assertEqual('X', event['ph'])
+        self.assertEqual('outer', event['name'])
+        self.assertEqual(1, event['args']['address'])
+        self.assertGreaterEqual(event['dur'], 0)
+        self.exporter.clear()
+        self.assertEqual([], self.exporter.events)
+
+    def test_device_read(self):
+        hmn = create_network([1])
+        set_tracer(self.tracer)
+        hmn.adaptor.setresponse([[17], [0, 180]])
+        hmn.C1.read_fields(['setroomtemp', 'airtemp'], 0)
+        names = [event['name'] for event in self.exporter.events]
+        self.assertEqual(2, names.count('read_block'))
+        self.assertEqual(2, names.count('process_payload'))
+        self.assertEqual('read_fields', names[-1])
+        root = self.exporter.events[-1]['args']['span_id']
+        blocks = [event for event in self.exporter.events if event['name'] == 'read_block']
+        self.assertEqual([root, root], [event['args']['parent_id'] for event in blocks])
+        self.assertEqual([18, 38], [event['args']['start'] for event in blocks])
+
+if __name__ == '__main__':
+    unittest.main()